@@ -0,0 +1,330 @@
+"""
+Локальные серверы для бенчмарков без сети: источник медиа (вместо googlevideo и i.ytimg.com)
+и сервер Telegram Bot API, принимающий запросы aiogram, а также сессия бота, отвечающая
+как Bot API без HTTP.
+"""
+
+import asyncio
+import itertools
+import json
+import os
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+from urllib.parse import unquote, urlparse
+
+from aiogram.client.session.base import BaseSession
+from aiohttp import web
+
+# Размер блока, которым серверы отдают и читают данные
+CHUNK_SIZE = 64 * 1024
+
+async def _throttle(size: int, bandwidth: Optional[float]) -> None:
+    """Ограничивает скорость передачи блока (bandwidth - байт/с, None - без ограничения)"""
+    if bandwidth:
+        await asyncio.sleep(size / bandwidth)
+
+class _Server:
+    """Общий запуск и остановка aiohttp-приложения на свободном локальном порту"""
+
+    def __init__(self):
+        self.app = web.Application(client_max_size=4 * 1024 ** 3)
+        self._runner: Optional[web.AppRunner] = None
+        self.url: Optional[str] = None
+
+    async def start(self) -> str:
+        """Запускает сервер и возвращает его адрес"""
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}"
+        return self.url
+
+    async def stop(self) -> None:
+        """Останавливает сервер"""
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+class FakeMediaOrigin(_Server):
+    """
+    Источник медиа: отдает тестовое аудио по ссылкам аудиоформатов (с поддержкой Range,
+    как googlevideo) и тестовую обложку по ссылкам миниатюр.
+    """
+
+    def __init__(self, audio_path: str, thumbnail_path: str,
+                 latency: float = 0.0, bandwidth: Optional[float] = None):
+        """
+        Args:
+            audio_path: Тестовый аудиофайл
+            thumbnail_path: Тестовая обложка
+            latency: Задержка перед ответом (секунды)
+            bandwidth: Скорость отдачи на соединение (байт/с, None - без ограничения)
+        """
+        super().__init__()
+        self._audio_path = audio_path
+        self._audio_size = os.path.getsize(audio_path)
+        with open(thumbnail_path, "rb") as f:
+            self._thumbnail = f.read()
+        self._latency = latency
+        self._bandwidth = bandwidth
+        self.requests = 0
+        self.bytes_sent = 0
+        self.app.router.add_get("/videoplayback/{name}", self._media)
+        self.app.router.add_get("/vi/{video_id}/{name}", self._thumbnail_handler)
+
+    def _parse_range(self, header: Optional[str]):
+        """Разбирает заголовок Range (bytes=start-end)"""
+        if not header or not header.startswith("bytes="):
+            return None
+        start, _, end = header[len("bytes="):].partition("-")
+        start = int(start) if start else 0
+        end = min(int(end), self._audio_size - 1) if end else self._audio_size - 1
+        return start, end
+
+    async def _media(self, request: web.Request) -> web.StreamResponse:
+        self.requests += 1
+        if self._latency:
+            await asyncio.sleep(self._latency)
+
+        byte_range = self._parse_range(request.headers.get("Range"))
+        if byte_range is None:
+            start, end, status = 0, self._audio_size - 1, 200
+        else:
+            start, end = byte_range
+            if start >= self._audio_size:
+                return web.Response(status=416, headers={"Content-Range": f"bytes */{self._audio_size}"})
+            status = 206
+
+        response = web.StreamResponse(status=status)
+        response.content_type = "audio/mp4"
+        response.content_length = end - start + 1
+        response.headers["Accept-Ranges"] = "bytes"
+        if status == 206:
+            response.headers["Content-Range"] = f"bytes {start}-{end}/{self._audio_size}"
+        await response.prepare(request)
+
+        with open(self._audio_path, "rb") as f:
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = f.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                await _throttle(len(chunk), self._bandwidth)
+                await response.write(chunk)
+                remaining -= len(chunk)
+                self.bytes_sent += len(chunk)
+        await response.write_eof()
+        return response
+
+    async def _thumbnail_handler(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        if self._latency:
+            await asyncio.sleep(self._latency)
+        return web.Response(body=self._thumbnail, content_type="image/jpeg")
+
+class BotAPIResponder:
+    """
+    Ответы Telegram Bot API для бенчмарков: правдоподобные объекты Message для методов отправки
+    и редактирования, True для остальных. Фиксирует время получения аудио по чатам
+    и последние клавиатуры результатов поиска (для сценариев с нажатием кнопок).
+    """
+
+    BOT_USER = {"id": 100000001, "is_bot": True, "first_name": "Benchmark Bot", "username": "benchmark_bot"}
+
+    def __init__(self, latency: float = 0.0, upload_bandwidth: Optional[float] = None):
+        """
+        Args:
+            latency: Задержка ответа на каждый запрос (секунды)
+            upload_bandwidth: Скорость приема загружаемых файлов (байт/с, None - без ограничения)
+        """
+        self.latency = latency
+        self.upload_bandwidth = upload_bandwidth
+        self._message_ids = itertools.count(1)
+        self._file_ids = itertools.count(1)
+        # Ожидающие аудио: chat_id -> future со временем получения
+        self._audio_waiters: Dict[int, asyncio.Future] = {}
+        # Последнее сообщение с кнопками в чате: (chat_id, topic_id) -> (message_id, callback_data кнопок)
+        self.keyboards: Dict[Tuple[int, Optional[int]], Tuple[int, List[str]]] = {}
+        self.calls: Dict[str, int] = {}
+        self.bytes_received = 0
+
+    def expect_audio(self, chat_id: int) -> asyncio.Future:
+        """
+        Возвращает future, который завершится (time.perf_counter) при получении аудио для чата
+
+        Args:
+            chat_id: ID чата
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._audio_waiters[chat_id] = future
+        return future
+
+    async def receive_file(self, chunks: AsyncIterator[bytes]) -> int:
+        """Читает загружаемый файл целиком, как это делает Telegram, и возвращает его размер"""
+        size = 0
+        async for chunk in chunks:
+            await _throttle(len(chunk), self.upload_bandwidth)
+            size += len(chunk)
+        self.bytes_received += size
+        return size
+
+    def _chat(self, chat_id: Any) -> Dict[str, Any]:
+        chat_id = int(chat_id or 0)
+        if chat_id < 0:
+            return {"id": chat_id, "type": "supergroup", "title": "Benchmark Group"}
+        return {"id": chat_id, "type": "private", "first_name": "Bench"}
+
+    def _message(self, params: Dict[str, Any], **fields: Any) -> Dict[str, Any]:
+        message_id = int(params.get("message_id") or next(self._message_ids))
+        message = {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": self._chat(params.get("chat_id")),
+            "from": self.BOT_USER,
+        }
+        topic_id = int(params["message_thread_id"]) if params.get("message_thread_id") else None
+        if topic_id:
+            message["message_thread_id"] = topic_id
+        if params.get("text"):
+            message["text"] = params["text"]
+        if params.get("reply_markup"):
+            markup = json.loads(params["reply_markup"])
+            message["reply_markup"] = markup
+            callbacks = [
+                button["callback_data"]
+                for row in markup.get("inline_keyboard") or []
+                for button in row if button.get("callback_data")
+            ]
+            if callbacks:
+                self.keyboards[(message["chat"]["id"], topic_id)] = (message_id, callbacks)
+        message.update(fields)
+        return message
+
+    def _audio_size(self, params: Dict[str, Any], audio: str) -> int:
+        """Размер отправленного аудио: загруженный файл или локальный файл (file://)"""
+        if audio.startswith("attach://"):
+            return params.get(audio, 0)
+        if audio.startswith("file://"):
+            path = unquote(urlparse(audio).path)
+            return os.path.getsize(path) if os.path.exists(path) else 0
+        return 0
+
+    def _audio_message(self, params: Dict[str, Any], audio: Dict[str, Any]) -> Dict[str, Any]:
+        """Сообщение с аудио (audio - параметры sendAudio или элемент media в sendMediaGroup)"""
+        file_number = next(self._file_ids)
+        reference = audio.get("audio") or audio.get("media") or ""
+        return self._message(params, audio={
+            "file_id": f"BENCHAUDIO{file_number:08d}",
+            "file_unique_id": f"BENCHU{file_number:08d}",
+            "duration": int(audio.get("duration") or 0),
+            "title": audio.get("title"),
+            "performer": audio.get("performer"),
+            "file_size": self._audio_size(params, reference),
+            "mime_type": "audio/mpeg",
+        })
+
+    def _audio_received(self, params: Dict[str, Any]) -> None:
+        """Завершает ожидание аудио в чате"""
+        waiter = self._audio_waiters.pop(int(params.get("chat_id") or 0), None)
+        if waiter is not None and not waiter.done():
+            waiter.set_result(time.perf_counter())
+
+    async def respond(self, method: str, params: Dict[str, Any]) -> Any:
+        """
+        Возвращает результат метода Bot API
+
+        Args:
+            method: Имя метода
+            params: Параметры запроса (строки, как в multipart-форме; файлы - attach://имя -> размер)
+        """
+        method = method.lower()
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if method == "getme":
+            return self.BOT_USER
+        if method == "sendaudio":
+            result = self._audio_message(params, params)
+            self._audio_received(params)
+            return result
+        if method == "sendmediagroup":
+            # Альбом из аудио: сообщение на каждый трек
+            result = [self._audio_message(params, item) for item in json.loads(params.get("media") or "[]")]
+            self._audio_received(params)
+            return result
+        if method in ("sendmessage", "editmessagetext", "editmessagereplymarkup", "editmessagecaption"):
+            return self._message(params)
+        # deleteMessage, answerCallbackQuery, setMyCommands, deleteWebhook и т.п.
+        return True
+
+class FakeBotAPI(_Server):
+    """Сервер Telegram Bot API: принимает запросы aiogram (multipart) по HTTP"""
+
+    def __init__(self, responder: BotAPIResponder):
+        super().__init__()
+        self.responder = responder
+        self.app.router.add_post("/bot{token}/{method}", self._handle)
+
+    async def _read_params(self, request: web.Request) -> Dict[str, Any]:
+        """Читает параметры запроса вместе с загружаемыми файлами"""
+        params: Dict[str, Any] = {}
+        if request.content_type == "multipart/form-data":
+            reader = await request.multipart()
+            async for part in reader:
+                if part.filename:
+                    params[f"attach://{part.name}"] = await self.responder.receive_file(_iter_part(part))
+                else:
+                    params[part.name] = await part.text()
+        elif request.can_read_body:
+            params.update(await request.post())
+        return params
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        params = await self._read_params(request)
+        result = await self.responder.respond(request.match_info["method"], params)
+        return web.json_response({"ok": True, "result": result})
+
+async def _iter_part(part) -> AsyncIterator[bytes]:
+    """Блоки загружаемого файла из части multipart-запроса"""
+    while True:
+        chunk = await part.read_chunk(CHUNK_SIZE)
+        if not chunk:
+            break
+        yield chunk
+
+class MockBotSession(BaseSession):
+    """
+    Сессия бота без HTTP: запросы aiogram обрабатываются BotAPIResponder в том же процессе.
+    Параметры готовятся так же, как для multipart-запроса, загружаемые файлы читаются целиком.
+    """
+
+    def __init__(self, responder: BotAPIResponder):
+        super().__init__()
+        self.responder = responder
+
+    async def make_request(self, bot, method, timeout: Optional[int] = None):
+        files: Dict[str, Any] = {}
+        params: Dict[str, Any] = {}
+        for key, value in method.model_dump(warnings=False).items():
+            value = self.prepare_value(value, bot=bot, files=files)
+            if value:
+                params[key] = value
+        for name, input_file in files.items():
+            params[f"attach://{name}"] = await self.responder.receive_file(input_file.read(bot))
+
+        result = await self.responder.respond(method.__api_method__, params)
+        response = self.check_response(
+            bot=bot, method=method, status_code=200, content=json.dumps({"ok": True, "result": result})
+        )
+        return response.result
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        raise NotImplementedError("Скачивание файлов Telegram в бенчмарках не используется")
+        yield b""  # pragma: no cover
+
+    async def close(self) -> None:
+        pass
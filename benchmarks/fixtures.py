@@ -0,0 +1,138 @@
+"""
+Фикстуры бенчмарков: тестовое аудио и обложка (генерируются ffmpeg), info dict видео,
+указывающие на локальный сервер-источник, и записанные результаты поиска YouTube Music.
+"""
+
+import copy
+import json
+import os
+import subprocess
+import time
+from typing import Any, Dict, List
+
+import imageio_ffmpeg
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+# Записанные ответы YTMusic.search (в разобранном ytmusicapi виде) по поисковым запросам
+SEARCH_FIXTURES_PATH = os.path.join(FIXTURES_DIR, "search_results.json")
+
+# Размер тестового аудиофайла, сопоставимый с обычным треком
+FIXTURE_AUDIO_DURATION = 180
+FIXTURE_AUDIO_BITRATE = 128
+
+def make_audio_fixture(directory: str, duration: int = FIXTURE_AUDIO_DURATION) -> str:
+    """
+    Создает тестовый аудиофайл AAC в m4a (как формат 140 YouTube)
+
+    Args:
+        directory: Директория для файла
+        duration: Длительность в секундах
+
+    Returns:
+        str: Путь к файлу
+    """
+    path = os.path.join(directory, f"fixture_{duration}s.m4a")
+    if not os.path.exists(path):
+        subprocess.run(
+            [imageio_ffmpeg.get_ffmpeg_exe(), "-hide_banner", "-loglevel", "error", "-y",
+             "-f", "lavfi", "-i", f"sine=frequency=440:duration={duration}",
+             "-f", "lavfi", "-i", f"anoisesrc=color=pink:amplitude=0.05:duration={duration}",
+             "-filter_complex", "amix=inputs=2", "-ac", "2", "-ar", "44100",
+             "-c:a", "aac", "-b:a", f"{FIXTURE_AUDIO_BITRATE}k", path],
+            check=True,
+        )
+    return path
+
+def make_thumbnail_fixture(directory: str) -> str:
+    """
+    Создает тестовую обложку в размере миниатюры YouTube (480x360)
+
+    Args:
+        directory: Директория для файла
+
+    Returns:
+        str: Путь к файлу
+    """
+    path = os.path.join(directory, "fixture_thumbnail.jpg")
+    if not os.path.exists(path):
+        subprocess.run(
+            [imageio_ffmpeg.get_ffmpeg_exe(), "-hide_banner", "-loglevel", "error", "-y",
+             "-f", "lavfi", "-i", "testsrc=size=480x360", "-frames:v", "1", path],
+            check=True,
+        )
+    return path
+
+def make_video_id(index: int) -> str:
+    """Возвращает детерминированный ID видео в формате YouTube (11 символов)"""
+    return f"bench{index:06d}"
+
+def build_video_info(video_id: str, origin_url: str, audio_path: str, duration: int) -> Dict[str, Any]:
+    """
+    Собирает info dict видео в том виде, в каком его возвращает экстрактор YouTube,
+    с единственным аудиоформатом, который отдает локальный сервер-источник
+
+    Args:
+        video_id: ID видео
+        origin_url: Адрес сервера-источника
+        audio_path: Путь к тестовому аудиофайлу (для размера)
+        duration: Длительность трека в секундах
+
+    Returns:
+        dict: Info dict для yt-dlp
+    """
+    # Подписанные ссылки YouTube содержат срок действия - кэш метаданных учитывает его
+    expire = int(time.time()) + 6 * 60 * 60
+    webpage_url = f"https://www.youtube.com/watch?v={video_id}"
+    return {
+        "id": video_id,
+        "title": f"Benchmark Track {video_id}",
+        "artist": "Benchmark Artist",
+        "track": f"Benchmark Track {video_id}",
+        "album": "Benchmarks",
+        "channel": "Benchmark Channel",
+        "uploader": "Benchmark Channel",
+        "duration": duration,
+        "thumbnail": f"{origin_url}/vi/{video_id}/hqdefault.jpg",
+        "webpage_url": webpage_url,
+        "original_url": webpage_url,
+        "extractor": "youtube",
+        "extractor_key": "Youtube",
+        "formats": [{
+            "format_id": "140",
+            "url": f"{origin_url}/videoplayback/{video_id}.m4a?expire={expire}&itag=140",
+            "ext": "m4a",
+            "acodec": "mp4a.40.2",
+            "vcodec": "none",
+            "abr": FIXTURE_AUDIO_BITRATE,
+            "asr": 44100,
+            "audio_channels": 2,
+            "protocol": "https",
+            "filesize": os.path.getsize(audio_path),
+            "http_headers": {"User-Agent": "Mozilla/5.0"},
+        }],
+    }
+
+def load_search_fixtures(origin_url: str) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Загружает записанные результаты поиска; ссылки на обложки переводятся на сервер-источник
+
+    Args:
+        origin_url: Адрес сервера-источника
+
+    Returns:
+        dict: Поисковый запрос -> результаты YTMusic.search
+    """
+    with open(SEARCH_FIXTURES_PATH, encoding="utf-8") as f:
+        fixtures = json.load(f)
+    for results in fixtures.values():
+        for result in results:
+            for thumbnail in result.get("thumbnails") or []:
+                thumbnail["url"] = f"{origin_url}/vi/{result['videoId']}/hqdefault.jpg"
+    return fixtures
+
+def search_results_for(fixtures: Dict[str, List[Dict[str, Any]]], query: str) -> List[Dict[str, Any]]:
+    """Возвращает копию записанных результатов для запроса (неизвестные запросы получают результаты первого)"""
+    key = query.strip().lower()
+    results = fixtures.get(key) or next(iter(fixtures.values()))
+    return copy.deepcopy(results)
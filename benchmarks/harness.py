@@ -0,0 +1,304 @@
+"""
+Окружение бенчмарков: поднимает локальный источник медиа и сервер Bot API (или сессию бота
+без сети), настраивает бота на работу с ними через переменные окружения и импортирует
+настоящие модули бота.
+
+YouTube заменяется так же, как это делает сам бот при повторной загрузке: info dict видео
+со ссылкой на локальный источник кладется в кэш метаданных, и yt-dlp выполняет выбор формата,
+загрузку и постобработку без обращения к экстрактору. Поиск YouTube Music получает записанные
+результаты вместо сетевых запросов.
+"""
+
+import asyncio
+import datetime
+import itertools
+import logging
+import math
+import os
+import shutil
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+from benchmarks.fake_servers import BotAPIResponder, FakeBotAPI, FakeMediaOrigin, MockBotSession
+from benchmarks.fixtures import (
+    build_video_info, load_search_fixtures, make_audio_fixture, make_thumbnail_fixture, make_video_id,
+    search_results_for
+)
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Способы связи бота с Bot API: HTTP-сервер или сессия без сети в том же процессе
+SESSION_MODES = ("http", "mock")
+
+# Токен бота для сервера Bot API бенчмарков
+BENCH_BOT_TOKEN = "100000001:BENCHMARK-TOKEN"
+
+def percentile(values: List[float], percent: float) -> Optional[float]:
+    """Возвращает перцентиль по методу ближайшего ранга"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(percent / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+def summarize(latencies: List[float], errors: int, wall_time: float) -> Dict[str, Any]:
+    """
+    Сводка прогона: пропускная способность и перцентили времени ответа
+
+    Args:
+        latencies: Время выполнения успешных запросов (секунды)
+        errors: Количество ошибок
+        wall_time: Общее время прогона (секунды)
+    """
+    return {
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "wall_time": wall_time,
+        "throughput": len(latencies) / wall_time if wall_time > 0 else 0.0,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+        "max": max(latencies) if latencies else None,
+    }
+
+class BenchmarkEnvironment:
+    """
+    Бот, подключенный к локальным серверам вместо YouTube и Telegram.
+
+    Модули бота импортируются в start() после настройки переменных окружения
+    (config читает их при импорте), поэтому окружение создается один раз на процесс.
+    """
+
+    def __init__(self, track_duration: int = 180, origin_latency: float = 0.0,
+                 origin_bandwidth: Optional[float] = None, bot_api_latency: float = 0.0,
+                 upload_bandwidth: Optional[float] = None, search_latency: float = 0.0,
+                 env: Optional[Dict[str, str]] = None, keep_workdir: bool = False,
+                 session_mode: str = "http"):
+        """
+        Args:
+            track_duration: Длительность тестового трека (секунды)
+            origin_latency: Задержка ответа источника медиа (секунды)
+            origin_bandwidth: Скорость отдачи источника на соединение (байт/с)
+            bot_api_latency: Задержка ответа сервера Bot API (секунды)
+            upload_bandwidth: Скорость приема файлов сервером Bot API (байт/с)
+            search_latency: Время ответа поиска YouTube Music (секунды, блокирует как настоящий клиент)
+            env: Дополнительные переменные окружения бота
+            keep_workdir: Не удалять рабочую директорию после завершения
+            session_mode: Связь с Bot API - "http" (локальный сервер) или "mock" (без сети)
+        """
+        if session_mode not in SESSION_MODES:
+            raise ValueError(f"Неизвестный режим сессии: {session_mode}")
+        self.track_duration = track_duration
+        self._origin_latency = origin_latency
+        self._origin_bandwidth = origin_bandwidth
+        self._search_latency = search_latency
+        self._env = env or {}
+        self._keep_workdir = keep_workdir
+        self._session_mode = session_mode
+
+        self.workdir = tempfile.mkdtemp(prefix="ytaudio-bench-")
+        self.responder = BotAPIResponder(bot_api_latency, upload_bandwidth)
+        self.origin: Optional[FakeMediaOrigin] = None
+        self.bot_api: Optional[FakeBotAPI] = None
+        self.bot = None
+        self.dispatcher = None
+        self.search_fixtures: Dict[str, List[Dict[str, Any]]] = {}
+        self._audio_path: Optional[str] = None
+        self._video_numbers = itertools.count(1)
+        self._update_ids = itertools.count(1)
+        self._previous_cwd = os.getcwd()
+
+    async def start(self) -> None:
+        """Готовит фикстуры, запускает серверы и инициализирует бота"""
+        fixtures_dir = os.path.join(self.workdir, "fixtures")
+        os.makedirs(fixtures_dir)
+        self._audio_path = await asyncio.to_thread(make_audio_fixture, fixtures_dir, self.track_duration)
+        thumbnail_path = await asyncio.to_thread(make_thumbnail_fixture, fixtures_dir)
+
+        self.origin = FakeMediaOrigin(self._audio_path, thumbnail_path,
+                                      self._origin_latency, self._origin_bandwidth)
+        origin_url = await self.origin.start()
+        self.search_fixtures = load_search_fixtures(origin_url)
+
+        # config читает настройки при импорте: директория загрузок создается в текущей директории
+        bot_env = {
+            "BOT_TOKEN": BENCH_BOT_TOKEN,
+            "DATA_DIR": os.path.join(self.workdir, "data"),
+            "METRICS_ENABLED": "false",
+        }
+        if self._session_mode == "http":
+            self.bot_api = FakeBotAPI(self.responder)
+            bot_env["TELEGRAM_API_SERVER"] = await self.bot_api.start()
+            bot_env["TELEGRAM_API_LOCAL"] = "false"
+        os.environ.update({**bot_env, **self._env})
+        os.chdir(self.workdir)
+        if REPO_DIR not in sys.path:
+            sys.path.insert(0, REPO_DIR)
+
+        from aiogram import Bot, Dispatcher
+        from aiogram.client.default import DefaultBotProperties
+        from aiogram.enums import ParseMode
+        from aiogram.fsm.storage.memory import MemoryStorage
+        from ytmusicapi import YTMusic
+
+        from handlers import routers
+        from services.bot_api import create_bot_session
+        from services.ydl_engine import ydl_engine
+
+        self._patch_search(YTMusic)
+        ydl_engine.start()
+
+        session = create_bot_session() if self._session_mode == "http" else MockBotSession(self.responder)
+        self.bot = Bot(token=BENCH_BOT_TOKEN, session=session,
+                       default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+        self.dispatcher = Dispatcher(storage=MemoryStorage())
+        for router in routers:
+            self.dispatcher.include_router(router)
+
+        # Видео из записанных результатов поиска доступны для скачивания кнопками
+        for results in self.search_fixtures.values():
+            for result in results:
+                if result.get("videoId"):
+                    self.publish_video(result["videoId"])
+
+    def _patch_search(self, ytmusic_class) -> None:
+        """Подменяет сетевой поиск YouTube Music записанными результатами"""
+        fixtures = self.search_fixtures
+        latency = self._search_latency
+
+        def search(_self, query, filter=None, scope=None, limit=20, ignore_spelling=False):
+            if latency:
+                # Настоящий клиент выполняет синхронный HTTP-запрос
+                time.sleep(latency)
+            return search_results_for(fixtures, query)[:limit]
+
+        ytmusic_class.search = search
+
+    async def stop(self) -> None:
+        """Останавливает бота и серверы и удаляет рабочую директорию"""
+        from services.ranged_download import ranged_downloader
+        from services.search_executor import search_executor
+        from services.thumbnails import thumbnail_service
+        from services.ydl_engine import ydl_engine
+
+        # Обработчики продолжают работу после отправки аудио (удаляют сообщение о загрузке) -
+        # дожидаемся их, пока серверы еще запущены
+        pending = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        if pending:
+            await asyncio.wait(pending, timeout=30)
+
+        if self.bot is not None:
+            await self.bot.session.close()
+        await thumbnail_service.close()
+        await ranged_downloader.close()
+        ydl_engine.shutdown()
+        search_executor.shutdown()
+        if self.origin is not None:
+            await self.origin.stop()
+        if self.bot_api is not None:
+            await self.bot_api.stop()
+        os.chdir(self._previous_cwd)
+        if not self._keep_workdir:
+            shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def publish_video(self, video_id: str) -> str:
+        """
+        Публикует видео на источнике (для бота - как уже извлеченное YouTube)
+
+        Args:
+            video_id: ID видео
+
+        Returns:
+            str: Ссылка на видео YouTube
+        """
+        from services.metadata_cache import metadata_cache
+        from services.ydl_engine import compact_info
+
+        info = build_video_info(video_id, self.origin.url, self._audio_path, self.track_duration)
+        metadata_cache.put_info(video_id, compact_info(info))
+        return f"https://www.youtube.com/watch?v={video_id}"
+
+    def new_video(self) -> str:
+        """Публикует новое видео на источнике и возвращает ссылку на него"""
+        return self.publish_video(make_video_id(next(self._video_numbers)))
+
+    def _chat(self, chat_id: int, topic_id: Optional[int]):
+        """Чат апдейта: личный (chat_id > 0) или супергруппа (с темами, если указан topic_id)"""
+        from aiogram.types import Chat
+
+        if chat_id > 0:
+            return Chat(id=chat_id, type="private")
+        return Chat(id=chat_id, type="supergroup", title=f"Group {abs(chat_id)}",
+                    is_forum=True if topic_id else None)
+
+    def message_update(self, chat_id: int, text: str, user_id: Optional[int] = None,
+                       topic_id: Optional[int] = None):
+        """Создает апдейт с текстовым сообщением пользователя (в теме topic_id, если указана)"""
+        from aiogram.types import Message, Update, User
+
+        user_id = user_id or abs(chat_id)
+        update_id = next(self._update_ids)
+        return Update(
+            update_id=update_id,
+            message=Message(
+                message_id=update_id,
+                date=datetime.datetime.now(datetime.timezone.utc),
+                chat=self._chat(chat_id, topic_id),
+                message_thread_id=topic_id,
+                is_topic_message=True if topic_id else None,
+                from_user=User(id=user_id, is_bot=False, first_name=f"User{user_id}"),
+                text=text,
+            ),
+        )
+
+    def callback_update(self, chat_id: int, data: str, message_id: int, user_id: Optional[int] = None,
+                        topic_id: Optional[int] = None):
+        """Создает апдейт с нажатием inline-кнопки под сообщением бота"""
+        from aiogram.types import CallbackQuery, Message, Update, User
+
+        user_id = user_id or abs(chat_id)
+        update_id = next(self._update_ids)
+        return Update(
+            update_id=update_id,
+            callback_query=CallbackQuery(
+                id=str(update_id),
+                from_user=User(id=user_id, is_bot=False, first_name=f"User{user_id}"),
+                chat_instance=str(chat_id),
+                data=data,
+                message=Message(
+                    message_id=message_id,
+                    date=datetime.datetime.now(datetime.timezone.utc),
+                    chat=self._chat(chat_id, topic_id),
+                    message_thread_id=topic_id,
+                    is_topic_message=True if topic_id else None,
+                    from_user=User(**BotAPIResponder.BOT_USER),
+                    text="Результаты поиска",
+                ),
+            ),
+        )
+
+    async def send_link(self, chat_id: int, url: str, timeout: float = 300.0) -> float:
+        """
+        Отправляет боту ссылку и ждет, пока аудио придет на сервер Bot API
+
+        Args:
+            chat_id: ID чата (у каждого одновременного запроса свой)
+            url: Ссылка на видео
+            timeout: Максимальное время ожидания (секунды)
+
+        Returns:
+            float: Время до получения аудио (секунды)
+        """
+        waiter = self.responder.expect_audio(chat_id)
+        started = time.perf_counter()
+        await self.dispatcher.feed_update(self.bot, self.message_update(chat_id, url))
+        finished = await asyncio.wait_for(waiter, timeout)
+        return finished - started
+
+def quiet_logging(verbose: bool) -> None:
+    """Оставляет в выводе бенчмарка только предупреждения бота (или все сообщения с verbose)"""
+    logging.getLogger().setLevel(logging.INFO if verbose else logging.WARNING)
+    for name in ("aiogram", "aiohttp.access"):
+        logging.getLogger(name).setLevel(logging.INFO if verbose else logging.ERROR)
@@ -0,0 +1,446 @@
+"""
+Нагрузочный генератор: воспроизводит поток апдейтов от сотен групп, тем и личных чатов
+через Dispatcher.feed_update с роутерами бота и фиксирует время обработки апдейтов,
+задержку цикла событий и рост состояния user_state_manager во времени.
+
+Апдейты приходят по пуассоновскому процессу с заданной интенсивностью независимо от того,
+успевает ли бот их обработать (как long polling под нагрузкой). Состав трафика задается
+весами типов апдейтов.
+
+Запуск из корня репозитория:
+
+    python -m benchmarks.load_generator --duration 60 --rate 50 --groups 300 --topics 4
+    python -m benchmarks.load_generator --mix search=3,page=5,chatter=10,link=1 --output load.json
+
+Типы апдейтов:
+    search   - поисковый запрос (текст в личном чате, /search в группе)
+    page     - переключение страницы результатов поиска кнопкой
+    download - кнопка скачивания трека из результатов поиска
+    link     - ссылка на видео (новое или популярное, см. --repeat-links)
+    chatter  - обычное сообщение в группе, не адресованное боту
+"""
+
+import argparse
+import asyncio
+import gc
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from typing import Any, Dict, List, Optional, Tuple
+
+from benchmarks.harness import SESSION_MODES, BenchmarkEnvironment, percentile, quiet_logging
+
+UPDATE_KINDS = ("search", "page", "download", "link", "chatter")
+
+DEFAULT_MIX = "search=3,page=4,download=1,link=1,chatter=6"
+
+# Фразы для обычных сообщений в группах
+CHATTER = ("всем привет", "кто что слушает?", "скиньте что-нибудь новое", "ахаха", "согласен", "ок")
+
+def parse_mix(value: str) -> Dict[str, float]:
+    """
+    Разбирает состав трафика вида "search=3,page=4" в нормированные доли
+
+    Raises:
+        ValueError: Неизвестный тип апдейта или нулевая сумма весов
+    """
+    weights: Dict[str, float] = {}
+    for item in value.split(","):
+        if not item.strip():
+            continue
+        kind, _, weight = item.partition("=")
+        kind = kind.strip()
+        if kind not in UPDATE_KINDS:
+            raise ValueError(f"Неизвестный тип апдейта: {kind}")
+        weights[kind] = float(weight or 1)
+    total = sum(weights.values())
+    if total <= 0:
+        raise ValueError("Сумма весов состава трафика должна быть больше нуля")
+    return {kind: weight / total for kind, weight in weights.items() if weight > 0}
+
+def deep_sizeof(obj: Any) -> int:
+    """Приблизительный размер объекта со всем, на что он ссылается (контейнеры и __dict__)"""
+    seen = set()
+    stack = [obj]
+    size = 0
+    while stack:
+        current = stack.pop()
+        if id(current) in seen:
+            continue
+        seen.add(id(current))
+        size += sys.getsizeof(current)
+        if isinstance(current, dict):
+            stack.extend(current.keys())
+            stack.extend(current.values())
+        elif isinstance(current, (list, tuple, set, frozenset)):
+            stack.extend(current)
+        elif hasattr(current, "__dict__") and not isinstance(current, type):
+            stack.append(vars(current))
+    return size
+
+class Population:
+    """
+    Участники нагрузки: группы (с темами или без) и личные чаты со своими пользователями
+    """
+
+    def __init__(self, groups: int, topics: int, private_chats: int, users_per_group: int, seed: Optional[int]):
+        """
+        Args:
+            groups: Количество групп
+            topics: Тем в каждой группе (0 - группы без тем)
+            private_chats: Количество личных чатов
+            users_per_group: Активных пользователей в каждой группе
+            seed: Начальное значение генератора случайных чисел (None - случайное)
+        """
+        self.random = random.Random(seed)
+        self.groups = [-(1_000_000_000_000 + number) for number in range(1, groups + 1)]
+        self.topics = topics
+        self.private_chats = [20_000_000 + number for number in range(1, private_chats + 1)]
+        self.users_per_group = users_per_group
+
+    def user_for(self, chat_id: int) -> int:
+        """Случайный пользователь чата (в личном чате - его владелец)"""
+        if chat_id > 0:
+            return chat_id
+        return 30_000_000 + (abs(chat_id) % 100_000) * self.users_per_group + self.random.randrange(self.users_per_group)
+
+    def pick(self, group_only: bool = False) -> Tuple[int, Optional[int], int]:
+        """
+        Выбирает чат, тему и пользователя для очередного апдейта
+
+        Returns:
+            tuple: (chat_id, topic_id, user_id)
+        """
+        rnd = self.random
+        use_group = group_only or not self.private_chats or (
+            self.groups and rnd.random() < len(self.groups) / (len(self.groups) + len(self.private_chats))
+        )
+        if use_group and self.groups:
+            chat_id = rnd.choice(self.groups)
+            # Темы нумеруются как ID сообщений, создавших их; 1 - общая тема без message_thread_id
+            topic_id = rnd.randrange(2, self.topics + 2) if self.topics else None
+            return chat_id, topic_id, self.user_for(chat_id)
+        chat_id = rnd.choice(self.private_chats)
+        return chat_id, None, chat_id
+
+class LoadRecorder:
+    """Время обработки апдейтов, задержка цикла событий и выборки состояния во времени"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {kind: [] for kind in UPDATE_KINDS}
+        self.errors: Dict[str, List[str]] = {kind: [] for kind in UPDATE_KINDS}
+        self.loop_lag: List[float] = []
+        self.samples: List[Dict[str, Any]] = []
+        self.inflight = 0
+        self.sent = 0
+
+    def summary(self) -> Dict[str, Any]:
+        kinds = {}
+        for kind in UPDATE_KINDS:
+            latencies = self.latencies[kind]
+            errors = self.errors[kind]
+            if not latencies and not errors:
+                continue
+            kinds[kind] = {
+                "updates": len(latencies) + len(errors),
+                "errors": len(errors),
+                "p50": percentile(latencies, 50),
+                "p95": percentile(latencies, 95),
+                "p99": percentile(latencies, 99),
+                "max": max(latencies) if latencies else None,
+            }
+            if errors:
+                kinds[kind]["first_error"] = errors[0]
+        return {
+            "updates_sent": self.sent,
+            "kinds": kinds,
+            "loop_lag": {
+                "p50": percentile(self.loop_lag, 50),
+                "p99": percentile(self.loop_lag, 99),
+                "max": max(self.loop_lag) if self.loop_lag else None,
+            },
+            "samples": self.samples,
+        }
+
+class LoadGenerator:
+    """Открытая нагрузка апдейтами через Dispatcher.feed_update"""
+
+    def __init__(self, environment: BenchmarkEnvironment, population: Population, mix: Dict[str, float],
+                 rate: float, repeat_links: float):
+        """
+        Args:
+            environment: Запущенное окружение бенчмарка
+            population: Участники нагрузки
+            mix: Доли типов апдейтов
+            rate: Средняя интенсивность апдейтов (в секунду)
+            repeat_links: Доля ссылок на уже отправленные видео (попадание в кэш file_id)
+        """
+        self.environment = environment
+        self.population = population
+        self.kinds = list(mix)
+        self.weights = [mix[kind] for kind in self.kinds]
+        self.rate = rate
+        self.repeat_links = repeat_links
+        self.queries = list(environment.search_fixtures)
+        self.recorder = LoadRecorder()
+        self._linked_videos: List[str] = []
+        self._tasks: set = set()
+
+    def _button_press(self, prefix: str):
+        """
+        Нажатие случайной кнопки с заданным префиксом под результатами поиска, уже показанными
+        в одном из чатов (None - таких результатов еще нет)
+        """
+        rnd = self.population.random
+        keyboards = self.environment.responder.keyboards
+        if not keyboards:
+            return None
+        chat_id, topic_id = rnd.choice(list(keyboards))
+        message_id, callbacks = keyboards[(chat_id, topic_id)]
+        matching = [data for data in callbacks if data.startswith(prefix)]
+        if not matching:
+            return None
+        user_id = self.population.user_for(chat_id)
+        return self.environment.callback_update(chat_id, rnd.choice(matching), message_id, user_id, topic_id)
+
+    def _make_update(self, kind: str):
+        """
+        Создает апдейт заданного типа. Кнопки нажимаются под результатами поиска, уже показанными
+        в чатах, - пока их нет, вместо нажатия отправляется поисковый запрос.
+
+        Returns:
+            tuple: (фактический тип, апдейт)
+        """
+        environment = self.environment
+        rnd = self.population.random
+
+        if kind in ("page", "download"):
+            update = self._button_press("search_" if kind == "page" else "download:")
+            if update is not None:
+                return kind, update
+            kind = "search"
+
+        chat_id, topic_id, user_id = self.population.pick(group_only=kind == "chatter")
+        is_group = chat_id < 0
+        if kind == "search":
+            query = rnd.choice(self.queries)
+            text = f"/search {query}" if is_group else query
+        elif kind == "link":
+            if self._linked_videos and rnd.random() < self.repeat_links:
+                text = rnd.choice(self._linked_videos)
+            else:
+                text = environment.new_video()
+                self._linked_videos.append(text)
+        else:
+            text = rnd.choice(CHATTER)
+        return kind, environment.message_update(chat_id, text, user_id, topic_id)
+
+    async def _feed(self, kind: str, update) -> None:
+        """Обрабатывает апдейт и фиксирует время до возврата из feed_update"""
+        recorder = self.recorder
+        recorder.inflight += 1
+        started = time.perf_counter()
+        try:
+            await self.environment.dispatcher.feed_update(self.environment.bot, update)
+            recorder.latencies[kind].append(time.perf_counter() - started)
+        except Exception as e:
+            recorder.errors[kind].append(f"{type(e).__name__}: {e}")
+        finally:
+            recorder.inflight -= 1
+
+    async def _monitor_loop_lag(self, interval: float) -> None:
+        """Измеряет, насколько позже запланированного просыпается корутина"""
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(interval)
+            self.recorder.loop_lag.append(max(0.0, time.perf_counter() - started - interval))
+
+    def _sample_state(self, elapsed: float, trace_memory: bool) -> Dict[str, Any]:
+        """Выборка состояния бота: размер user_state_manager, память процесса, очередь загрузок"""
+        from services.scheduler import download_scheduler
+        from services.user_state import user_state_manager
+
+        recorder = self.recorder
+        recent_lag = recorder.loop_lag[-50:]
+        sample = {
+            "elapsed": round(elapsed, 2),
+            "updates_sent": recorder.sent,
+            "inflight_updates": recorder.inflight,
+            "queued_downloads": download_scheduler.queued,
+            "loop_lag_max": max(recent_lag) if recent_lag else 0.0,
+            "user_states": len(user_state_manager._user_states),
+            "request_counters": len(user_state_manager._request_counters),
+            "message_search_results": len(user_state_manager._message_search_results),
+            "user_state_bytes": deep_sizeof(user_state_manager),
+        }
+        if trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            sample["traced_bytes"] = current
+            sample["traced_peak_bytes"] = peak
+        return sample
+
+    async def _sample_periodically(self, interval: float, started: float, trace_memory: bool) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            self.recorder.samples.append(self._sample_state(time.perf_counter() - started, trace_memory))
+
+    async def run(self, duration: float, sample_interval: float, lag_interval: float,
+                  trace_memory: bool) -> Dict[str, Any]:
+        """
+        Подает апдейты в течение duration секунд и дожидается их обработки
+
+        Args:
+            duration: Длительность подачи нагрузки (секунды)
+            sample_interval: Период выборок состояния (секунды)
+            lag_interval: Период измерения задержки цикла событий (секунды)
+            trace_memory: Отслеживать выделения памяти через tracemalloc
+        """
+        rnd = self.population.random
+        started = time.perf_counter()
+        self.recorder.samples.append(self._sample_state(0.0, trace_memory))
+        monitors = [
+            asyncio.create_task(self._monitor_loop_lag(lag_interval)),
+            asyncio.create_task(self._sample_periodically(sample_interval, started, trace_memory)),
+        ]
+        try:
+            next_arrival = started
+            while True:
+                next_arrival += rnd.expovariate(self.rate)
+                if next_arrival - started >= duration:
+                    break
+                delay = next_arrival - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                kind, update = self._make_update(rnd.choices(self.kinds, self.weights)[0])
+                task = asyncio.create_task(self._feed(kind, update))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+                self.recorder.sent += 1
+            if self._tasks:
+                await asyncio.wait(list(self._tasks))
+        finally:
+            for monitor in monitors:
+                monitor.cancel()
+            await asyncio.gather(*monitors, return_exceptions=True)
+
+        gc.collect()
+        self.recorder.samples.append(self._sample_state(time.perf_counter() - started, trace_memory))
+        summary = self.recorder.summary()
+        summary["wall_time"] = time.perf_counter() - started
+        return summary
+
+def format_seconds(value: Optional[float]) -> str:
+    return "-" if value is None else f"{value * 1000:9.1f} мс"
+
+def format_bytes(value: int) -> str:
+    return f"{value / 1024:9.1f} КБ"
+
+def print_report(summary: Dict[str, Any]) -> None:
+    """Печатает время обработки по типам апдейтов и динамику состояния"""
+    print()
+    print(f"Апдейтов отправлено: {summary['updates_sent']} за {summary['wall_time']:.1f} с")
+    print(f"{'тип':<10} {'апдейты':>8} {'ошибки':>7} {'p50':>12} {'p95':>12} {'p99':>12} {'max':>12}")
+    for kind, stats in summary["kinds"].items():
+        print(f"{kind:<10} {stats['updates']:>8} {stats['errors']:>7} {format_seconds(stats['p50']):>12} "
+              f"{format_seconds(stats['p95']):>12} {format_seconds(stats['p99']):>12} "
+              f"{format_seconds(stats['max']):>12}")
+        if stats.get("first_error"):
+            print(f"{'':<10} первая ошибка: {stats['first_error']}")
+
+    lag = summary["loop_lag"]
+    print(f"\nЗадержка цикла событий: p50 {format_seconds(lag['p50']).strip()}, "
+          f"p99 {format_seconds(lag['p99']).strip()}, max {format_seconds(lag['max']).strip()}")
+
+    print(f"\n{'время, с':>9} {'апдейты':>8} {'в работе':>9} {'лаг max':>12} {'состояния':>10} "
+          f"{'счетчики':>9} {'поиски':>7} {'user_state':>12}")
+    for sample in summary["samples"]:
+        print(f"{sample['elapsed']:>9.1f} {sample['updates_sent']:>8} {sample['inflight_updates']:>9} "
+              f"{format_seconds(sample['loop_lag_max']):>12} {sample['user_states']:>10} "
+              f"{sample['request_counters']:>9} {sample['message_search_results']:>7} "
+              f"{format_bytes(sample['user_state_bytes']):>12}")
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Нагрузочный генератор апдейтов для Dispatcher")
+    parser.add_argument("--duration", type=float, default=60, help="Длительность подачи нагрузки (секунды)")
+    parser.add_argument("--rate", type=float, default=20, help="Средняя интенсивность апдейтов в секунду")
+    parser.add_argument("--mix", default=DEFAULT_MIX,
+                        help=f"Веса типов апдейтов ({', '.join(UPDATE_KINDS)}), по умолчанию {DEFAULT_MIX}")
+    parser.add_argument("--groups", type=int, default=200, help="Количество групп")
+    parser.add_argument("--topics", type=int, default=3, help="Тем в каждой группе (0 - без тем)")
+    parser.add_argument("--private-chats", type=int, default=100, help="Количество личных чатов")
+    parser.add_argument("--users-per-group", type=int, default=20, help="Активных пользователей в группе")
+    parser.add_argument("--repeat-links", type=float, default=0.5,
+                        help="Доля ссылок на уже отправленные видео (0..1)")
+    parser.add_argument("--session", choices=SESSION_MODES, default="mock",
+                        help="Связь с Bot API: mock - без сети, http - локальный сервер")
+    parser.add_argument("--bot-api-latency-ms", type=float, default=0, help="Задержка ответа Bot API")
+    parser.add_argument("--search-latency-ms", type=float, default=0, help="Время ответа поиска YouTube Music")
+    parser.add_argument("--track-duration", type=int, default=60, help="Длительность тестового трека (секунды)")
+    parser.add_argument("--sample-interval", type=float, default=5, help="Период выборок состояния (секунды)")
+    parser.add_argument("--lag-interval", type=float, default=0.05,
+                        help="Период измерения задержки цикла событий (секунды)")
+    parser.add_argument("--tracemalloc", action="store_true",
+                        help="Отслеживать память процесса через tracemalloc (замедляет бота)")
+    parser.add_argument("--seed", type=int, help="Начальное значение генератора случайных чисел")
+    parser.add_argument("--env", action="append", default=[], metavar="NAME=VALUE",
+                        help="Переменная окружения бота (можно указать несколько раз)")
+    parser.add_argument("--output", help="Сохранить результаты в JSON")
+    parser.add_argument("--keep-workdir", action="store_true", help="Не удалять рабочую директорию")
+    parser.add_argument("--verbose", action="store_true", help="Выводить журнал бота")
+    return parser.parse_args(argv)
+
+async def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    try:
+        mix = parse_mix(args.mix)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+    if args.rate <= 0 or args.duration <= 0:
+        print("Интенсивность и длительность должны быть больше нуля", file=sys.stderr)
+        return 2
+    env = dict(item.split("=", 1) for item in args.env)
+
+    environment = BenchmarkEnvironment(
+        track_duration=args.track_duration,
+        bot_api_latency=args.bot_api_latency_ms / 1000,
+        search_latency=args.search_latency_ms / 1000,
+        env=env,
+        keep_workdir=args.keep_workdir,
+        session_mode=args.session,
+    )
+    population = Population(args.groups, args.topics, args.private_chats, args.users_per_group, args.seed)
+    try:
+        await environment.start()
+        quiet_logging(args.verbose)
+        if args.tracemalloc:
+            tracemalloc.start()
+        print(f"Нагрузка {args.rate:g} апдейтов/с в течение {args.duration:g} с: "
+              f"{args.groups} групп x {args.topics} тем, {args.private_chats} личных чатов...", flush=True)
+        generator = LoadGenerator(environment, population, mix, args.rate, args.repeat_links)
+        summary = await generator.run(args.duration, args.sample_interval, args.lag_interval, args.tracemalloc)
+    finally:
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+        await environment.stop()
+
+    print_report(summary)
+    if args.output:
+        report = {
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "settings": {key: value for key, value in vars(args).items() if key != "output"},
+            "bot_api_calls": environment.responder.calls,
+            "results": summary,
+        }
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\nРезультаты сохранены в {args.output}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,209 @@
+"""
+Сквозной бенчмарк без сети: загрузка, поиск и обработка ссылок через роутеры aiogram
+на разных уровнях параллельности.
+
+Запуск из корня репозитория:
+
+    python -m benchmarks.run_e2e --concurrency 1,4,16 --requests 32 --output results.json
+    python -m benchmarks.run_e2e --baseline results.json
+
+Сценарии:
+    download - download_audio_from_youtube для новых видео (загрузка, перекодирование, обложка)
+    search   - search_youtube_music по записанным результатам (кэш поиска выключен, измеряется сам поиск)
+    search_cached - search_youtube_music через кэш поиска с настройками по умолчанию (в основном попадания)
+    link     - ссылка от пользователя через Dispatcher.feed_update до получения аудио сервером Bot API
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import platform
+import sys
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from benchmarks.harness import BenchmarkEnvironment, quiet_logging, summarize
+
+# Настройки бота по умолчанию для бенчмарка (переопределяются через --env)
+DEFAULT_ENV = {
+    # Сценарий search измеряет поиск, а не попадания в кэш; кэш проверяет сценарий search_cached
+    "SEARCH_CACHE_TTL": "0",
+}
+
+SCENARIOS = ("download", "search", "search_cached", "link")
+
+# Метрики сводки, сравниваемые с базовым прогоном (меньше - лучше, кроме throughput)
+COMPARED_METRICS = ("throughput", "p50", "p95", "p99")
+
+async def run_level(make_request: Callable[[int], Awaitable[float]], requests: int, concurrency: int) -> Dict[str, Any]:
+    """
+    Выполняет запросы с заданной параллельностью
+
+    Args:
+        make_request: Корутина запроса по номеру, возвращает время ответа
+        requests: Количество запросов
+        concurrency: Количество одновременно выполняющихся запросов
+    """
+    latencies: List[float] = []
+    errors: List[str] = []
+    numbers = iter(range(requests))
+
+    async def worker():
+        for number in numbers:
+            try:
+                latencies.append(await make_request(number))
+            except Exception as e:
+                errors.append(f"{type(e).__name__}: {e}")
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    summary = summarize(latencies, len(errors), time.perf_counter() - started)
+    if errors:
+        summary["first_error"] = errors[0]
+    return summary
+
+def scenario_factory(environment: BenchmarkEnvironment, scenario: str) -> Callable[[int], Awaitable[float]]:
+    """Возвращает функцию одного запроса сценария"""
+    from services.search_cache import SearchCache
+    from services.youtube import download_audio_from_youtube, release_downloaded_files, search_youtube_music
+    from config import SEARCH_CACHE_STALE_TTL, SEARCH_CACHE_SIZE, SEARCH_CACHE_TRANSLITERATE
+
+    chat_ids = itertools.count(10_000_001)
+    queries = list(environment.search_fixtures)
+
+    async def download(_number: int) -> float:
+        url = environment.new_video()
+        started = time.perf_counter()
+        result = await download_audio_from_youtube(url)
+        elapsed = time.perf_counter() - started
+        await release_downloaded_files(result[0], result[2])
+        return elapsed
+
+    async def search(number: int) -> float:
+        started = time.perf_counter()
+        results = await search_youtube_music(queries[number % len(queries)])
+        if not results:
+            raise RuntimeError("Поиск не вернул результатов")
+        return time.perf_counter() - started
+
+    # Отдельный кэш с TTL по умолчанию: общий кэш бота в бенчмарке выключен
+    cache = SearchCache(600, SEARCH_CACHE_STALE_TTL, SEARCH_CACHE_SIZE, SEARCH_CACHE_TRANSLITERATE)
+
+    async def search_cached(number: int) -> float:
+        started = time.perf_counter()
+        results = await cache.get(queries[number % len(queries)], 0, search_youtube_music)
+        if not results:
+            raise RuntimeError("Поиск не вернул результатов")
+        return time.perf_counter() - started
+
+    async def link(_number: int) -> float:
+        return await environment.send_link(next(chat_ids), environment.new_video())
+
+    return {"download": download, "search": search, "search_cached": search_cached, "link": link}[scenario]
+
+def format_seconds(value: Optional[float]) -> str:
+    return "-" if value is None else f"{value * 1000:8.0f} мс"
+
+def print_report(results: Dict[str, Dict[str, Dict[str, Any]]], baseline: Optional[Dict[str, Any]]) -> None:
+    """Печатает таблицу результатов (и изменение относительно базового прогона)"""
+    print()
+    print(f"{'сценарий':<13} {'паралл.':>7} {'запросы':>8} {'ошибки':>7} {'req/s':>8} "
+          f"{'p50':>11} {'p95':>11} {'p99':>11}")
+    for scenario, levels in results.items():
+        for concurrency, summary in levels.items():
+            print(f"{scenario:<13} {concurrency:>7} {summary['requests']:>8} {summary['errors']:>7} "
+                  f"{summary['throughput']:>8.2f} {format_seconds(summary['p50']):>11} "
+                  f"{format_seconds(summary['p95']):>11} {format_seconds(summary['p99']):>11}")
+            base = ((baseline or {}).get("results") or {}).get(scenario, {}).get(concurrency)
+            if base:
+                changes = []
+                for metric in COMPARED_METRICS:
+                    if summary.get(metric) and base.get(metric):
+                        change = (summary[metric] - base[metric]) / base[metric] * 100
+                        changes.append(f"{metric} {change:+.1f}%")
+                print(f"{'':<13} {'':>7} относительно базового прогона: {', '.join(changes)}")
+            if summary.get("first_error"):
+                print(f"{'':<13} {'':>7} первая ошибка: {summary['first_error']}")
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Сквозной бенчмарк бота без сети")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        help="Сценарии через запятую (download, search, search_cached, link)")
+    parser.add_argument("--concurrency", default="1,4,16", help="Уровни параллельности через запятую")
+    parser.add_argument("--requests", type=int, default=32, help="Запросов на каждый уровень")
+    parser.add_argument("--track-duration", type=int, default=180, help="Длительность тестового трека (секунды)")
+    parser.add_argument("--origin-latency-ms", type=float, default=0, help="Задержка ответа источника медиа")
+    parser.add_argument("--origin-bandwidth-mbps", type=float, default=0,
+                        help="Скорость источника на соединение, Мбит/с (0 - без ограничения)")
+    parser.add_argument("--bot-api-latency-ms", type=float, default=0, help="Задержка ответа сервера Bot API")
+    parser.add_argument("--upload-bandwidth-mbps", type=float, default=0,
+                        help="Скорость приема файлов сервером Bot API, Мбит/с (0 - без ограничения)")
+    parser.add_argument("--search-latency-ms", type=float, default=0, help="Время ответа поиска YouTube Music")
+    parser.add_argument("--env", action="append", default=[], metavar="NAME=VALUE",
+                        help="Переменная окружения бота (можно указать несколько раз)")
+    parser.add_argument("--output", help="Сохранить результаты в JSON")
+    parser.add_argument("--baseline", help="JSON с результатами базового прогона для сравнения")
+    parser.add_argument("--keep-workdir", action="store_true", help="Не удалять рабочую директорию")
+    parser.add_argument("--verbose", action="store_true", help="Выводить журнал бота")
+    return parser.parse_args(argv)
+
+def mbps(value: float) -> Optional[float]:
+    """Мбит/с -> байт/с (0 - без ограничения)"""
+    return value * 1_000_000 / 8 if value else None
+
+async def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    scenarios = [scenario.strip() for scenario in args.scenarios.split(",") if scenario.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        print(f"Неизвестные сценарии: {', '.join(sorted(unknown))}", file=sys.stderr)
+        return 2
+    levels = [int(level) for level in args.concurrency.split(",") if level.strip()]
+    env = {**DEFAULT_ENV, **dict(item.split("=", 1) for item in args.env)}
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    environment = BenchmarkEnvironment(
+        track_duration=args.track_duration,
+        origin_latency=args.origin_latency_ms / 1000,
+        origin_bandwidth=mbps(args.origin_bandwidth_mbps),
+        bot_api_latency=args.bot_api_latency_ms / 1000,
+        upload_bandwidth=mbps(args.upload_bandwidth_mbps),
+        search_latency=args.search_latency_ms / 1000,
+        env=env,
+        keep_workdir=args.keep_workdir,
+    )
+    results: Dict[str, Dict[str, Dict[str, Any]]] = {}
+    try:
+        await environment.start()
+        quiet_logging(args.verbose)
+        for scenario in scenarios:
+            make_request = scenario_factory(environment, scenario)
+            results[scenario] = {}
+            for concurrency in levels:
+                print(f"{scenario}: параллельность {concurrency}, запросов {args.requests}...", flush=True)
+                # JSON сохраняет ключи строками - используем их и здесь для сравнения с базовым прогоном
+                results[scenario][str(concurrency)] = await run_level(make_request, args.requests, concurrency)
+    finally:
+        await environment.stop()
+
+    print_report(results, baseline)
+    if args.output:
+        report = {
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "settings": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+            "results": results,
+        }
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\nРезультаты сохранены в {args.output}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -1,6 +1,6 @@
 import os
 import logging
-from typing import List, Optional
+from typing import Dict, List, Optional
 from dotenv import load_dotenv
 
 # Настройка логирования
@@ -19,10 +19,91 @@ if not BOT_TOKEN:
     logger.error("Не указан BOT_TOKEN в .env файле")
     exit(1)
 
+# Собственный сервер Telegram Bot API (telegram-bot-api). В локальном режиме (--local) бот передает серверу
+# путь к файлу вместо загрузки байтов, а лимит размера файла - 2000 МБ вместо 50 МБ
+TELEGRAM_API_SERVER = os.getenv("TELEGRAM_API_SERVER", "").strip()
+TELEGRAM_API_LOCAL = bool(TELEGRAM_API_SERVER) and os.getenv("TELEGRAM_API_LOCAL", "true").lower() == "true"
+
+# Максимальный размер отправляемого файла (в байтах), по умолчанию - лимит используемого сервера Bot API
+MAX_TELEGRAM_FILE_SIZE = int(
+    os.getenv("TELEGRAM_MAX_FILE_SIZE_MB", "2000" if TELEGRAM_API_LOCAL else "50")
+) * 1024 * 1024
+
 # Создание директории для загрузок, если она не существует
 DOWNLOADS_DIR = os.path.join(os.getcwd(), "downloads")
 os.makedirs(DOWNLOADS_DIR, exist_ok=True)
 
+# Фоновая очистка директории загрузок: интервал проходов (секунды), максимальный возраст файлов (секунды)
+# и отметки свободного места на диске (при нехватке места старые файлы удаляются досрочно)
+JANITOR_INTERVAL = int(os.getenv("JANITOR_INTERVAL", "60"))
+DOWNLOADS_MAX_FILE_AGE = int(os.getenv("DOWNLOADS_MAX_FILE_AGE", "3600"))
+DOWNLOADS_MIN_FREE_BYTES = int(os.getenv("DOWNLOADS_MIN_FREE_MB", "500")) * 1024 * 1024
+DOWNLOADS_TARGET_FREE_BYTES = int(os.getenv("DOWNLOADS_TARGET_FREE_MB", "1000")) * 1024 * 1024
+
+# Директория для постоянных данных бота (не очищается вместе с загрузками)
+DATA_DIR = os.getenv("DATA_DIR", os.path.join(os.getcwd(), "data"))
+os.makedirs(DATA_DIR, exist_ok=True)
+
+# База данных реестра Telegram file_id для повторной отправки треков без скачивания
+FILE_ID_DB_PATH = os.getenv("FILE_ID_DB_PATH", os.path.join(DATA_DIR, "file_ids.sqlite3"))
+
+# Журнал задач загрузки: незавершенные задачи возобновляются после перезапуска бота.
+# Задачи старше JOB_RESUME_MAX_AGE секунд или перезапущенные JOB_RESUME_MAX_ATTEMPTS раз отбрасываются
+JOB_JOURNAL_DB_PATH = os.getenv("JOB_JOURNAL_DB_PATH", os.path.join(DATA_DIR, "jobs.sqlite3"))
+JOB_RESUME_ENABLED = os.getenv("JOB_RESUME_ENABLED", "true").lower() == "true"
+JOB_RESUME_MAX_AGE = int(os.getenv("JOB_RESUME_MAX_AGE", "3600"))
+JOB_RESUME_MAX_ATTEMPTS = int(os.getenv("JOB_RESUME_MAX_ATTEMPTS", "3"))
+
+# Настройки дискового кэша готовых аудиофайлов
+AUDIO_CACHE_DIR = os.getenv("AUDIO_CACHE_DIR", os.path.join(DATA_DIR, "audio_cache"))
+AUDIO_CACHE_MAX_BYTES = int(os.getenv("AUDIO_CACHE_MAX_MB", "2048")) * 1024 * 1024
+
+# Кэш обложек треков, подготовленных для Telegram
+THUMBNAIL_CACHE_DIR = os.getenv("THUMBNAIL_CACHE_DIR", os.path.join(DATA_DIR, "thumbnails"))
+THUMBNAIL_CACHE_MAX_FILES = int(os.getenv("THUMBNAIL_CACHE_MAX_FILES", "5000"))
+
+# Кэш метаданных видео (из поиска и загрузок): срок жизни записи в секундах и максимальное число записей
+METADATA_CACHE_TTL = int(os.getenv("METADATA_CACHE_TTL", "21600"))
+METADATA_CACHE_SIZE = int(os.getenv("METADATA_CACHE_SIZE", "5000"))
+
+# Кэш результатов поиска по нормализованному запросу: срок свежести (секунды, 0 - кэш выключен), время,
+# в течение которого устаревшие результаты еще выдаются с обновлением в фоне (секунды), максимальное число
+# запросов и приведение кириллицы к латинице в ключе (запросы "kino" и "кино" получат общие результаты)
+SEARCH_CACHE_TTL = int(os.getenv("SEARCH_CACHE_TTL", "600"))
+SEARCH_CACHE_STALE_TTL = int(os.getenv("SEARCH_CACHE_STALE_TTL", "3600"))
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", "1000"))
+SEARCH_CACHE_TRANSLITERATE = os.getenv("SEARCH_CACHE_TRANSLITERATE", "false").lower() == "true"
+
+# Режим выдачи аудио: mp3 (перекодирование в MP3) или passthrough (исходный AAC в m4a без перекодирования)
+AUDIO_DELIVERY_MODE = os.getenv("AUDIO_DELIVERY_MODE", "mp3").lower()
+
+# Максимальная длительность трека в секундах (более длинные отклоняются до загрузки)
+MAX_TRACK_DURATION = int(os.getenv("MAX_TRACK_DURATION", "900"))
+
+# Фрагмент трека (/clip и ссылки с отметкой времени &t=): длительность фрагмента в секундах, если конец не указан.
+# Фрагмент не может быть длиннее MAX_TRACK_DURATION
+CLIP_DEFAULT_LENGTH = int(os.getenv("CLIP_DEFAULT_LENGTH", "60"))
+
+# Потоковый режим: аудиопоток передается через ffmpeg прямо в запрос к Telegram без временных файлов
+STREAMING_MODE_ENABLED = os.getenv("STREAMING_MODE_ENABLED", "false").lower() == "true"
+
+# Режим плейлистов и альбомов: ссылка на плейлист загружается целиком (не больше PLAYLIST_MAX_TRACKS треков)
+# и отправляется по порядку группами до 10 треков. Одновременно загружается PLAYLIST_CONCURRENCY треков:
+# плейлист не занимает слоты MAX_DOWNLOADS_PER_USER, но подчиняется общему лимиту и лимиту чата
+PLAYLIST_MODE_ENABLED = os.getenv("PLAYLIST_MODE_ENABLED", "true").lower() == "true"
+PLAYLIST_MAX_TRACKS = int(os.getenv("PLAYLIST_MAX_TRACKS", "50"))
+PLAYLIST_CONCURRENCY = int(os.getenv("PLAYLIST_CONCURRENCY", "2"))
+
+# Упреждающая загрузка результатов поиска (по умолчанию выключена): пока пользователь просматривает новые
+# результаты, для первых PREFETCH_TOP_K из них заранее извлекается информация и ссылка на поток, а первые
+# PREFETCH_AUDIO_COUNT загружаются в кэш аудио. Выполняется не больше PREFETCH_CONCURRENCY задач и только
+# при пустой очереди загрузок; работа отменяется при уходе от результатов или через PREFETCH_TTL секунд
+PREFETCH_ENABLED = os.getenv("PREFETCH_ENABLED", "false").lower() == "true"
+PREFETCH_TOP_K = int(os.getenv("PREFETCH_TOP_K", "3"))
+PREFETCH_AUDIO_COUNT = int(os.getenv("PREFETCH_AUDIO_COUNT", "0"))
+PREFETCH_CONCURRENCY = int(os.getenv("PREFETCH_CONCURRENCY", "1"))
+PREFETCH_TTL = int(os.getenv("PREFETCH_TTL", "300"))
+
 # Настройки для группового чата
 GROUP_MODE_ENABLED = os.getenv("GROUP_MODE_ENABLED", "true").lower() == "true"
 DIRECT_PROCESS_YOUTUBE_LINKS = os.getenv("DIRECT_PROCESS_YOUTUBE_LINKS", "true").lower() == "true"
@@ -43,6 +124,23 @@ def parse_ids_list(env_var: str) -> List[int]:
         logger.warning(f"Неверный формат ID в {env_var}. Используется пустой список.")
         return []
 
+# Функция для парсинга словаря "ID:число" из строки с запятыми
+def parse_ids_map(env_var: str) -> Dict[int, int]:
+    """Парсит строку вида "ID:значение,ID:значение" в словарь целых чисел"""
+    value = os.getenv(env_var, "")
+    if not value:
+        return {}
+    try:
+        result = {}
+        for item in value.split(","):
+            if item.strip():
+                key, item_value = item.split(":", 1)
+                result[int(key.strip())] = int(item_value.strip())
+        return result
+    except ValueError:
+        logger.warning(f"Неверный формат значений в {env_var}. Используется пустой словарь.")
+        return {}
+
 # Списки разрешенных групп и тем
 ALLOWED_TOPIC_IDS = parse_ids_list("ALLOWED_TOPIC_IDS")
 ALLOWED_GROUP_IDS = parse_ids_list("ALLOWED_GROUP_IDS")
@@ -50,6 +148,51 @@ ALLOWED_GROUP_IDS = parse_ids_list("ALLOWED_GROUP_IDS")
 # ID администраторов бота (если нужно)
 ADMIN_USER_IDS = parse_ids_list("ADMIN_USER_IDS")
 
+# Настройки планировщика загрузок
+MAX_CONCURRENT_DOWNLOADS = int(os.getenv("MAX_CONCURRENT_DOWNLOADS", "4"))
+MAX_DOWNLOADS_PER_USER = int(os.getenv("MAX_DOWNLOADS_PER_USER", "1"))
+MAX_DOWNLOADS_PER_CHAT = int(os.getenv("MAX_DOWNLOADS_PER_CHAT", "2"))
+# Веса чатов в справедливой очереди в формате "chat_id:вес,chat_id:вес" (по умолчанию вес 1)
+CHAT_QUEUE_WEIGHTS = parse_ids_map("CHAT_QUEUE_WEIGHTS")
+if PLAYLIST_MODE_ENABLED and PLAYLIST_CONCURRENCY > min(MAX_DOWNLOADS_PER_CHAT, MAX_CONCURRENT_DOWNLOADS):
+    logger.warning(
+        f"PLAYLIST_CONCURRENCY={PLAYLIST_CONCURRENCY} больше лимита планировщика "
+        f"(MAX_DOWNLOADS_PER_CHAT={MAX_DOWNLOADS_PER_CHAT}, MAX_CONCURRENT_DOWNLOADS={MAX_CONCURRENT_DOWNLOADS}): "
+        f"одновременно загружается не больше {min(MAX_DOWNLOADS_PER_CHAT, MAX_CONCURRENT_DOWNLOADS)} треков плейлиста"
+    )
+
+# Исполнитель задач yt-dlp: thread (пул потоков) или process (пул рабочих процессов)
+YDL_EXECUTOR = os.getenv("YDL_EXECUTOR", "thread").lower()
+YDL_PROCESS_WORKERS = int(os.getenv("YDL_PROCESS_WORKERS", str(os.cpu_count() or 2)))
+
+# Перекодирование: одновременных задач и потоков ffmpeg на задачу (0 - по числу доступных ядер с учетом квоты cgroup)
+TRANSCODE_CONCURRENCY = int(os.getenv("TRANSCODE_CONCURRENCY", "0"))
+TRANSCODE_THREADS = int(os.getenv("TRANSCODE_THREADS", "0"))
+
+# Загрузка одиночного аудиопотока по частям (Range) в несколько соединений
+RANGED_DOWNLOAD_ENABLED = os.getenv("RANGED_DOWNLOAD_ENABLED", "true").lower() == "true"
+RANGED_DOWNLOAD_CONNECTIONS = int(os.getenv("RANGED_DOWNLOAD_CONNECTIONS", "4"))
+RANGED_DOWNLOAD_CHUNK_SIZE = int(os.getenv("RANGED_DOWNLOAD_CHUNK_KB", "1024")) * 1024
+RANGED_DOWNLOAD_RETRIES = int(os.getenv("RANGED_DOWNLOAD_RETRIES", "3"))
+
+# Пул клиентов YouTube Music для поиска: количество клиентов (одновременных запросов), максимальный возраст
+# клиента (секунды), интервал фоновой проверки простаивающих клиентов (секунды, 0 - без проверки)
+# и таймаут запроса (секунды)
+YTMUSIC_POOL_SIZE = int(os.getenv("YTMUSIC_POOL_SIZE", "4"))
+YTMUSIC_CLIENT_MAX_AGE = int(os.getenv("YTMUSIC_CLIENT_MAX_AGE", "3600"))
+YTMUSIC_HEALTH_CHECK_INTERVAL = int(os.getenv("YTMUSIC_HEALTH_CHECK_INTERVAL", "120"))
+YTMUSIC_REQUEST_TIMEOUT = int(os.getenv("YTMUSIC_REQUEST_TIMEOUT", "10"))
+
+# Пул потоков поиска (YouTube Music и резервный поиск yt-dlp), отдельный от пула загрузок:
+# количество потоков и таймаут одного запроса поиска, включая ожидание свободного потока (секунды)
+SEARCH_EXECUTOR_WORKERS = int(os.getenv("SEARCH_EXECUTOR_WORKERS", "6"))
+SEARCH_TIMEOUT = float(os.getenv("SEARCH_TIMEOUT", "15"))
+
+# Метрики Prometheus: HTTP-эндпоинт /metrics (по умолчанию доступен только локально)
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))
+
 # Функция для проверки, разрешена ли обработка в данной группе и теме
 def is_allowed_chat(chat_id: int, topic_id: Optional[int] = None) -> bool:
     """
@@ -6,6 +6,7 @@ from aiogram.enums import ChatType
 from keyboards.inline import get_main_keyboard
 from handlers.search import SearchStates
 from services.user_state import user_state_manager
+from services.prefetch import search_prefetcher
 from config import GROUP_MODE_ENABLED, TOPICS_MODE_ENABLED, is_allowed_chat
 
 logger = logging.getLogger(__name__)
@@ -86,6 +87,9 @@ async def process_back_to_main_callback(callback: CallbackQuery, state: FSMConte
         return
     
     logger.info(f"Пользователь {user_id} вернулся в главное меню в чате {chat_id} (топик: {topic_id})")
+
+    # Пользователь ушел от результатов поиска - их упреждающая загрузка больше не нужна
+    search_prefetcher.abandon(chat_id, callback.message.message_id)
     
     # Проверяем тип чата
     if chat_type in {ChatType.GROUP, ChatType.SUPERGROUP} and GROUP_MODE_ENABLED:
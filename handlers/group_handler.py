@@ -12,7 +12,7 @@ from config import TOPICS_MODE_ENABLED, is_allowed_chat
 from keyboards.inline import get_main_keyboard
 from services.user_state import user_state_manager
 from services.youtube import download_audio_from_youtube, search_youtube_music
-from handlers.link_handler import process_youtube_link
+from handlers.link_handler import process_youtube_link, cmd_clip
 from handlers.search import SearchPagination, display_search_results_page
 
 logger = logging.getLogger(__name__)
@@ -48,7 +48,8 @@ async def cmd_start_group(message: Message):
         f"В групповом чате{topic_info} я работаю так:\n"
         f"• Пришлите мне ссылку на YouTube видео, и я скачаю из него аудио\n"
         f"• Используйте команду /search для поиска музыки\n"
-        f"• Используйте команду /link для отправки ссылки на YouTube"
+        f"• Используйте команду /link для отправки ссылки на YouTube\n"
+        f"• Используйте команду /clip для загрузки фрагмента трека"
     )
     
     await message.answer(text)
@@ -137,6 +138,15 @@ async def cmd_search_group(message: Message, command: CommandObject):
             f"{user_name}, введите запрос для поиска музыки в YouTube Music:"
         )
 
+@router.message(Command("clip"), F.chat.type.in_({ChatType.GROUP, ChatType.SUPERGROUP}))
+async def cmd_clip_group(message: Message, command: CommandObject):
+    """
+    Обработчик команды /clip для групповых чатов.
+    Регистрируется раньше общего обработчика сообщений группы, который иначе
+    отправил бы ссылку из команды целиком.
+    """
+    await cmd_clip(message, command)
+
 @router.message(F.chat.type.in_({ChatType.GROUP, ChatType.SUPERGROUP}))
 async def handle_group_message(message: Message):
     """
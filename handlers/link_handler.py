@@ -3,13 +3,23 @@ import os
 import re
 import time
 import asyncio
+from contextlib import nullcontext
 from aiogram import Router, F
 from aiogram.types import Message, FSInputFile
 from aiogram.enums import ChatType
-from aiogram.filters import Command
+from aiogram.filters import Command, CommandObject
+from aiogram.exceptions import TelegramBadRequest
 from keyboards.inline import get_main_keyboard
-from services.youtube import download_audio_from_youtube, MAX_TELEGRAM_FILE_SIZE
-from config import TOPICS_MODE_ENABLED, is_allowed_chat, GROUP_MODE_ENABLED
+from services.youtube import download_audio_from_youtube, open_audio_stream, release_downloaded_files, AdmissionError, is_audio_available, extract_video_id, extract_playlist_id, MAX_TELEGRAM_FILE_SIZE, DEFAULT_AUDIO_PROFILE
+from services.youtube import TrackTooLongError, download_clip, clip_profile, extract_timestamp, parse_clip_request, format_timestamp
+from services.file_id_registry import file_id_registry
+from services.bot_api import audio_input_file
+from services.metrics import TIME_TO_AUDIO, observe_stage, record_cache_lookup, record_failure
+from services.scheduler import download_scheduler
+from services.job_journal import job_journal, STAGE_DOWNLOADING, STAGE_SENDING
+from handlers.playlist import process_playlist_link
+from config import TOPICS_MODE_ENABLED, is_allowed_chat, GROUP_MODE_ENABLED, STREAMING_MODE_ENABLED, PLAYLIST_MODE_ENABLED
+from config import CLIP_DEFAULT_LENGTH
 
 logger = logging.getLogger(__name__)
 router = Router()
@@ -17,11 +27,29 @@ router = Router()
 # Регулярное выражение для проверки YouTube ссылок
 YOUTUBE_REGEX = r"(?:https?:\/\/)?(?:www\.|m\.)?(?:youtube\.com|youtu\.be)\/(?:watch\?v=)?([^\s&]+)"
 
+# Текст сообщения-индикатора загрузки
+LOADING_MESSAGE_TEXT = (
+    "⏳ <b>Загружаю аудио...</b>\n\n"
+    "• Получение информации о треке\n"
+    "• Выбор аудиопотока\n"
+    "• Загрузка и конвертация\n\n"
+    "<i>Пожалуйста, подождите. Это может занять 10-30 секунд...</i>"
+)
+
+# Подсказка по команде /clip
+CLIP_USAGE_TEXT = (
+    "✂️ <b>Фрагмент трека</b>\n\n"
+    "Укажите ссылку и интервал:\n"
+    "<code>/clip ссылка 1:02:10-1:02:50</code>\n\n"
+    f"Если конец не указан, загружается {CLIP_DEFAULT_LENGTH} секунд с указанного места. "
+    "Начало можно задать и отметкой времени в ссылке (&amp;t=3730)."
+)
+
 # Словарь для отслеживания активных задач обработки по чатам
 active_tasks = {}
 
 # Функция для обработки скачивания и отправки аудио
-async def process_and_send_audio(message, url, loading_message, is_group_chat, user_name):
+async def process_and_send_audio(message, url, loading_message, is_group_chat, user_name, job_id=None, clip=None):
     """
     Асинхронная функция для скачивания и отправки аудио пользователю.
     Запускается как отдельная задача, чтобы не блокировать основной поток обработки сообщений.
@@ -32,15 +60,88 @@ async def process_and_send_audio(message, url, loading_message, is_group_chat, u
         loading_message: Сообщение-индикатор загрузки
         is_group_chat: Флаг группового чата
         user_name: Имя пользователя для сообщений
+        job_id: ID задачи в журнале задач
+        clip: Интервал фрагмента (начало, конец) в секундах или None - весь трек
     """
+    # Начало обработки запроса (для метрики времени до отправки аудио)
+    started = time.perf_counter()
     chat_id = message.chat.id
     file_path = None
     thumb_path = None
-    
+    audio_stream = None
+    video_id = extract_video_id(url)
+    # Фрагмент кэшируется и отправляется по file_id отдельно от полного трека
+    profile = clip_profile(*clip) if clip else DEFAULT_AUDIO_PROFILE
+
     try:
+        # Добавляем информацию об отправителе для группового чата
+        sender_info = f"Запрос от: {user_name}\n" if is_group_chat else ""
+
+        # Если трек уже отправлялся, пересылаем его по file_id без скачивания
+        cached_audio = file_id_registry.get(video_id, profile) if video_id else None
+        if video_id:
+            record_cache_lookup('file_id', bool(cached_audio))
+        if cached_audio:
+            try:
+                await (message.reply_audio if is_group_chat else message.answer_audio)(
+                    audio=cached_audio['file_id'],
+                    title=cached_audio['title'],
+                    performer=cached_audio['performer'],
+                    caption=f"✅ <b>Аудио успешно загружено!</b>\n\n{sender_info}",
+                    reply_markup=get_main_keyboard()
+                )
+                await loading_message.delete()
+                TIME_TO_AUDIO.labels(source='file_id').observe(time.perf_counter() - started)
+                logger.info(f"Аудио для видео {video_id} отправлено по сохраненному file_id")
+                return
+            except TelegramBadRequest as e:
+                # file_id больше недействителен - удаляем его и скачиваем трек заново
+                logger.warning(f"Не удалось отправить аудио по file_id для видео {video_id}: {e}")
+                file_id_registry.remove(video_id, profile)
+
         # Скачивание аудио и получение метаданных
         try:
-            download_result = await download_audio_from_youtube(url)
+            # Новые загрузки проходят через планировщик; трек из кэша или уже
+            # загружаемый по другому запросу не занимает слот
+            audio_available = not clip and is_audio_available(url)
+            if audio_available:
+                download_slot = nullcontext()
+            else:
+                topic_id = message.message_thread_id if TOPICS_MODE_ENABLED else None
+                download_slot = download_scheduler.slot(
+                    message.from_user.id, chat_id, topic_id,
+                    on_position=lambda position: loading_message.edit_text(
+                        f"⏳ <b>Загрузка в очереди</b>\n\n"
+                        f"Позиция в очереди: <b>{position}</b>\n\n"
+                        f"<i>Загрузка начнется автоматически, пожалуйста, подождите...</i>"
+                    )
+                )
+
+            async with download_slot as job:
+                job_journal.set_stage(job_id, STAGE_DOWNLOADING)
+                if job and job.was_queued:
+                    # Задача ждала в очереди - возвращаем сообщение о загрузке
+                    await loading_message.edit_text(LOADING_MESSAGE_TEXT)
+                if clip:
+                    download_result = await download_clip(url, *clip)
+                else:
+                    try:
+                        # В потоковом режиме новый трек передается в Telegram через ffmpeg без временных файлов
+                        stream_result = await open_audio_stream(url) if STREAMING_MODE_ENABLED and not audio_available else None
+                        if stream_result:
+                            audio_stream, metadata, estimated_size, stream_thumb_path = stream_result
+                            download_result = (None, metadata, stream_thumb_path)
+                        else:
+                            download_result = await download_audio_from_youtube(url)
+                    except TrackTooLongError:
+                        # Из длинного видео по ссылке с отметкой времени (&t=) отправляем фрагмент с этой отметки
+                        start = extract_timestamp(url)
+                        if start is None:
+                            raise
+                        clip = (start, start + CLIP_DEFAULT_LENGTH)
+                        profile = clip_profile(*clip)
+                        logger.info(f"Видео {video_id} слишком длинное, отправляется фрагмент с {format_timestamp(start)}")
+                        download_result = await download_clip(url, *clip)
             # Убедимся, что у нас есть кортеж с тремя элементами
             if isinstance(download_result, tuple) and len(download_result) == 3:
                 file_path, metadata, thumb_path = download_result
@@ -50,7 +151,25 @@ async def process_and_send_audio(message, url, loading_message, is_group_chat, u
                 metadata = download_result[1] if isinstance(download_result, tuple) and len(download_result) > 1 else {}
                 thumb_path = download_result[2] if isinstance(download_result, tuple) and len(download_result) > 2 else None
                 logger.warning(f"Неожиданный формат результата download_audio_from_youtube: {download_result}")
+        except AdmissionError as admission_error:
+            record_failure('admission', admission_error)
+            # Трек отклонен до загрузки - сообщаем причину
+            await loading_message.delete()
+            hint = (
+                "Чтобы получить часть трека, используйте\n<code>/clip ссылка 1:02:10-1:02:50</code>"
+                if isinstance(admission_error, TrackTooLongError) else
+                "Попробуйте видео с меньшей длительностью."
+            )
+            await (message.reply if is_group_chat else message.answer)(
+                f"⚠️ <b>Трек не может быть отправлен</b>\n\n"
+                f"{sender_info}"
+                f"Причина: {admission_error}\n\n"
+                f"{hint}",
+                reply_markup=get_main_keyboard()
+            )
+            return
         except Exception as download_error:
+            record_failure('download', download_error)
             logger.error(f"Ошибка при загрузке аудио: {download_error}")
             await loading_message.delete()
             await (message.reply if is_group_chat else message.answer)(
@@ -61,10 +180,13 @@ async def process_and_send_audio(message, url, loading_message, is_group_chat, u
             )
             return
         
-        if not file_path or not os.path.exists(file_path):
+        if audio_stream:
+            # Точный размер станет известен только после передачи
+            file_size = estimated_size
+        elif not file_path or not os.path.exists(file_path):
             raise FileNotFoundError(f"Файл не найден: {file_path}")
-            
-        file_size = os.path.getsize(file_path)
+        else:
+            file_size = os.path.getsize(file_path)
         
         # Подготавливаем метаданные для отправки
         title = metadata.get('title', 'Unknown Title')
@@ -74,23 +196,18 @@ async def process_and_send_audio(message, url, loading_message, is_group_chat, u
         
         # Генерируем понятное название аудиофайла без артиста, если его нет или это "Unknown Artist"
         display_title = title
-        
-        # Добавляем информацию об отправителе для группового чата
-        sender_info = f"Запрос от: {user_name}\n" if is_group_chat else ""
-        
+
         # Проверяем размер файла
         if file_size > MAX_TELEGRAM_FILE_SIZE:
             await loading_message.delete()
             await (message.reply if is_group_chat else message.answer)(
                 f"⚠️ <b>Файл слишком большой для отправки</b>\n\n"
                 f"{sender_info}"
-                f"Размер файла: <b>{file_size / 1024 / 1024:.1f} МБ</b>\n"
-                f"Лимит Telegram: <b>50 МБ</b>\n\n"
+                f"Размер файла: <b>{'~' if audio_stream else ''}{file_size / 1024 / 1024:.1f} МБ</b>\n"
+                f"Лимит Telegram: <b>{MAX_TELEGRAM_FILE_SIZE // 1024 // 1024} МБ</b>\n\n"
                 f"Попробуйте видео с меньшей длительностью.",
                 reply_markup=get_main_keyboard()
             )
-            # Удаляем файл
-            os.remove(file_path)
             return
         
         # Информативное сообщение о готовности аудио
@@ -100,12 +217,13 @@ async def process_and_send_audio(message, url, loading_message, is_group_chat, u
         if artist and artist != 'Unknown Artist':
             info_message += f"<b>Исполнитель:</b> {artist}\n"
             
-        info_message += f"<b>Размер файла:</b> <b>{file_size / 1024 / 1024:.1f} МБ</b>\n\n<i>Отправляю файл...</i>"
+        info_message += f"<b>Размер файла:</b> <b>{'~' if audio_stream else ''}{file_size / 1024 / 1024:.1f} МБ</b>\n\n<i>Отправляю файл...</i>"
         
         await loading_message.edit_text(info_message)
+        job_journal.set_stage(job_id, STAGE_SENDING)
         
-        # Создаем FSInputFile вместо открытия файла напрямую
-        audio_file = FSInputFile(file_path)
+        # Файл для отправки: FSInputFile, путь для локального сервера Bot API или поток
+        audio_file = audio_stream or audio_input_file(file_path)
         
         # Подготавливаем обложку для Telegram, если она есть
         thumbnail = None
@@ -119,55 +237,42 @@ async def process_and_send_audio(message, url, loading_message, is_group_chat, u
             performer = artist
             
         # Отправка аудио пользователю - используем reply в групповом чате
-        await (message.reply_audio if is_group_chat else message.answer_audio)(
-            audio=audio_file,
-            title=title,
-            performer=performer,
-            caption=f"✅ <b>Аудио успешно загружено!</b>\n\n{sender_info}",
-            thumbnail=thumbnail,
-            reply_markup=get_main_keyboard()
-        )
-        
+        with observe_stage('upload'):
+            sent_message = await (message.reply_audio if is_group_chat else message.answer_audio)(
+                audio=audio_file,
+                title=title,
+                performer=performer,
+                caption=f"✅ <b>Аудио успешно загружено!</b>\n\n{sender_info}",
+                thumbnail=thumbnail,
+                reply_markup=get_main_keyboard()
+            )
+
+        TIME_TO_AUDIO.labels(
+            source='stream' if audio_stream else ('cache' if audio_available else 'download')
+        ).observe(time.perf_counter() - started)
+
+        # Запоминаем file_id, чтобы повторные запросы отправлялись без скачивания
+        if video_id and sent_message.audio:
+            file_id_registry.set(
+                video_id,
+                profile,
+                sent_message.audio.file_id,
+                file_unique_id=sent_message.audio.file_unique_id,
+                title=title,
+                performer=performer,
+                duration=sent_message.audio.duration,
+                file_size=sent_message.audio.file_size or file_size
+            )
+
         # Удаление сообщения о загрузке
         await loading_message.delete()
         
-        # Удаление файла после отправки
-        try:
-            # Попытка удаления аудиофайла с повторными попытками
-            file_deleted = False
-            for attempt in range(5):
-                try:
-                    if os.path.exists(file_path):
-                        os.remove(file_path)
-                        logger.info(f"Файл {file_path} успешно отправлен и удален")
-                        file_deleted = True
-                        break
-                    else:
-                        logger.warning(f"Файл {file_path} не найден для удаления")
-                        file_deleted = True
-                        break
-                except PermissionError:
-                    # Если файл заблокирован, ждем немного и пробуем снова
-                    logger.warning(f"Файл {file_path} заблокирован, попытка {attempt+1}/5")
-                    time.sleep(0.5)
-                except Exception as e:
-                    logger.warning(f"Не удалось удалить файл {file_path}: {e}")
-                    break
-            
-            if not file_deleted:
-                logger.warning(f"Не удалось удалить файл {file_path} после 5 попыток")
-            
-            # Удаляем обложку, если она существует
-            if thumb_path and os.path.exists(thumb_path):
-                try:
-                    os.remove(thumb_path)
-                    logger.info(f"Файл обложки {thumb_path} удален")
-                except Exception as e:
-                    logger.warning(f"Не удалось удалить файл обложки {thumb_path}: {e}")
-        except Exception as e:
-            logger.warning(f"Ошибка при очистке файлов: {e}")
-        
+    except asyncio.CancelledError:
+        # Задача прервана остановкой бота - запись в журнале остается, задача возобновится после перезапуска
+        job_id = None
+        raise
     except Exception as e:
+        record_failure('send', e)
         logger.error(f"Ошибка при обработке YouTube ссылки: {e}")
         await loading_message.delete()
         await (message.reply if is_group_chat else message.answer)(
@@ -177,6 +282,13 @@ async def process_and_send_audio(message, url, loading_message, is_group_chat, u
             reply_markup=get_main_keyboard()
         )
     finally:
+        # Освобождаем файлы: запись кэша отпускается, временные файлы удаляются
+        if file_path or thumb_path:
+            await release_downloaded_files(file_path, thumb_path)
+
+        # Пользователь получил ответ - задача больше не возобновляется
+        job_journal.finish(job_id)
+
         # Удаляем задачу из словаря активных задач
         user_id = message.from_user.id
         task_key = f"{chat_id}_{user_id}"
@@ -213,23 +325,29 @@ async def process_youtube_link(message: Message, is_group_chat=False, topic_id=N
         logger.info(f"Ссылка отклонена в чате {chat_id} (топик: {topic_id}) от пользователя {user_id}")
         return
     
+    # Ссылка на плейлист или альбом загружается целиком
+    if PLAYLIST_MODE_ENABLED and extract_playlist_id(url):
+        await process_playlist_link(message, url, is_group_chat, user_name)
+        return
+
     logger.info(f"Пользователь {user_id} ({user_name}) отправил YouTube ссылку в чате {chat_id} (топик: {topic_id}): {url}")
     
     # Отправка сообщения о начале загрузки
     loading_message = await (message.reply if is_group_chat else message.answer)(
-        "⏳ <b>Загружаю аудио...</b>\n\n"
-        "• Получение информации о треке\n"
-        "• Выбор аудиопотока\n"
-        "• Загрузка и конвертация\n\n"
-        "<i>Пожалуйста, подождите. Это может занять 10-30 секунд...</i>"
+        LOADING_MESSAGE_TEXT
     )
     
+    # Записываем задачу в журнал, чтобы она пережила перезапуск бота
+    job_id = job_journal.add(
+        'link', message, message.from_user, loading_message, url, extract_video_id(url), is_group_chat
+    )
+
     # Создаем ключ для отслеживания задачи
     task_key = f"{chat_id}_{user_id}"
     
     # Создаем асинхронную задачу обработки
     task = asyncio.create_task(
-        process_and_send_audio(message, url, loading_message, is_group_chat, user_name)
+        process_and_send_audio(message, url, loading_message, is_group_chat, user_name, job_id)
     )
     
     # Сохраняем задачу в словаре активных задач
@@ -238,6 +356,25 @@ async def process_youtube_link(message: Message, is_group_chat=False, topic_id=N
     # Не ожидаем завершения задачи - она выполнится в фоне
     logger.info(f"Запущена асинхронная обработка YouTube ссылки для {user_id} в чате {chat_id}")
 
+async def resume_link_job(bot, job, loading_message):
+    """
+    Перезапускает задачу из журнала, не завершенную до перезапуска бота
+
+    Args:
+        bot: Экземпляр бота
+        job: Запись журнала задач
+        loading_message: Сообщение-индикатор загрузки
+    """
+    message = job_journal.restore_message(bot, job)
+    task = asyncio.create_task(
+        process_and_send_audio(
+            message, job['url'], loading_message, bool(job['is_group_chat']), job['user_name'], job['id']
+        )
+    )
+    active_tasks[f"{job['chat_id']}_{job['user_id']}"] = task
+
+job_journal.register_resumer('link', resume_link_job)
+
 # Обработчик команды /link для обоих типов чатов
 @router.message(Command("link"))
 async def cmd_link(message: Message):
@@ -265,4 +402,66 @@ async def cmd_link(message: Message):
     is_group_chat = chat_type in {ChatType.GROUP, ChatType.SUPERGROUP}
     await (message.reply if is_group_chat else message.answer)(
         "Пришлите ссылку на YouTube видео, и я скачаю из него аудио."
-    ) 
\ No newline at end of file
+    ) 
+# Обработчик команды /clip для обоих типов чатов
+@router.message(Command("clip"))
+async def cmd_clip(message: Message, command: CommandObject):
+    """
+    Обработчик команды /clip.
+    Загружает и отправляет только фрагмент трека: /clip ссылка 1:02:10-1:02:50
+    """
+    user_id = message.from_user.id
+    user_name = message.from_user.first_name
+    chat_id = message.chat.id
+    is_group_chat = message.chat.type in {ChatType.GROUP, ChatType.SUPERGROUP}
+    topic_id = message.message_thread_id if TOPICS_MODE_ENABLED else None
+
+    # Проверка для групповых чатов
+    if is_group_chat:
+        if not GROUP_MODE_ENABLED:
+            return
+        if not is_allowed_chat(chat_id, topic_id):
+            logger.info(f"Команда /clip отклонена в группе {chat_id} (топик: {topic_id}) от пользователя {user_id}")
+            return
+
+    args = (command.args or "").strip()
+    clip_request = parse_clip_request(args)
+    if not clip_request:
+        await (message.reply if is_group_chat else message.answer)(CLIP_USAGE_TEXT)
+        return
+    url, start, end = clip_request
+
+    logger.info(
+        f"Пользователь {user_id} ({user_name}) запросил фрагмент {format_timestamp(start)}-{format_timestamp(end)} "
+        f"в чате {chat_id} (топик: {topic_id}): {url}"
+    )
+
+    loading_message = await (message.reply if is_group_chat else message.answer)(LOADING_MESSAGE_TEXT)
+
+    # В журнал записываются аргументы команды целиком - при возобновлении они разбираются заново
+    job_id = job_journal.add('clip', message, message.from_user, loading_message, args, extract_video_id(url), is_group_chat)
+
+    task = asyncio.create_task(
+        process_and_send_audio(message, url, loading_message, is_group_chat, user_name, job_id, clip=(start, end))
+    )
+    active_tasks[f"{chat_id}_{user_id}"] = task
+
+async def resume_clip_job(bot, job, loading_message):
+    """
+    Перезапускает загрузку фрагмента из журнала, не завершенную до перезапуска бота
+
+    Args:
+        bot: Экземпляр бота
+        job: Запись журнала задач (url - аргументы команды /clip)
+        loading_message: Сообщение-индикатор загрузки
+    """
+    url, start, end = parse_clip_request(job['url'])
+    message = job_journal.restore_message(bot, job)
+    task = asyncio.create_task(
+        process_and_send_audio(
+            message, url, loading_message, bool(job['is_group_chat']), job['user_name'], job['id'], clip=(start, end)
+        )
+    )
+    active_tasks[f"{job['chat_id']}_{job['user_id']}"] = task
+
+job_journal.register_resumer('clip', resume_clip_job)
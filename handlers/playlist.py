@@ -0,0 +1,438 @@
+import asyncio
+import html
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from aiogram.exceptions import TelegramAPIError, TelegramBadRequest, TelegramRetryAfter
+from aiogram.types import FSInputFile, InputMediaAudio, Message
+
+from keyboards.inline import get_main_keyboard
+from services.youtube import download_audio_from_youtube, extract_playlist, release_downloaded_files, AdmissionError, MAX_TELEGRAM_FILE_SIZE, DEFAULT_AUDIO_PROFILE
+from services.file_id_registry import file_id_registry
+from services.bot_api import audio_input_file
+from services.metrics import observe_stage, record_cache_lookup, record_failure
+from services.scheduler import download_scheduler
+from services.job_journal import job_journal, STAGE_DOWNLOADING, STAGE_SENDING
+from config import TOPICS_MODE_ENABLED, PLAYLIST_CONCURRENCY, PLAYLIST_MAX_TRACKS, MAX_TRACK_DURATION
+
+logger = logging.getLogger(__name__)
+
+# Максимальное число треков в одной группе (ограничение sendMediaGroup)
+MEDIA_GROUP_SIZE = 10
+
+# Минимальный интервал между обновлениями сообщения о ходе загрузки (секунды)
+PROGRESS_UPDATE_INTERVAL = 3
+
+# Сколько раз отправка повторяется, если Telegram просит подождать из-за лимитов (RetryAfter)
+MAX_SEND_ATTEMPTS = 5
+
+# Сколько неудавшихся треков перечисляется в итоговом сообщении
+MAX_LISTED_FAILURES = 10
+
+# Текст сообщения о начале загрузки плейлиста
+PLAYLIST_LOADING_TEXT = (
+    "⏳ <b>Получаю список треков плейлиста...</b>\n\n"
+    "<i>Пожалуйста, подождите.</i>"
+)
+
+# Словарь для отслеживания активных задач загрузки плейлистов по чатам
+active_playlist_tasks = {}
+
+class PlaylistTrack:
+    """Трек плейлиста и результат его подготовки к отправке"""
+
+    def __init__(self, position: int, entry: Dict):
+        self.position = position
+        self.video_id = entry['id']
+        self.title = entry.get('title') or entry['id']
+        self.performer = entry.get('channel') or entry.get('uploader')
+        self.duration = entry.get('duration')
+        # Результат подготовки: file_id уже отправленного трека или загруженный файл
+        self.file_id: Optional[str] = None
+        self.file_path: Optional[str] = None
+        self.thumb_path: Optional[str] = None
+        self.file_size: Optional[int] = None
+        # Причина, по которой трек не будет отправлен
+        self.error: Optional[str] = None
+
+    @property
+    def url(self) -> str:
+        return f"https://www.youtube.com/watch?v={self.video_id}"
+
+    @property
+    def ready(self) -> bool:
+        return bool(self.file_id or self.file_path)
+
+    async def release(self) -> None:
+        """Освобождает загруженные файлы трека"""
+        if self.file_path:
+            await release_downloaded_files(self.file_path, self.thumb_path)
+            self.file_path = None
+            self.thumb_path = None
+
+class PlaylistProgress:
+    """
+    Одно сообщение о ходе загрузки плейлиста вместо сообщения на каждый трек.
+    Обновляется не чаще PROGRESS_UPDATE_INTERVAL секунд, чтобы не упираться в лимиты Telegram.
+    """
+
+    def __init__(self, message: Message, title: str, total: int, sender_info: str, truncated: bool):
+        self.message = message
+        self.title = title
+        self.total = total
+        self.sender_info = sender_info
+        self.truncated = truncated
+        self.ready = 0
+        self.sent = 0
+        self.failed = 0
+        self._last_update = 0.0
+
+    def _header(self) -> str:
+        text = f"{self.sender_info}<b>{html.escape(self.title)}</b>\n"
+        if self.truncated:
+            text += f"<i>Будут загружены первые {self.total} треков</i>\n"
+        return text
+
+    def text(self) -> str:
+        text = (
+            f"⏳ <b>Загружаю плейлист</b>\n\n{self._header()}\n"
+            f"Готово: <b>{self.ready}</b> из <b>{self.total}</b>\n"
+            f"Отправлено: <b>{self.sent}</b>\n"
+        )
+        if self.failed:
+            text += f"Ошибки: <b>{self.failed}</b>\n"
+        return text + f"\n<i>Треки отправляются по порядку группами по {MEDIA_GROUP_SIZE}.</i>"
+
+    async def update(self, force: bool = False) -> None:
+        """Обновляет сообщение о ходе загрузки (пропускается, если предыдущее обновление было недавно)"""
+        now = time.monotonic()
+        if not force and now - self._last_update < PROGRESS_UPDATE_INTERVAL:
+            return
+        self._last_update = now
+        try:
+            await self.message.edit_text(self.text())
+        except TelegramAPIError as e:
+            logger.debug(f"Не удалось обновить сообщение о загрузке плейлиста: {e}")
+
+    async def finish(self, tracks: List[PlaylistTrack]) -> None:
+        """Заменяет сообщение о ходе загрузки итогом: сколько треков отправлено и какие не удалось"""
+        failures = [track for track in tracks if track.error]
+        text = (
+            f"{'✅' if not failures else '⚠️'} <b>Плейлист отправлен</b>\n\n{self._header()}\n"
+            f"Отправлено треков: <b>{self.sent}</b> из <b>{self.total}</b>\n"
+        )
+        if failures:
+            text += "\n<b>Не удалось отправить:</b>\n"
+            for track in failures[:MAX_LISTED_FAILURES]:
+                text += f"• {track.position}. {html.escape(track.title)} - {html.escape(track.error)}\n"
+            if len(failures) > MAX_LISTED_FAILURES:
+                text += f"<i>...и еще {len(failures) - MAX_LISTED_FAILURES}</i>\n"
+        try:
+            await self.message.edit_text(text, reply_markup=get_main_keyboard())
+        except TelegramAPIError as e:
+            logger.debug(f"Не удалось обновить итоговое сообщение плейлиста: {e}")
+
+async def prepare_track(track: PlaylistTrack, semaphore: asyncio.Semaphore, progress: PlaylistProgress,
+                        user_id: int, chat_id: int, topic_id: Optional[int], group: Tuple) -> None:
+    """
+    Готовит трек к отправке через обычный конвейер загрузки (реестр file_id, планировщик загрузок,
+    кэш аудио, объединение одновременных загрузок, очередь перекодирования). Ошибка трека
+    не прерывает загрузку плейлиста - она сохраняется в track.error.
+
+    Args:
+        track: Трек плейлиста
+        semaphore: Ограничение одновременно загружаемых треков плейлиста
+        progress: Сообщение о ходе загрузки
+        user_id: ID пользователя, запросившего плейлист
+        chat_id: ID чата
+        topic_id: ID топика или None
+        group: Ключ плейлиста в планировщике загрузок
+    """
+    async with semaphore:
+        cached_audio = file_id_registry.get(track.video_id, DEFAULT_AUDIO_PROFILE)
+        record_cache_lookup('file_id', bool(cached_audio))
+        if cached_audio:
+            track.file_id = cached_audio['file_id']
+            track.title = cached_audio['title'] or track.title
+            track.performer = cached_audio['performer']
+        elif track.duration and track.duration > MAX_TRACK_DURATION:
+            track.error = "слишком длинный трек"
+        else:
+            try:
+                # Каждая загрузка трека занимает свой слот планировщика: треки плейлиста ограничены
+                # PLAYLIST_CONCURRENCY вместо лимита пользователя, общий лимит и лимит чата действуют как обычно
+                async with download_scheduler.slot(user_id, chat_id, topic_id, group=group,
+                                                   group_limit=max(1, PLAYLIST_CONCURRENCY)):
+                    file_path, metadata, thumb_path = await download_audio_from_youtube(track.url)
+                track.file_path, track.thumb_path = file_path, thumb_path
+                track.title = metadata.get('title') or track.title
+                artist = metadata.get('artist')
+                track.performer = artist if artist and artist != 'Unknown Artist' else None
+                track.file_size = os.path.getsize(file_path)
+                if track.file_size > MAX_TELEGRAM_FILE_SIZE:
+                    track.error = f"файл больше {MAX_TELEGRAM_FILE_SIZE // 1024 // 1024} МБ"
+                    await track.release()
+            except AdmissionError as e:
+                record_failure('admission', e)
+                track.error = str(e)
+            except Exception as e:
+                record_failure('download', e)
+                logger.error(f"Ошибка при загрузке трека {track.video_id} плейлиста: {e}")
+                track.error = "ошибка загрузки"
+
+    if track.error:
+        progress.failed += 1
+    else:
+        progress.ready += 1
+    await progress.update()
+
+def _thumbnail(track: PlaylistTrack) -> Optional[FSInputFile]:
+    """Обложка загруженного трека для Telegram, если она есть"""
+    if track.thumb_path and os.path.exists(track.thumb_path) and os.path.getsize(track.thumb_path) > 0:
+        return FSInputFile(track.thumb_path)
+    return None
+
+def _input_media(track: PlaylistTrack, caption: Optional[str] = None) -> InputMediaAudio:
+    """Трек для отправки в группе: по file_id или загруженным файлом с обложкой"""
+    return InputMediaAudio(
+        media=track.file_id or audio_input_file(track.file_path),
+        title=track.title,
+        performer=track.performer,
+        thumbnail=_thumbnail(track),
+        caption=caption,
+    )
+
+def _remember_file_id(track: PlaylistTrack, sent_message: Message) -> None:
+    """Запоминает file_id отправленного трека, чтобы повторные запросы обходились без скачивания"""
+    if track.file_id or not sent_message.audio:
+        return
+    file_id_registry.set(
+        track.video_id,
+        DEFAULT_AUDIO_PROFILE,
+        sent_message.audio.file_id,
+        file_unique_id=sent_message.audio.file_unique_id,
+        title=track.title,
+        performer=track.performer,
+        duration=sent_message.audio.duration,
+        file_size=sent_message.audio.file_size or track.file_size
+    )
+
+async def _send(send: Callable[[], Awaitable[Any]]) -> Any:
+    """Выполняет отправку, выжидая паузу, которую требует Telegram при превышении лимитов"""
+    for attempt in range(1, MAX_SEND_ATTEMPTS + 1):
+        try:
+            with observe_stage('upload'):
+                return await send()
+        except TelegramRetryAfter as e:
+            if attempt == MAX_SEND_ATTEMPTS:
+                raise
+            logger.warning(f"Telegram ограничил отправку плейлиста, повтор через {e.retry_after} с")
+            await asyncio.sleep(e.retry_after)
+
+async def send_batch(message: Message, batch: List[PlaylistTrack], is_group_chat: bool,
+                     progress: PlaylistProgress) -> None:
+    """
+    Отправляет готовые треки группы одним сообщением-альбомом (в исходном порядке).
+    Если Telegram просит подождать (лимиты отправки), отправка повторяется после паузы;
+    если Telegram не принял альбом, треки отправляются по одному.
+
+    Args:
+        message: Сообщение со ссылкой на плейлист
+        batch: Треки группы (не больше MEDIA_GROUP_SIZE)
+        is_group_chat: Флаг группового чата
+        progress: Сообщение о ходе загрузки
+    """
+    ready = [track for track in batch if track.ready]
+    if not ready:
+        return
+    caption = (
+        f"{progress.sender_info}<b>{html.escape(progress.title)}</b>: "
+        f"треки {ready[0].position}-{ready[-1].position} из {progress.total}"
+    )
+
+    if len(ready) > 1:
+        media = [_input_media(track) for track in ready[:-1]] + [_input_media(ready[-1], caption)]
+        try:
+            sent_messages = await _send(
+                lambda: (message.reply_media_group if is_group_chat else message.answer_media_group)(media=media)
+            )
+            for track, sent_message in zip(ready, sent_messages):
+                _remember_file_id(track, sent_message)
+            progress.sent += len(ready)
+            return
+        except (TelegramBadRequest, TelegramRetryAfter) as e:
+            # Например, недействительный file_id одного из треков
+            logger.warning(f"Не удалось отправить группу треков плейлиста, отправляю по одному: {e}")
+
+    for track in ready:
+        try:
+            sent_message = await _send(
+                lambda: (message.reply_audio if is_group_chat else message.answer_audio)(
+                    audio=track.file_id or audio_input_file(track.file_path),
+                    title=track.title,
+                    performer=track.performer,
+                    thumbnail=_thumbnail(track),
+                    caption=caption if track is ready[-1] else None,
+                )
+            )
+            _remember_file_id(track, sent_message)
+            progress.sent += 1
+        except (TelegramBadRequest, TelegramRetryAfter) as e:
+            record_failure('send', e)
+            logger.warning(f"Не удалось отправить трек {track.video_id} плейлиста: {e}")
+            if track.file_id and isinstance(e, TelegramBadRequest):
+                # file_id больше недействителен - при следующем запросе трек будет загружен заново
+                file_id_registry.remove(track.video_id, DEFAULT_AUDIO_PROFILE)
+            track.error = "ошибка отправки"
+            progress.failed += 1
+
+async def process_playlist(message: Message, url: str, status_message: Message, is_group_chat: bool,
+                           user_name: str, job_id: Optional[int] = None, delivered: int = 0) -> None:
+    """
+    Загружает треки плейлиста (не больше PLAYLIST_CONCURRENCY одновременно) и отправляет их
+    по порядку группами. Ход загрузки показывается в одном сообщении.
+
+    Args:
+        message: Сообщение со ссылкой на плейлист
+        url: Ссылка на плейлист
+        status_message: Сообщение о ходе загрузки
+        is_group_chat: Флаг группового чата
+        user_name: Имя пользователя для сообщений
+        job_id: ID задачи в журнале задач
+        delivered: Сколько первых треков уже отправлено (при возобновлении после перезапуска)
+    """
+    chat_id = message.chat.id
+    user_id = message.from_user.id
+    topic_id = message.message_thread_id if TOPICS_MODE_ENABLED else None
+    sender_info = f"Запрос от: {html.escape(user_name)}\n" if is_group_chat else ""
+    tracks: List[PlaylistTrack] = []
+    prepare_tasks: List[asyncio.Task] = []
+
+    try:
+        try:
+            playlist = await extract_playlist(url)
+        except Exception as e:
+            record_failure('extract', e)
+            logger.error(f"Не удалось получить плейлист {url}: {e}")
+            await status_message.edit_text(
+                f"❌ <b>Не удалось получить плейлист</b>\n\n"
+                f"{sender_info}"
+                f"Причина: {html.escape(str(e))}\n\n"
+                f"Пожалуйста, проверьте ссылку и попробуйте еще раз.",
+                reply_markup=get_main_keyboard()
+            )
+            return
+
+        tracks = [PlaylistTrack(position, entry) for position, entry in enumerate(playlist['entries'], start=1)]
+        progress = PlaylistProgress(status_message, playlist['title'], len(tracks), sender_info, playlist['truncated'])
+        progress.ready = progress.sent = min(delivered, len(tracks))
+        remaining = tracks[delivered:]
+        logger.info(
+            f"Загрузка плейлиста {url} для пользователя {user_id} в чате {chat_id}: "
+            f"{len(remaining)} из {len(tracks)} треков"
+        )
+
+        job_journal.set_stage(job_id, STAGE_DOWNLOADING)
+        await progress.update(force=True)
+
+        # Треки загружаются параллельно (не больше PLAYLIST_CONCURRENCY), каждый в своем слоте планировщика
+        # под ключом плейлиста, поэтому плейлист не занимает слоты пользователя для других его запросов
+        semaphore = asyncio.Semaphore(max(1, PLAYLIST_CONCURRENCY))
+        group = ('playlist', chat_id, status_message.message_id)
+        prepare_tasks = [
+            asyncio.create_task(prepare_track(track, semaphore, progress, user_id, chat_id, topic_id, group))
+            for track in remaining
+        ]
+
+        # Группы отправляются по порядку, как только готовы все их треки;
+        # следующие треки в это время продолжают загружаться
+        for start in range(0, len(remaining), MEDIA_GROUP_SIZE):
+            batch = remaining[start:start + MEDIA_GROUP_SIZE]
+            await asyncio.gather(*prepare_tasks[start:start + len(batch)])
+            job_journal.set_stage(job_id, STAGE_SENDING)
+            await send_batch(message, batch, is_group_chat, progress)
+            for track in batch:
+                await track.release()
+            delivered += len(batch)
+            job_journal.set_progress(job_id, delivered)
+            await progress.update(force=True)
+
+        await progress.finish(tracks)
+
+    except asyncio.CancelledError:
+        # Задача прервана остановкой бота - запись в журнале остается, задача возобновится после перезапуска
+        job_id = None
+        raise
+    except Exception as e:
+        record_failure('send', e)
+        logger.error(f"Ошибка при обработке плейлиста {url}: {e}")
+        try:
+            await status_message.edit_text(
+                f"❌ <b>Ошибка при загрузке плейлиста</b>\n\n"
+                f"Причина: {html.escape(str(e))}\n\n"
+                f"Пожалуйста, попробуйте еще раз.",
+                reply_markup=get_main_keyboard()
+            )
+        except TelegramAPIError:
+            pass
+    finally:
+        # Останавливаем загрузку оставшихся треков и освобождаем их файлы
+        for task in prepare_tasks:
+            if not task.done():
+                task.cancel()
+        if prepare_tasks:
+            await asyncio.gather(*prepare_tasks, return_exceptions=True)
+        for track in tracks:
+            await track.release()
+
+        # Пользователь получил ответ - задача больше не возобновляется
+        job_journal.finish(job_id)
+        active_playlist_tasks.pop(f"{chat_id}_{user_id}_{url}", None)
+
+async def process_playlist_link(message: Message, url: str, is_group_chat: bool, user_name: str) -> None:
+    """
+    Запускает загрузку плейлиста по ссылке в фоне
+
+    Args:
+        message: Сообщение со ссылкой на плейлист
+        url: Ссылка на плейлист
+        is_group_chat: Флаг группового чата
+        user_name: Имя пользователя для сообщений
+    """
+    chat_id = message.chat.id
+    user_id = message.from_user.id
+    logger.info(
+        f"Пользователь {user_id} ({user_name}) отправил ссылку на плейлист в чате {chat_id} "
+        f"(не больше {PLAYLIST_MAX_TRACKS} треков): {url}"
+    )
+    status_message = await (message.reply if is_group_chat else message.answer)(PLAYLIST_LOADING_TEXT)
+
+    # Записываем задачу в журнал, чтобы она пережила перезапуск бота
+    job_id = job_journal.add('playlist', message, message.from_user, status_message, url, None, is_group_chat)
+
+    task = asyncio.create_task(
+        process_playlist(message, url, status_message, is_group_chat, user_name, job_id)
+    )
+    active_playlist_tasks[f"{chat_id}_{user_id}_{url}"] = task
+
+async def resume_playlist_job(bot, job, loading_message):
+    """
+    Перезапускает загрузку плейлиста из журнала: уже отправленные треки пропускаются
+
+    Args:
+        bot: Экземпляр бота
+        job: Запись журнала задач
+        loading_message: Сообщение о ходе загрузки
+    """
+    message = job_journal.restore_message(bot, job)
+    task = asyncio.create_task(
+        process_playlist(
+            message, job['url'], loading_message, bool(job['is_group_chat']), job['user_name'],
+            job['id'], job['progress']
+        )
+    )
+    active_playlist_tasks[f"{job['chat_id']}_{job['user_id']}_{job['url']}"] = task
+
+job_journal.register_resumer('playlist', resume_playlist_job)
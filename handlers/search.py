@@ -9,13 +9,22 @@ from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.enums import ChatType
 from aiogram.filters import Command, CommandObject
+from aiogram.exceptions import TelegramBadRequest
 from typing import List, Dict, Optional, Union, Tuple
 import asyncio
+from contextlib import nullcontext
 
 from keyboards.inline import get_main_keyboard
-from services.youtube import search_youtube_music, download_audio_from_youtube, MAX_TELEGRAM_FILE_SIZE
+from services.youtube import search_youtube_music, download_audio_from_youtube, open_audio_stream, release_downloaded_files, AdmissionError, is_audio_available, MAX_TELEGRAM_FILE_SIZE, DEFAULT_AUDIO_PROFILE
+from services.file_id_registry import file_id_registry
+from services.bot_api import audio_input_file
+from services.metrics import TIME_TO_AUDIO, observe_stage, record_cache_lookup, record_failure
+from services.scheduler import download_scheduler
+from services.job_journal import job_journal, STAGE_DOWNLOADING, STAGE_SENDING
+from services.prefetch import search_prefetcher
+from handlers.link_handler import LOADING_MESSAGE_TEXT
 from services.user_state import user_state_manager
-from config import GROUP_MODE_ENABLED, TOPICS_MODE_ENABLED, is_allowed_chat
+from config import GROUP_MODE_ENABLED, TOPICS_MODE_ENABLED, is_allowed_chat, STREAMING_MODE_ENABLED
 
 logger = logging.getLogger(__name__)
 router = Router()
@@ -60,7 +69,7 @@ class SearchStates(StatesGroup):
 active_download_tasks = {}
 
 # Функция для обработки скачивания и отправки аудио
-async def process_and_send_audio_download(callback, url, loading_message, is_group_chat, user_name, video_id):
+async def process_and_send_audio_download(callback, url, loading_message, is_group_chat, user_name, video_id, job_id=None):
     """
     Асинхронная функция для скачивания и отправки аудио пользователю.
     Запускается как отдельная задача, чтобы не блокировать основной поток обработки сообщений.
@@ -72,16 +81,79 @@ async def process_and_send_audio_download(callback, url, loading_message, is_gro
         is_group_chat: Флаг группового чата
         user_name: Имя пользователя для сообщений
         video_id: ID видео YouTube
+        job_id: ID задачи в журнале задач
     """
+    # Начало обработки запроса (для метрики времени до отправки аудио)
+    started = time.perf_counter()
     chat_id = callback.message.chat.id
     user_id = callback.from_user.id
     file_path = None
     thumb_path = None
-    
+    audio_stream = None
+    # Информация об отправителе для группового чата
+    sender_info = f"Запрос от: {user_name}\n" if is_group_chat else ""
+
     try:
+        # Подпись к аудио с информацией об отправителе
+        caption = f"Аудио успешно загружено\nЗапрос от: Пользователь {user_name}"
+
+        # Если трек уже отправлялся, пересылаем его по file_id без скачивания
+        cached_audio = file_id_registry.get(video_id, DEFAULT_AUDIO_PROFILE)
+        if video_id:
+            record_cache_lookup('file_id', bool(cached_audio))
+        if cached_audio:
+            try:
+                await callback.message.reply_audio(
+                    audio=cached_audio['file_id'],
+                    caption=caption,
+                    title=cached_audio['title'],
+                    performer=cached_audio['performer'],
+                    duration=cached_audio['duration'],
+                    reply_to_message_id=None if is_group_chat else callback.message.message_id,
+                    parse_mode="HTML"
+                )
+                await loading_message.delete()
+                TIME_TO_AUDIO.labels(source='file_id').observe(time.perf_counter() - started)
+                logger.info(f"Аудио для видео {video_id} отправлено по сохраненному file_id")
+                return
+            except TelegramBadRequest as e:
+                # file_id больше недействителен - удаляем его и скачиваем трек заново
+                logger.warning(f"Не удалось отправить аудио по file_id для видео {video_id}: {e}")
+                file_id_registry.remove(video_id, DEFAULT_AUDIO_PROFILE)
+
         # Скачивание аудио и получение метаданных
         try:
-            download_result = await download_audio_from_youtube(url)
+            # Если результат уже готовится заранее, загрузка продолжит с готового
+            await search_prefetcher.join(video_id)
+
+            # Новые загрузки проходят через планировщик; трек из кэша или уже
+            # загружаемый по другому запросу не занимает слот
+            audio_available = is_audio_available(url)
+            if audio_available:
+                download_slot = nullcontext()
+            else:
+                topic_id = callback.message.message_thread_id if TOPICS_MODE_ENABLED else None
+                download_slot = download_scheduler.slot(
+                    user_id, chat_id, topic_id,
+                    on_position=lambda position: loading_message.edit_text(
+                        f"⏳ <b>Загрузка в очереди</b>\n\n"
+                        f"Позиция в очереди: <b>{position}</b>\n\n"
+                        f"<i>Загрузка начнется автоматически, пожалуйста, подождите...</i>"
+                    )
+                )
+
+            async with download_slot as job:
+                job_journal.set_stage(job_id, STAGE_DOWNLOADING)
+                if job and job.was_queued:
+                    # Задача ждала в очереди - возвращаем сообщение о загрузке
+                    await loading_message.edit_text(LOADING_MESSAGE_TEXT)
+                # В потоковом режиме новый трек передается в Telegram через ffmpeg без временных файлов
+                stream_result = await open_audio_stream(url) if STREAMING_MODE_ENABLED and not audio_available else None
+                if stream_result:
+                    audio_stream, metadata, estimated_size, stream_thumb_path = stream_result
+                    download_result = (None, metadata, stream_thumb_path)
+                else:
+                    download_result = await download_audio_from_youtube(url)
             # Убедимся, что у нас есть кортеж с тремя элементами
             if isinstance(download_result, tuple) and len(download_result) == 3:
                 file_path, metadata, thumb_path = download_result
@@ -91,7 +163,20 @@ async def process_and_send_audio_download(callback, url, loading_message, is_gro
                 metadata = download_result[1] if isinstance(download_result, tuple) and len(download_result) > 1 else {}
                 thumb_path = download_result[2] if isinstance(download_result, tuple) and len(download_result) > 2 else None
                 logger.warning(f"Неожиданный формат результата download_audio_from_youtube: {download_result}")
+        except AdmissionError as admission_error:
+            record_failure('admission', admission_error)
+            # Трек отклонен до загрузки - сообщаем причину
+            await loading_message.delete()
+            await (callback.message.reply if is_group_chat else callback.message.answer)(
+                f"⚠️ <b>Трек не может быть отправлен</b>\n\n"
+                f"{sender_info}"
+                f"Причина: {admission_error}\n\n"
+                f"Попробуйте другой трек.",
+                reply_markup=get_main_keyboard()
+            )
+            return
         except Exception as download_error:
+            record_failure('download', download_error)
             logger.error(f"Ошибка при загрузке аудио: {download_error}")
             await loading_message.delete()
             await (callback.message.reply if is_group_chat else callback.message.answer)(
@@ -102,10 +187,13 @@ async def process_and_send_audio_download(callback, url, loading_message, is_gro
             )
             return
         
-        if not file_path or not os.path.exists(file_path):
+        if audio_stream:
+            # Точный размер станет известен только после передачи
+            file_size = estimated_size
+        elif not file_path or not os.path.exists(file_path):
             raise FileNotFoundError(f"Файл не найден: {file_path}")
-            
-        file_size = os.path.getsize(file_path)
+        else:
+            file_size = os.path.getsize(file_path)
         
         # Подготавливаем метаданные для отправки
         title = metadata.get('title', 'Unknown Title')
@@ -116,22 +204,17 @@ async def process_and_send_audio_download(callback, url, loading_message, is_gro
         # Генерируем понятное название аудиофайла без артиста, если его нет или это "Unknown Artist"
         display_title = title
         
-        # Добавляем информацию об отправителе для группового чата
-        sender_info = f"Запрос от: {user_name}\n" if is_group_chat else ""
-        
         # Проверяем размер файла
         if file_size > MAX_TELEGRAM_FILE_SIZE:
             await loading_message.delete()
             await (callback.message.reply if is_group_chat else callback.message.answer)(
                 f"⚠️ <b>Файл слишком большой для отправки</b>\n\n"
                 f"{sender_info}"
-                f"Размер файла: <b>{file_size / 1024 / 1024:.1f} МБ</b>\n"
-                f"Лимит Telegram: <b>50 МБ</b>\n\n"
+                f"Размер файла: <b>{'~' if audio_stream else ''}{file_size / 1024 / 1024:.1f} МБ</b>\n"
+                f"Лимит Telegram: <b>{MAX_TELEGRAM_FILE_SIZE // 1024 // 1024} МБ</b>\n\n"
                 f"Попробуйте трек с меньшей длительностью.",
                 reply_markup=get_main_keyboard()
             )
-            # Удаляем файл
-            os.remove(file_path)
             return
         
         # Информативное сообщение о готовности аудио
@@ -141,12 +224,13 @@ async def process_and_send_audio_download(callback, url, loading_message, is_gro
         if artist and artist != 'Unknown Artist':
             info_message += f"<b>Исполнитель:</b> {artist}\n"
             
-        info_message += f"<b>Размер файла:</b> <b>{file_size / 1024 / 1024:.1f} МБ</b>\n\n<i>Отправляю файл...</i>"
+        info_message += f"<b>Размер файла:</b> <b>{'~' if audio_stream else ''}{file_size / 1024 / 1024:.1f} МБ</b>\n\n<i>Отправляю файл...</i>"
         
         await loading_message.edit_text(info_message)
+        job_journal.set_stage(job_id, STAGE_SENDING)
         
-        # Создаем FSInputFile вместо открытия файла напрямую
-        audio_file = FSInputFile(file_path)
+        # Файл для отправки: FSInputFile, путь для локального сервера Bot API или поток
+        audio_file = audio_stream or audio_input_file(file_path)
         
         # Подготавливаем обложку для Telegram, если она есть
         thumbnail = None
@@ -154,65 +238,50 @@ async def process_and_send_audio_download(callback, url, loading_message, is_gro
             thumbnail = FSInputFile(thumb_path)
             logger.info(f"Подготовлена обложка для Telegram: {thumb_path}")
         
-        # Отправляем аудио пользователю
-        caption = f"Аудио успешно загружено\nЗапрос от: Пользователь {user_name}"
-        
         # Определяем, нужно ли отправлять performer (исполнителя) в аудио
         performer = None
         if artist and artist != 'Unknown Artist':
             performer = artist
             
-        await callback.message.reply_audio(
-            audio=audio_file,
-            caption=caption,
-            title=title,
-            performer=performer,
-            duration=int(metadata.get('duration_sec', 0)),
-            thumbnail=thumbnail,
-            reply_to_message_id=None if is_group_chat else callback.message.message_id,
-            parse_mode="HTML"
-        )
+        # Отправляем аудио пользователю
+        with observe_stage('upload'):
+            sent_message = await callback.message.reply_audio(
+                audio=audio_file,
+                caption=caption,
+                title=title,
+                performer=performer,
+                duration=int(metadata.get('duration_sec', 0)),
+                thumbnail=thumbnail,
+                reply_to_message_id=None if is_group_chat else callback.message.message_id,
+                parse_mode="HTML"
+            )
+
+        TIME_TO_AUDIO.labels(
+            source='stream' if audio_stream else ('cache' if audio_available else 'download')
+        ).observe(time.perf_counter() - started)
+
+        # Запоминаем file_id, чтобы повторные запросы отправлялись без скачивания
+        if sent_message.audio:
+            file_id_registry.set(
+                video_id,
+                DEFAULT_AUDIO_PROFILE,
+                sent_message.audio.file_id,
+                file_unique_id=sent_message.audio.file_unique_id,
+                title=title,
+                performer=performer,
+                duration=sent_message.audio.duration,
+                file_size=sent_message.audio.file_size or file_size
+            )
         
         # Удаление сообщения о загрузке
         await loading_message.delete()
         
-        # Удаление файла после отправки
-        try:
-            # Попытка удаления аудиофайла с повторными попытками
-            file_deleted = False
-            for attempt in range(5):
-                try:
-                    if os.path.exists(file_path):
-                        os.remove(file_path)
-                        logger.info(f"Файл {file_path} успешно отправлен и удален")
-                        file_deleted = True
-                        break
-                    else:
-                        logger.warning(f"Файл {file_path} не найден для удаления")
-                        file_deleted = True
-                        break
-                except PermissionError:
-                    # Если файл заблокирован, ждем немного и пробуем снова
-                    logger.warning(f"Файл {file_path} заблокирован, попытка {attempt+1}/5")
-                    time.sleep(0.5)
-                except Exception as e:
-                    logger.warning(f"Не удалось удалить файл {file_path}: {e}")
-                    break
-            
-            if not file_deleted:
-                logger.warning(f"Не удалось удалить файл {file_path} после 5 попыток")
-            
-            # Удаляем обложку, если она существует
-            if thumb_path and os.path.exists(thumb_path):
-                try:
-                    os.remove(thumb_path)
-                    logger.info(f"Файл обложки {thumb_path} удален")
-                except Exception as e:
-                    logger.warning(f"Не удалось удалить файл обложки {thumb_path}: {e}")
-        except Exception as e:
-            logger.warning(f"Ошибка при очистке файлов: {e}")
-        
+    except asyncio.CancelledError:
+        # Задача прервана остановкой бота - запись в журнале остается, задача возобновится после перезапуска
+        job_id = None
+        raise
     except Exception as e:
+        record_failure('send', e)
         logger.error(f"Ошибка при обработке запроса на скачивание: {e}")
         await loading_message.delete()
         await (callback.message.reply if is_group_chat else callback.message.answer)(
@@ -222,6 +291,13 @@ async def process_and_send_audio_download(callback, url, loading_message, is_gro
             reply_markup=get_main_keyboard()
         )
     finally:
+        # Освобождаем файлы: запись кэша отпускается, временные файлы удаляются
+        if file_path or thumb_path:
+            await release_downloaded_files(file_path, thumb_path)
+
+        # Пользователь получил ответ - задача больше не возобновляется
+        job_journal.finish(job_id)
+
         # Удаляем задачу из словаря активных задач
         task_key = f"{chat_id}_{user_id}_{video_id}"
         if task_key in active_download_tasks:
@@ -304,7 +380,7 @@ async def process_search_query(message: Message, state: FSMContext):
         await state.set_state(SearchStates.browsing_results)
         
         # Отображаем первую страницу результатов
-        await display_search_results_page(message, pagination)
+        await display_search_results_page(message, pagination, state=state)
         
     except Exception as e:
         logger.error(f"Ошибка при обработке поискового запроса: {e}")
@@ -316,7 +392,7 @@ async def process_search_query(message: Message, state: FSMContext):
         await state.clear()
 
 # Обновляем функцию для отображения страницы результатов
-async def display_search_results_page(message_or_callback, pagination, edit_message=False, is_reply=False):
+async def display_search_results_page(message_or_callback, pagination, edit_message=False, is_reply=False, state=None):
     """
     Отображает страницу результатов поиска.
     
@@ -325,6 +401,7 @@ async def display_search_results_page(message_or_callback, pagination, edit_mess
         pagination: Объект пагинации
         edit_message: Редактировать ли существующее сообщение (для CallbackQuery)
         is_reply: Отправлять ли результаты как ответ на сообщение (для групповых чатов)
+        state: Контекст FSM пользователя (для сброса состояния в личном чате)
     """
     # Получаем результаты для текущей страницы
     page_results = pagination.get_page_results()
@@ -435,9 +512,8 @@ async def display_search_results_page(message_or_callback, pagination, edit_mess
         
         # Сбрасываем состояние просмотра результатов для пользователя только в приватном чате
         if message_or_callback.message.chat.type == ChatType.PRIVATE:
-            state = Dispatcher.get_current().fsm_storage
             if state:
-                await state.set_state(user=user_id, chat=chat_id, state=None)
+                await state.set_state(None)
     else:
         # Для Message
         chat_id = message_or_callback.chat.id
@@ -453,9 +529,8 @@ async def display_search_results_page(message_or_callback, pagination, edit_mess
         
         # Сбрасываем состояние просмотра результатов для пользователя только в приватном чате
         if message_or_callback.chat.type == ChatType.PRIVATE:
-            state = Dispatcher.get_current().fsm_storage
             if state:
-                await state.set_state(user=user_id, chat=chat_id, state=None)
+                await state.set_state(None)
     
     # Сохраняем результаты поиска в хранилище по ID сообщения для возможности навигации
     if result_message and chat_id:
@@ -465,6 +540,10 @@ async def display_search_results_page(message_or_callback, pagination, edit_mess
             result_message.message_id, 
             pagination.__dict__
         )
+
+        # Пока пользователь читает новые результаты, первые из них готовятся заранее
+        if not edit_message and pagination.page == 0:
+            search_prefetcher.schedule(user_id, chat_id, topic_id, result_message.message_id, pagination.results)
         
         # При первой отправке message_id еще не известен, поэтому обновляем callback_data
         if not message_id and result_message:
@@ -559,7 +638,7 @@ async def process_next_page(callback: CallbackQuery, state: FSMContext):
         await state.update_data(pagination=pagination.__dict__)
     
     # Отображаем следующую страницу
-    await display_search_results_page(callback, pagination, edit_message=True)
+    await display_search_results_page(callback, pagination, edit_message=True, state=state)
 
 @router.callback_query(F.data.startswith("search_prev_page"))
 async def process_prev_page(callback: CallbackQuery, state: FSMContext):
@@ -633,7 +712,7 @@ async def process_prev_page(callback: CallbackQuery, state: FSMContext):
         await state.update_data(pagination=pagination.__dict__)
     
     # Отображаем предыдущую страницу
-    await display_search_results_page(callback, pagination, edit_message=True)
+    await display_search_results_page(callback, pagination, edit_message=True, state=state)
 
 @router.callback_query(F.data == "new_search")
 async def process_new_search_callback(callback: CallbackQuery, state: FSMContext):
@@ -651,6 +730,9 @@ async def process_new_search_callback(callback: CallbackQuery, state: FSMContext
         await callback.answer("Доступ ограничен", show_alert=True)
         return
     
+    # Пользователь ушел от результатов - их упреждающая загрузка больше не нужна
+    search_prefetcher.abandon(chat_id, callback.message.message_id)
+
     # Очищаем состояние просмотра результатов независимо от типа чата
     if chat_type in {ChatType.GROUP, ChatType.SUPERGROUP} and GROUP_MODE_ENABLED:
         # В групповом чате используем локальный менеджер состояний
@@ -707,7 +789,7 @@ async def process_search_suggestion(callback: CallbackQuery, state: FSMContext):
         await state.set_state(SearchStates.browsing_results)
         
         # Отображаем первую страницу результатов
-        await display_search_results_page(callback, pagination)
+        await display_search_results_page(callback, pagination, state=state)
         
     except Exception as e:
         logger.error(f"Ошибка при обработке поискового запроса: {e}")
@@ -743,19 +825,20 @@ async def process_download_callback(callback: CallbackQuery):
     
     # Отправляем сообщение о начале загрузки
     loading_message = await (callback.message.reply if is_group_chat else callback.message.answer)(
-        "⏳ <b>Загружаю аудио...</b>\n\n"
-        "• Получение информации о треке\n"
-        "• Выбор аудиопотока\n"
-        "• Загрузка и конвертация\n\n"
-        "<i>Пожалуйста, подождите. Это может занять 10-30 секунд...</i>"
+        LOADING_MESSAGE_TEXT
     )
     
+    # Записываем задачу в журнал, чтобы она пережила перезапуск бота
+    job_id = job_journal.add(
+        'search', callback.message, callback.from_user, loading_message, url, video_id, is_group_chat
+    )
+
     # Создаем ключ для отслеживания задачи с учетом уникального видео ID
     task_key = f"{chat_id}_{user_id}_{video_id}"
     
     # Создаем асинхронную задачу обработки
     task = asyncio.create_task(
-        process_and_send_audio_download(callback, url, loading_message, is_group_chat, user_name, video_id)
+        process_and_send_audio_download(callback, url, loading_message, is_group_chat, user_name, video_id, job_id)
     )
     
     # Сохраняем задачу в словаре активных задач
@@ -764,6 +847,33 @@ async def process_download_callback(callback: CallbackQuery):
     # Не ожидаем завершения задачи - она выполнится в фоне
     logger.info(f"Запущена асинхронная обработка запроса на скачивание для {user_id} в чате {chat_id}, видео {video_id}")
 
+async def resume_download_job(bot, job, loading_message):
+    """
+    Перезапускает задачу из журнала, не завершенную до перезапуска бота
+
+    Args:
+        bot: Экземпляр бота
+        job: Запись журнала задач
+        loading_message: Сообщение-индикатор загрузки
+    """
+    # Обработчику нужны только сообщение с результатами поиска и пользователь из callback
+    callback = CallbackQuery(
+        id=f"resume:{job['id']}",
+        from_user=job_journal.restore_user(job),
+        chat_instance=str(job['chat_id']),
+        message=job_journal.restore_message(bot, job),
+        data=f"download:{job['video_id']}",
+    ).as_(bot)
+    task = asyncio.create_task(
+        process_and_send_audio_download(
+            callback, job['url'], loading_message, bool(job['is_group_chat']), job['user_name'],
+            job['video_id'], job['id']
+        )
+    )
+    active_download_tasks[f"{job['chat_id']}_{job['user_id']}_{job['video_id']}"] = task
+
+job_journal.register_resumer('search', resume_download_job)
+
 @router.callback_query(F.data == "back_to_main")
 async def process_back_callback(callback: CallbackQuery):
     """
@@ -855,7 +965,7 @@ async def cmd_search(message: Message, state: FSMContext, command: CommandObject
             await state.set_state(SearchStates.browsing_results)
             
             # Отображаем первую страницу результатов
-            await display_search_results_page(message, pagination)
+            await display_search_results_page(message, pagination, state=state)
             
         except Exception as e:
             logger.error(f"Ошибка при обработке поискового запроса: {e}")
@@ -1035,7 +1145,7 @@ async def process_select_page(callback: CallbackQuery, state: FSMContext):
         await state.update_data(pagination=pagination.__dict__)
     
     # Отображаем выбранную страницу
-    await display_search_results_page(callback, pagination, edit_message=True) 
+    await display_search_results_page(callback, pagination, edit_message=True, state=state) 
 
 # Добавляем общий обработчик для любых текстовых сообщений в личных чатах
 # Используем низкий приоритет, чтобы этот обработчик сработал только если сообщение не обработано другими обработчиками
@@ -1116,7 +1226,7 @@ async def process_any_text_as_search(message: Message, state: FSMContext):
         await state.set_state(SearchStates.browsing_results)
         
         # Отображаем первую страницу результатов
-        await display_search_results_page(message, pagination)
+        await display_search_results_page(message, pagination, state=state)
         
     except Exception as e:
         logger.error(f"Ошибка при обработке поискового запроса: {e}")
@@ -6,10 +6,22 @@ from aiogram.enums import ParseMode
 from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.client.default import DefaultBotProperties
 
-from config import BOT_TOKEN, GROUP_MODE_ENABLED
+from config import BOT_TOKEN, GROUP_MODE_ENABLED, JOB_RESUME_ENABLED
 from handlers import routers
 from services.youtube import force_cleanup_downloads_folder
 from services.commands import set_commands
+from services.ydl_engine import ydl_engine
+from services.janitor import downloads_janitor
+from services.thumbnails import thumbnail_service
+from services.ranged_download import ranged_downloader
+from services.transcoder import transcoder
+from services.bot_api import create_bot_session
+from services.metrics import start_metrics_server
+from services.job_journal import job_journal
+from services.prefetch import search_prefetcher
+from services.ytmusic_pool import ytmusic_pool
+from services.search_executor import search_executor
+from services.search_cache import search_cache
 
 # Настройка логирования
 logger = logging.getLogger(__name__)
@@ -33,12 +45,22 @@ async def main():
         logger.info("Режим групповых чатов ОТКЛЮЧЕН")
 
     # Принудительная очистка папки загрузок при запуске
-    force_cleanup_downloads_folder()
-    logger.info("Директория загрузок полностью очищена")
+    # (частично загруженные файлы незавершенных задач сохраняются для возобновления)
+    pending_jobs = job_journal.pending() if JOB_RESUME_ENABLED else []
+    force_cleanup_downloads_folder(keep_video_ids=[job['video_id'] for job in pending_jobs if job['video_id']])
+    logger.info("Директория загрузок очищена")
+
+    # HTTP-эндпоинт /metrics для Prometheus
+    start_metrics_server()
+
+    # Запускаем исполнитель yt-dlp заранее, чтобы рабочие процессы успели прогреться
+    ydl_engine.start()
 
     # Создание экземпляров бота и диспетчера с использованием нового синтаксиса для DefaultBotProperties
+    # (при заданном TELEGRAM_API_SERVER - через собственный сервер Bot API)
     bot = Bot(
         token=BOT_TOKEN, 
+        session=create_bot_session(),
         default=DefaultBotProperties(parse_mode=ParseMode.HTML)
     )
     
@@ -59,8 +81,27 @@ async def main():
     
     # Пропуск накопившихся апдейтов и запуск поллинга
     await bot.delete_webhook(drop_pending_updates=True)
+    # Фоновая очистка директории загрузок от оставшихся файлов
+    downloads_janitor.start()
+    # Прогрев и фоновая проверка клиентов YouTube Music
+    ytmusic_pool.start()
+
+    # Возобновляем загрузки, прерванные остановкой или падением бота
+    await job_journal.resume(bot)
+
     logger.info("Бот успешно запущен и готов к работе")
-    await dp.start_polling(bot)
+    try:
+        await dp.start_polling(bot)
+    finally:
+        await search_prefetcher.shutdown()
+        await search_cache.shutdown()
+        await ytmusic_pool.stop()
+        search_executor.shutdown()
+        await downloads_janitor.stop()
+        await thumbnail_service.close()
+        await ranged_downloader.close()
+        await transcoder.shutdown()
+        ydl_engine.shutdown()
 
 if __name__ == "__main__":
     try:
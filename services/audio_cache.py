@@ -0,0 +1,336 @@
+import errno
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Dict, Optional
+
+from config import AUDIO_CACHE_DIR, AUDIO_CACHE_MAX_BYTES
+
+logger = logging.getLogger(__name__)
+
+class AudioCache:
+    """
+    Дисковый кэш готовых аудиофайлов с адресацией по videoId и профилю кодирования.
+
+    Файлы переносятся в кэш атомарно (os.replace), индекс хранится в SQLite,
+    поэтому кэш переживает перезапуски и аварийные остановки бота.
+    Размер кэша ограничен бюджетом в байтах, при превышении удаляются
+    давно не использованные записи (LRU). Записи, файлы которых сейчас
+    отправляются пользователям, защищены счетчиком ссылок и не удаляются.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int):
+        self._cache_dir = cache_dir
+        self._max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+        # Счетчики ссылок на записи: key -> количество активных пользователей файла
+        self._refs: Dict[str, int] = {}
+        # Обратный индекс путей к файлам для освобождения записи по пути: path -> key
+        self._paths: Dict[str, str] = {}
+
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(os.path.join(cache_dir, "index.sqlite3"), check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS entries (
+                    key TEXT PRIMARY KEY,
+                    video_id TEXT NOT NULL,
+                    profile TEXT NOT NULL,
+                    audio_file TEXT NOT NULL,
+                    thumb_file TEXT,
+                    metadata TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_used_at REAL NOT NULL,
+                    hits INTEGER NOT NULL DEFAULT 0
+                )
+                """
+            )
+
+        self._total_bytes = 0
+        self._recover()
+        logger.info(
+            f"Кэш аудио открыт: {cache_dir} "
+            f"(занято {self._total_bytes / 1024 / 1024:.1f} МБ из {max_bytes / 1024 / 1024:.0f} МБ)"
+        )
+
+    @staticmethod
+    def make_key(video_id: str, profile: str) -> str:
+        """Формирует ключ записи кэша из ID видео и профиля кодирования"""
+        return f"{video_id}.{profile}"
+
+    def _path(self, file_name: Optional[str]) -> Optional[str]:
+        """Возвращает абсолютный путь к файлу кэша по имени файла"""
+        return os.path.join(self._cache_dir, file_name) if file_name else None
+
+    def _recover(self) -> None:
+        """
+        Сверяет индекс с содержимым директории после запуска.
+        Удаляет записи без файлов и файлы без записей (остатки прерванных операций).
+        """
+        with self._lock, self._conn:
+            known_files = set()
+            for row in self._conn.execute("SELECT key, audio_file, thumb_file, size FROM entries").fetchall():
+                if not os.path.exists(self._path(row["audio_file"])):
+                    logger.warning(f"Файл записи кэша {row['key']} не найден, запись удалена")
+                    self._conn.execute("DELETE FROM entries WHERE key = ?", (row["key"],))
+                    continue
+                known_files.add(row["audio_file"])
+                if row["thumb_file"]:
+                    known_files.add(row["thumb_file"])
+                self._total_bytes += row["size"]
+
+            for file_name in os.listdir(self._cache_dir):
+                if file_name.startswith("index.sqlite3") or file_name in known_files:
+                    continue
+                try:
+                    os.remove(os.path.join(self._cache_dir, file_name))
+                    logger.info(f"Удален неучтенный файл кэша: {file_name}")
+                except OSError as e:
+                    logger.warning(f"Не удалось удалить неучтенный файл кэша {file_name}: {e}")
+
+    def _stage(self, src_path: str, file_name: str) -> str:
+        """
+        Перемещает файл во временный файл в директории кэша (без блокировки индекса).
+        Если исходный файл на другом разделе, копирует его. Временный файл затем атомарно
+        переименовывается в файл записи; после сбоя он удаляется при следующем запуске.
+        """
+        tmp_path = os.path.join(self._cache_dir, f".{file_name}.{uuid.uuid4().hex[:8]}.tmp")
+        try:
+            os.replace(src_path, tmp_path)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            try:
+                shutil.copyfile(src_path, tmp_path)
+            except BaseException:
+                self._remove_file(tmp_path)
+                raise
+            os.remove(src_path)
+        return tmp_path
+
+    @staticmethod
+    def _remove_file(path: Optional[str]) -> None:
+        """Удаляет файл, если он существует"""
+        if path:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _entry_from_row(self, row: sqlite3.Row) -> Dict[str, Any]:
+        """Преобразует строку индекса в описание записи кэша"""
+        return {
+            "key": row["key"],
+            "audio_path": self._path(row["audio_file"]),
+            "thumb_path": self._path(row["thumb_file"]),
+            "metadata": json.loads(row["metadata"]),
+            "size": row["size"],
+        }
+
+    def _add_ref(self, entry: Dict[str, Any], count: int = 1) -> None:
+        """Увеличивает счетчик ссылок записи"""
+        if count <= 0:
+            return
+        self._refs[entry["key"]] = self._refs.get(entry["key"], 0) + count
+        self._paths[entry["audio_path"]] = entry["key"]
+
+    def acquire(self, video_id: str, profile: str) -> Optional[Dict[str, Any]]:
+        """
+        Ищет запись в кэше и захватывает ее (запрещает удаление до вызова release)
+
+        Args:
+            video_id: ID видео YouTube
+            profile: Профиль кодирования аудио
+
+        Returns:
+            Словарь с путями к аудио и обложке и метаданными или None при промахе
+        """
+        key = self.make_key(video_id, profile)
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT * FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+
+            entry = self._entry_from_row(row)
+            if not os.path.exists(entry["audio_path"]):
+                logger.warning(f"Файл записи кэша {key} исчез, запись удалена")
+                self._delete_entry(row)
+                return None
+
+            self._conn.execute(
+                "UPDATE entries SET last_used_at = ?, hits = hits + 1 WHERE key = ?",
+                (time.time(), key)
+            )
+            self._add_ref(entry)
+        logger.info(f"Аудио для видео {video_id} найдено в кэше (профиль {profile})")
+        return entry
+
+    def contains(self, video_id: str, profile: str) -> bool:
+        """Проверяет наличие записи в кэше без ее захвата"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT audio_file FROM entries WHERE key = ?", (self.make_key(video_id, profile),)
+            ).fetchone()
+        return row is not None and os.path.exists(self._path(row["audio_file"]))
+
+    def put(self, video_id: str, profile: str, audio_src: str, thumb_src: Optional[str],
+            metadata: Dict[str, Any], refs: int = 1) -> Dict[str, Any]:
+        """
+        Помещает готовый аудиофайл (и обложку) в кэш.
+        Выполняет файловые операции (на другом разделе - копирование), поэтому из асинхронного
+        кода вызывается через asyncio.to_thread.
+
+        Args:
+            video_id: ID видео YouTube
+            profile: Профиль кодирования аудио
+            audio_src: Путь к готовому аудиофайлу (файл будет перемещен в кэш)
+            thumb_src: Путь к обложке или None (файл будет перемещен в кэш)
+            metadata: Метаданные трека
+            refs: Сколько ссылок на запись захватить сразу
+
+        Returns:
+            Словарь с путями к файлам в кэше и метаданными
+        """
+        key = self.make_key(video_id, profile)
+        audio_file = f"{key}{os.path.splitext(audio_src)[1]}"
+        thumb_file = f"{key}.thumb{os.path.splitext(thumb_src)[1]}" if thumb_src else None
+
+        # Файлы переносятся в директорию кэша до захвата блокировки, чтобы копирование
+        # с другого раздела не задерживало обращения к кэшу
+        audio_tmp = self._stage(audio_src, audio_file)
+        thumb_tmp = None
+        if thumb_file:
+            try:
+                thumb_tmp = self._stage(thumb_src, thumb_file)
+            except OSError as e:
+                logger.warning(f"Не удалось поместить обложку в кэш: {e}")
+                thumb_file = None
+
+        with self._lock:
+            # Если запись уже существует (например, после гонки), заменяем ее
+            old_row = self._conn.execute("SELECT * FROM entries WHERE key = ?", (key,)).fetchone()
+            if old_row is not None and not self._refs.get(key):
+                with self._conn:
+                    self._delete_entry(old_row)
+                old_row = None
+
+            if old_row is not None:
+                # Старая запись сейчас используется - не трогаем ее файлы, отдаем ее же
+                for tmp_path in (audio_tmp, thumb_tmp):
+                    self._remove_file(tmp_path)
+                entry = self._entry_from_row(old_row)
+                self._add_ref(entry, refs)
+                return entry
+
+            os.replace(audio_tmp, self._path(audio_file))
+            if thumb_tmp:
+                os.replace(thumb_tmp, self._path(thumb_file))
+
+            size = os.path.getsize(self._path(audio_file))
+            if thumb_file:
+                size += os.path.getsize(self._path(thumb_file))
+
+            now = time.time()
+            with self._conn:
+                self._conn.execute(
+                    """
+                    INSERT INTO entries (key, video_id, profile, audio_file, thumb_file, metadata,
+                                         size, created_at, last_used_at, hits)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 0)
+                    """,
+                    (key, video_id, profile, audio_file, thumb_file,
+                     json.dumps(metadata, ensure_ascii=False), size, now, now)
+                )
+            self._total_bytes += size
+
+            entry = {
+                "key": key,
+                "audio_path": self._path(audio_file),
+                "thumb_path": self._path(thumb_file),
+                "metadata": metadata,
+                "size": size,
+            }
+            self._add_ref(entry, refs)
+            logger.info(f"Аудио для видео {video_id} помещено в кэш ({size / 1024 / 1024:.1f} МБ)")
+
+            self._evict()
+            return entry
+
+    def retain(self, audio_path: str, refs: int = 1) -> None:
+        """
+        Захватывает дополнительные ссылки на уже захваченную запись кэша
+
+        Args:
+            audio_path: Путь к аудиофайлу, полученный из acquire или put
+            refs: Сколько ссылок захватить
+        """
+        with self._lock:
+            key = self._paths.get(audio_path)
+            if key is not None and refs > 0:
+                self._refs[key] = self._refs.get(key, 0) + refs
+
+    def owns(self, path: Optional[str]) -> bool:
+        """Проверяет, является ли файл захваченной записью кэша"""
+        return bool(path) and path in self._paths
+
+    def release(self, audio_path: str) -> None:
+        """
+        Освобождает ранее захваченную запись кэша по пути к аудиофайлу
+
+        Args:
+            audio_path: Путь к аудиофайлу, полученный из acquire или put
+        """
+        with self._lock:
+            key = self._paths.get(audio_path)
+            if key is None:
+                return
+            count = self._refs.get(key, 0) - 1
+            if count > 0:
+                self._refs[key] = count
+            else:
+                self._refs.pop(key, None)
+                self._paths.pop(audio_path, None)
+            self._evict()
+
+    def _delete_entry(self, row: sqlite3.Row) -> None:
+        """Удаляет файлы и строку индекса записи (вызывается внутри транзакции)"""
+        for file_name in (row["audio_file"], row["thumb_file"]):
+            if not file_name:
+                continue
+            try:
+                os.remove(self._path(file_name))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"Не удалось удалить файл кэша {file_name}: {e}")
+        self._conn.execute("DELETE FROM entries WHERE key = ?", (row["key"],))
+        self._total_bytes = max(0, self._total_bytes - row["size"])
+
+    def _evict(self) -> None:
+        """Удаляет давно не использованные записи, пока кэш не уложится в бюджет"""
+        if self._total_bytes <= self._max_bytes:
+            return
+        with self._lock, self._conn:
+            rows = self._conn.execute(
+                "SELECT * FROM entries ORDER BY last_used_at ASC"
+            ).fetchall()
+            for row in rows:
+                if self._total_bytes <= self._max_bytes:
+                    break
+                if self._refs.get(row["key"]):
+                    continue
+                self._delete_entry(row)
+                logger.info(f"Запись {row['key']} вытеснена из кэша аудио")
+
+# Создаем глобальный экземпляр кэша
+audio_cache = AudioCache(AUDIO_CACHE_DIR, AUDIO_CACHE_MAX_BYTES)
@@ -0,0 +1,44 @@
+import logging
+from pathlib import Path
+from typing import Optional, Union
+
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.types import FSInputFile
+
+from config import TELEGRAM_API_SERVER, TELEGRAM_API_LOCAL, MAX_TELEGRAM_FILE_SIZE
+
+logger = logging.getLogger(__name__)
+
+def create_bot_session() -> Optional[AiohttpSession]:
+    """
+    Создает HTTP-сессию бота для собственного сервера Telegram Bot API
+
+    Returns:
+        AiohttpSession: Сессия для TELEGRAM_API_SERVER или None, если используется api.telegram.org
+    """
+    if not TELEGRAM_API_SERVER:
+        return None
+    logger.info(
+        f"Используется сервер Bot API {TELEGRAM_API_SERVER}"
+        f"{' в локальном режиме' if TELEGRAM_API_LOCAL else ''} "
+        f"(лимит файла {MAX_TELEGRAM_FILE_SIZE // 1024 // 1024} МБ)"
+    )
+    return AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_SERVER, is_local=TELEGRAM_API_LOCAL))
+
+def audio_input_file(file_path: str) -> Union[str, FSInputFile]:
+    """
+    Возвращает файл для отправки в Telegram.
+
+    В локальном режиме сервер Bot API читает файл сам (нужен общий доступ к файловой системе),
+    поэтому передается только путь в виде file:// URI, без загрузки байтов через multipart-запрос.
+
+    Args:
+        file_path: Путь к файлу
+
+    Returns:
+        str или FSInputFile: URI локального файла или файл для загрузки
+    """
+    if TELEGRAM_API_LOCAL:
+        return Path(file_path).resolve().as_uri()
+    return FSInputFile(file_path)
@@ -17,14 +17,16 @@ async def set_commands(bot: Bot) -> None:
     private_commands = [
         BotCommand(command="start", description="Запустить бота"),
         BotCommand(command="search", description="Поиск музыки на YouTube"),
-        BotCommand(command="link", description="Отправить YouTube ссылку")
+        BotCommand(command="link", description="Отправить YouTube ссылку"),
+        BotCommand(command="clip", description="Загрузить фрагмент трека")
     ]
     
     # Команды для групповых чатов
     group_commands = [
         BotCommand(command="start", description="Запустить бота в группе"),
         BotCommand(command="search", description="Поиск музыки на YouTube"),
-        BotCommand(command="link", description="Отправить YouTube ссылку")
+        BotCommand(command="link", description="Отправить YouTube ссылку"),
+        BotCommand(command="clip", description="Загрузить фрагмент трека")
     ]
     
     # Регистрация команд для приватных чатов
@@ -46,7 +48,8 @@ async def set_commands(bot: Bot) -> None:
     default_commands = [
         BotCommand(command="start", description="Запустить бота"),
         BotCommand(command="search", description="Поиск музыки на YouTube"),
-        BotCommand(command="link", description="Отправить YouTube ссылку")
+        BotCommand(command="link", description="Отправить YouTube ссылку"),
+        BotCommand(command="clip", description="Загрузить фрагмент трека")
     ]
     
     await bot.set_my_commands(
@@ -0,0 +1,124 @@
+import logging
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from config import FILE_ID_DB_PATH
+
+logger = logging.getLogger(__name__)
+
+class FileIdRegistry:
+    """
+    Постоянный реестр соответствий videoId -> Telegram file_id.
+    Хранится в SQLite, поэтому переживает перезапуски бота.
+    Позволяет повторно отправлять уже загруженные в Telegram треки
+    одним запросом к API, без скачивания и конвертации.
+    """
+
+    def __init__(self, db_path: str):
+        self._db_path = db_path
+        # Соединение используется из нескольких потоков, доступ сериализуем блокировкой
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS audio_files (
+                    video_id TEXT NOT NULL,
+                    profile TEXT NOT NULL,
+                    file_id TEXT NOT NULL,
+                    file_unique_id TEXT,
+                    title TEXT,
+                    performer TEXT,
+                    duration INTEGER,
+                    file_size INTEGER,
+                    created_at REAL NOT NULL,
+                    last_used_at REAL NOT NULL,
+                    hits INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (video_id, profile)
+                )
+                """
+            )
+        logger.info(f"Реестр file_id открыт: {db_path}")
+
+    def get(self, video_id: str, profile: str) -> Optional[Dict[str, Any]]:
+        """
+        Возвращает запись реестра для видео и обновляет статистику использования
+
+        Args:
+            video_id: ID видео YouTube
+            profile: Профиль кодирования аудио
+
+        Returns:
+            Словарь с file_id и метаданными или None, если запись не найдена
+        """
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT * FROM audio_files WHERE video_id = ? AND profile = ?",
+                (video_id, profile)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                "UPDATE audio_files SET last_used_at = ?, hits = hits + 1 WHERE video_id = ? AND profile = ?",
+                (time.time(), video_id, profile)
+            )
+        return dict(row)
+
+    def set(self, video_id: str, profile: str, file_id: str, file_unique_id: Optional[str] = None,
+            title: Optional[str] = None, performer: Optional[str] = None,
+            duration: Optional[int] = None, file_size: Optional[int] = None) -> None:
+        """
+        Сохраняет или обновляет file_id для видео
+
+        Args:
+            video_id: ID видео YouTube
+            profile: Профиль кодирования аудио
+            file_id: file_id отправленного аудио в Telegram
+            file_unique_id: Уникальный ID файла в Telegram
+            title: Название трека
+            performer: Исполнитель
+            duration: Длительность в секундах
+            file_size: Размер файла в байтах
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                """
+                INSERT INTO audio_files (video_id, profile, file_id, file_unique_id, title, performer,
+                                         duration, file_size, created_at, last_used_at, hits)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 0)
+                ON CONFLICT (video_id, profile) DO UPDATE SET
+                    file_id = excluded.file_id,
+                    file_unique_id = excluded.file_unique_id,
+                    title = excluded.title,
+                    performer = excluded.performer,
+                    duration = excluded.duration,
+                    file_size = excluded.file_size,
+                    last_used_at = excluded.last_used_at
+                """,
+                (video_id, profile, file_id, file_unique_id, title, performer,
+                 duration, file_size, now, now)
+            )
+        logger.info(f"Сохранен file_id для видео {video_id} (профиль {profile})")
+
+    def remove(self, video_id: str, profile: str) -> None:
+        """
+        Удаляет запись из реестра (например, если Telegram больше не принимает file_id)
+
+        Args:
+            video_id: ID видео YouTube
+            profile: Профиль кодирования аудио
+        """
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM audio_files WHERE video_id = ? AND profile = ?",
+                (video_id, profile)
+            )
+        logger.info(f"Удален file_id для видео {video_id} (профиль {profile})")
+
+# Создаем глобальный экземпляр реестра
+file_id_registry = FileIdRegistry(FILE_ID_DB_PATH)
@@ -0,0 +1,208 @@
+import asyncio
+import heapq
+import logging
+import os
+import shutil
+import time
+from typing import List, Optional, Set, Tuple
+
+from config import (
+    DOWNLOADS_DIR, JANITOR_INTERVAL, DOWNLOADS_MAX_FILE_AGE, DOWNLOADS_MIN_FREE_BYTES, DOWNLOADS_TARGET_FREE_BYTES
+)
+
+logger = logging.getLogger(__name__)
+
+# Сколько файлов удаляется за один проход (остальные - на следующем проходе)
+SWEEP_BATCH_SIZE = 200
+
+# Минимальный возраст файла, который можно удалить досрочно при нехватке места (секунды)
+PRESSURE_MIN_FILE_AGE = 120
+
+class DownloadsJanitor:
+    """
+    Фоновая очистка директории загрузок.
+
+    Сервис загрузок регистрирует каждый созданный файл, janitor хранит их
+    в куче по времени изменения и по таймеру удаляет файлы старше заданного
+    возраста небольшими порциями. Если свободного места на диске становится меньше
+    нижней отметки, старые файлы удаляются досрочно, пока свободное место
+    не поднимется до верхней отметки. Путь загрузки при этом не сканирует директорию.
+    """
+
+    def __init__(self, directory: str, max_age: int, interval: int,
+                 min_free_bytes: int, target_free_bytes: int):
+        self._directory = directory
+        self._max_age = max_age
+        self._interval = interval
+        self._min_free_bytes = min_free_bytes
+        self._target_free_bytes = max(target_free_bytes, min_free_bytes)
+
+        # Куча (время изменения, путь) известных файлов
+        self._heap: List[Tuple[float, str]] = []
+        self._known: Set[str] = set()
+        self._task: Optional[asyncio.Task] = None
+
+    def register(self, *paths: Optional[str]) -> None:
+        """
+        Регистрирует файлы, созданные в директории загрузок
+
+        Args:
+            *paths: Пути к файлам (None пропускаются)
+        """
+        now = time.time()
+        for path in paths:
+            if not path or path in self._known:
+                continue
+            self._known.add(path)
+            heapq.heappush(self._heap, (now, path))
+
+    def _index_existing_files(self) -> List[Tuple[float, str]]:
+        """Однократно собирает файлы, оставшиеся в директории с прошлого запуска"""
+        entries = []
+        with os.scandir(self._directory) as iterator:
+            for entry in iterator:
+                try:
+                    if entry.is_file():
+                        entries.append((entry.stat().st_mtime, entry.path))
+                except OSError:
+                    continue
+        return entries
+
+    def start(self) -> None:
+        """Запускает фоновую задачу очистки"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Останавливает фоновую задачу очистки"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        """Цикл фоновой очистки"""
+        try:
+            for mtime, path in await asyncio.to_thread(self._index_existing_files):
+                if path not in self._known:
+                    self._known.add(path)
+                    heapq.heappush(self._heap, (mtime, path))
+            logger.info(f"Очистка директории загрузок запущена (известно файлов: {len(self._heap)})")
+        except OSError as e:
+            logger.warning(f"Не удалось проиндексировать директорию загрузок: {e}")
+
+        while True:
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.error(f"Ошибка при очистке директории загрузок: {e}")
+            await asyncio.sleep(self._interval)
+
+    async def sweep(self) -> int:
+        """
+        Выполняет один проход очистки: удаляет устаревшие файлы,
+        а при нехватке места на диске - и более новые
+
+        Returns:
+            int: Количество удаленных файлов
+        """
+        now = time.time()
+        expired = []
+        while self._heap and len(expired) < SWEEP_BATCH_SIZE and self._heap[0][0] + self._max_age <= now:
+            expired.append(heapq.heappop(self._heap))
+
+        removed = await self._remove(expired, now - self._max_age)
+
+        free_bytes = await asyncio.to_thread(self._free_bytes)
+        if free_bytes is not None and free_bytes < self._min_free_bytes:
+            logger.warning(
+                f"Мало места на диске загрузок: свободно {free_bytes / 1024 / 1024:.0f} МБ, "
+                f"удаляем старые файлы досрочно"
+            )
+            removed += await self._relieve_pressure(free_bytes, now)
+
+        if removed:
+            logger.info(f"Очищено {removed} файлов из директории загрузок")
+        return removed
+
+    async def _relieve_pressure(self, free_bytes: int, now: float) -> int:
+        """Удаляет самые старые файлы, пока свободное место не достигнет верхней отметки"""
+        removed = 0
+        while self._heap and free_bytes < self._target_free_bytes:
+            if self._heap[0][0] + PRESSURE_MIN_FILE_AGE > now:
+                # Остальные файлы созданы только что и, скорее всего, еще используются
+                break
+            batch = []
+            while self._heap and len(batch) < SWEEP_BATCH_SIZE and self._heap[0][0] + PRESSURE_MIN_FILE_AGE <= now:
+                batch.append(heapq.heappop(self._heap))
+            removed += await self._remove(batch, now - PRESSURE_MIN_FILE_AGE)
+            free_bytes = await asyncio.to_thread(self._free_bytes)
+            if free_bytes is None:
+                break
+        return removed
+
+    def _free_bytes(self) -> Optional[int]:
+        """Возвращает свободное место на разделе директории загрузок"""
+        try:
+            return shutil.disk_usage(self._directory).free
+        except OSError as e:
+            logger.warning(f"Не удалось получить свободное место на диске: {e}")
+            return None
+
+    async def _remove(self, entries: List[Tuple[float, str]], deadline: float) -> int:
+        """Удаляет файлы в потоке и обновляет индекс в цикле событий"""
+        if not entries:
+            return 0
+        removed, requeue, forgotten = await asyncio.to_thread(self._remove_files, entries, deadline)
+        self._known.difference_update(forgotten)
+        for entry in requeue:
+            heapq.heappush(self._heap, entry)
+        return removed
+
+    def _remove_files(self, entries: List[Tuple[float, str]],
+                      deadline: float) -> Tuple[int, List[Tuple[float, str]], List[str]]:
+        """
+        Удаляет файлы из списка (выполняется в потоке, индекс не изменяет).
+        Файлы, изменявшиеся после deadline, возвращаются для повторной постановки в кучу.
+
+        Returns:
+            tuple: (количество удаленных файлов, файлы для возврата в кучу, файлы, исключаемые из индекса)
+        """
+        removed = 0
+        requeue = []
+        forgotten = []
+        for registered_at, path in entries:
+            try:
+                mtime = os.path.getmtime(path)
+            except FileNotFoundError:
+                # Файл уже удален после отправки или перенесен в кэш
+                forgotten.append(path)
+                continue
+            except OSError as e:
+                logger.warning(f"Ошибка при проверке файла {path}: {e}")
+                forgotten.append(path)
+                continue
+
+            if mtime > deadline:
+                requeue.append((max(mtime, registered_at), path))
+                continue
+            try:
+                os.remove(path)
+                removed += 1
+                forgotten.append(path)
+                logger.info(f"Удален старый файл: {os.path.basename(path)}")
+            except FileNotFoundError:
+                forgotten.append(path)
+            except OSError as e:
+                # Файл заблокирован - попробуем на следующем проходе
+                logger.warning(f"Не удалось удалить файл {path}: {e}")
+                requeue.append((time.time() - self._max_age + self._interval, path))
+        return removed, requeue, forgotten
+
+# Создаем глобальный экземпляр очистки директории загрузок
+downloads_janitor = DownloadsJanitor(
+    DOWNLOADS_DIR, DOWNLOADS_MAX_FILE_AGE, JANITOR_INTERVAL, DOWNLOADS_MIN_FREE_BYTES, DOWNLOADS_TARGET_FREE_BYTES
+)
@@ -0,0 +1,269 @@
+import logging
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError
+from aiogram.types import Chat, Message, User
+
+from config import JOB_JOURNAL_DB_PATH, JOB_RESUME_ENABLED, JOB_RESUME_MAX_AGE, JOB_RESUME_MAX_ATTEMPTS
+
+logger = logging.getLogger(__name__)
+
+# Стадии задачи загрузки
+STAGE_QUEUED = "queued"
+STAGE_DOWNLOADING = "downloading"
+STAGE_SENDING = "sending"
+
+# Обработчик, который перезапускает задачу своего типа: (бот, запись журнала, сообщение-индикатор)
+JobResumer = Callable[[Bot, Dict[str, Any], Message], Awaitable[Any]]
+
+RESUME_MESSAGE_TEXT = (
+    "🔄 <b>Бот был перезапущен</b>\n\n"
+    "Продолжаю загрузку аудио с места остановки...\n\n"
+    "<i>Пожалуйста, подождите.</i>"
+)
+
+EXPIRED_MESSAGE_TEXT = (
+    "❌ <b>Загрузка прервана перезапуском бота</b>\n\n"
+    "Пожалуйста, отправьте запрос еще раз."
+)
+
+class JobJournal:
+    """
+    Постоянный журнал задач загрузки.
+
+    Каждый запрос на загрузку записывается в SQLite вместе с данными, необходимыми
+    для ответа в исходный чат (чат, топик, сообщение-запрос, сообщение-индикатор, пользователь),
+    и стадией выполнения. Запись удаляется, когда пользователь получил аудио или сообщение
+    об ошибке. Записи, оставшиеся после остановки или падения бота, при следующем запуске
+    передаются обработчикам своего типа и выполняются заново; уже загруженные части файлов
+    при этом используются повторно.
+    """
+
+    def __init__(self, db_path: str):
+        self._db_path = db_path
+        self._resumers: Dict[str, JobResumer] = {}
+        # Соединение используется из нескольких потоков, доступ сериализуем блокировкой
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind TEXT NOT NULL,
+                    chat_id INTEGER NOT NULL,
+                    chat_type TEXT NOT NULL,
+                    message_id INTEGER NOT NULL,
+                    message_thread_id INTEGER,
+                    is_topic_message INTEGER NOT NULL DEFAULT 0,
+                    loading_message_id INTEGER,
+                    user_id INTEGER NOT NULL,
+                    user_name TEXT,
+                    is_group_chat INTEGER NOT NULL DEFAULT 0,
+                    url TEXT NOT NULL,
+                    video_id TEXT,
+                    stage TEXT NOT NULL,
+                    progress INTEGER NOT NULL DEFAULT 0,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+                """
+            )
+        logger.info(f"Журнал задач открыт: {db_path}")
+
+    def add(self, kind: str, message: Message, user: User, loading_message: Message, url: str,
+            video_id: Optional[str], is_group_chat: bool) -> int:
+        """
+        Записывает новую задачу загрузки
+
+        Args:
+            kind: Тип задачи (определяет обработчик, который ее возобновит)
+            message: Сообщение, на которое отвечает бот (запрос со ссылкой или результаты поиска)
+            user: Пользователь, запросивший трек
+            loading_message: Сообщение-индикатор загрузки
+            url: URL для скачивания
+            video_id: ID видео YouTube
+            is_group_chat: Флаг группового чата
+
+        Returns:
+            int: ID задачи в журнале
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                """
+                INSERT INTO jobs (kind, chat_id, chat_type, message_id, message_thread_id, is_topic_message,
+                                  loading_message_id, user_id, user_name, is_group_chat, url, video_id,
+                                  stage, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (kind, message.chat.id, message.chat.type, message.message_id, message.message_thread_id,
+                 int(bool(message.is_topic_message)), loading_message.message_id, user.id, user.first_name,
+                 int(is_group_chat), url, video_id, STAGE_QUEUED, now, now)
+            )
+        return cursor.lastrowid
+
+    def _update(self, job_id: Optional[int], **fields: Any) -> None:
+        """Обновляет поля задачи (job_id None - задача не записана в журнал)"""
+        if job_id is None:
+            return
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock, self._conn:
+            self._conn.execute(
+                f"UPDATE jobs SET {assignments}, updated_at = ? WHERE id = ?",
+                (*fields.values(), time.time(), job_id)
+            )
+
+    def set_stage(self, job_id: Optional[int], stage: str) -> None:
+        """
+        Отмечает переход задачи на новую стадию
+
+        Args:
+            job_id: ID задачи в журнале
+            stage: Стадия (STAGE_QUEUED, STAGE_DOWNLOADING, STAGE_SENDING)
+        """
+        self._update(job_id, stage=stage)
+
+    def set_progress(self, job_id: Optional[int], progress: int) -> None:
+        """
+        Сохраняет количество уже отправленных треков задачи из нескольких треков
+        (после перезапуска они не отправляются повторно)
+
+        Args:
+            job_id: ID задачи в журнале
+            progress: Количество отправленных треков
+        """
+        self._update(job_id, progress=progress)
+
+    def finish(self, job_id: Optional[int]) -> None:
+        """
+        Удаляет завершенную задачу (аудио отправлено или пользователь получил сообщение об ошибке)
+
+        Args:
+            job_id: ID задачи в журнале
+        """
+        if job_id is None:
+            return
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+    def pending(self) -> List[Dict[str, Any]]:
+        """Возвращает незавершенные задачи в порядке поступления"""
+        with self._lock:
+            rows = self._conn.execute("SELECT * FROM jobs ORDER BY id").fetchall()
+        return [dict(row) for row in rows]
+
+    def register_resumer(self, kind: str, resumer: JobResumer) -> None:
+        """
+        Регистрирует обработчик, который перезапускает задачи заданного типа
+
+        Args:
+            kind: Тип задачи
+            resumer: Корутина (бот, запись журнала, сообщение-индикатор), запускающая обработку в фоне
+        """
+        self._resumers[kind] = resumer
+
+    @staticmethod
+    def restore_message(bot: Bot, job: Dict[str, Any], message_id: Optional[int] = None) -> Message:
+        """
+        Восстанавливает сообщение из записи журнала, чтобы обработчик мог отвечать
+        в исходный чат и топик так же, как до перезапуска
+
+        Args:
+            bot: Экземпляр бота
+            job: Запись журнала
+            message_id: ID сообщения (по умолчанию - сообщение, на которое отвечает бот)
+        """
+        message = Message(
+            message_id=message_id or job['message_id'],
+            date=datetime.fromtimestamp(job['created_at']),
+            chat=Chat(id=job['chat_id'], type=job['chat_type']),
+            from_user=JobJournal.restore_user(job),
+            message_thread_id=job['message_thread_id'],
+            is_topic_message=bool(job['is_topic_message']) or None,
+        )
+        return message.as_(bot)
+
+    @staticmethod
+    def restore_user(job: Dict[str, Any]) -> User:
+        """Восстанавливает пользователя, запросившего трек"""
+        return User(id=job['user_id'], is_bot=False, first_name=job['user_name'] or str(job['user_id']))
+
+    async def _restore_loading_message(self, bot: Bot, job: Dict[str, Any], text: str) -> Optional[Message]:
+        """
+        Обновляет сообщение-индикатор задачи. Если его уже нет, отправляет новое
+        (в группе - ответом на исходное сообщение)
+        """
+        if job['loading_message_id']:
+            try:
+                edited = await bot.edit_message_text(
+                    text=text, chat_id=job['chat_id'], message_id=job['loading_message_id']
+                )
+                if isinstance(edited, Message):
+                    return edited
+            except TelegramAPIError as e:
+                logger.debug(f"Не удалось обновить сообщение о загрузке задачи {job['id']}: {e}")
+
+        try:
+            message = self.restore_message(bot, job)
+            loading_message = await (message.reply if job['is_group_chat'] else message.answer)(text)
+        except TelegramAPIError as e:
+            logger.warning(f"Не удалось отправить сообщение о загрузке для задачи {job['id']}: {e}")
+            return None
+        self._update(job['id'], loading_message_id=loading_message.message_id)
+        return loading_message
+
+    async def resume(self, bot: Bot) -> int:
+        """
+        Перезапускает задачи, не завершенные до остановки бота. Устаревшие задачи, задачи,
+        которые уже перезапускались слишком много раз, и все задачи при отключенном возобновлении
+        отбрасываются с уведомлением пользователя.
+
+        Args:
+            bot: Экземпляр бота
+
+        Returns:
+            int: Количество перезапущенных задач
+        """
+        resumed = 0
+        now = time.time()
+        for job in self.pending():
+            resumer = self._resumers.get(job['kind'])
+            expired = now - job['created_at'] > JOB_RESUME_MAX_AGE
+            if not JOB_RESUME_ENABLED or resumer is None or expired or job['attempts'] >= JOB_RESUME_MAX_ATTEMPTS:
+                logger.info(
+                    f"Задача {job['id']} ({job['kind']}, видео {job['video_id']}) отброшена: "
+                    f"стадия {job['stage']}, перезапусков {job['attempts']}"
+                )
+                self.finish(job['id'])
+                await self._restore_loading_message(bot, job, EXPIRED_MESSAGE_TEXT)
+                continue
+
+            self._update(job['id'], attempts=job['attempts'] + 1)
+            loading_message = await self._restore_loading_message(bot, job, RESUME_MESSAGE_TEXT)
+            if loading_message is None:
+                # Чат недоступен (бот удален из группы или заблокирован) - задачу некому доставить
+                self.finish(job['id'])
+                continue
+
+            logger.info(
+                f"Возобновляю задачу {job['id']} ({job['kind']}, видео {job['video_id']}) "
+                f"в чате {job['chat_id']} со стадии {job['stage']}"
+            )
+            await resumer(bot, job, loading_message)
+            resumed += 1
+
+        if resumed:
+            logger.info(f"Возобновлено {resumed} незавершенных задач загрузки")
+        return resumed
+
+# Создаем глобальный экземпляр журнала
+job_journal = JobJournal(JOB_JOURNAL_DB_PATH)
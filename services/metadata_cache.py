@@ -0,0 +1,140 @@
+import logging
+import time
+from typing import Any, Dict, Optional
+from urllib.parse import urlparse, parse_qs
+
+from cachetools import TLRUCache
+
+from config import METADATA_CACHE_TTL, METADATA_CACHE_SIZE
+
+logger = logging.getLogger(__name__)
+
+# Запас времени до истечения подписанной ссылки: загрузка должна успеть завершиться
+STREAM_URL_SAFETY_MARGIN = 5 * 60
+
+# Срок жизни ссылки на поток, если в ней не указан срок действия
+STREAM_URL_DEFAULT_TTL = 60 * 60
+
+def parse_stream_expiry(stream_url: Optional[str]) -> Optional[float]:
+    """
+    Извлекает срок действия подписанной ссылки googlevideo (параметр expire в запросе или в пути)
+
+    Args:
+        stream_url: Ссылка на поток
+
+    Returns:
+        float: Время истечения (unix time) или None, если срок не указан
+    """
+    if not stream_url:
+        return None
+    try:
+        parsed = urlparse(stream_url)
+        expire = parse_qs(parsed.query).get("expire")
+        if expire:
+            return float(expire[0])
+        path_parts = parsed.path.split("/")
+        if "expire" in path_parts:
+            return float(path_parts[path_parts.index("expire") + 1])
+    except (ValueError, IndexError):
+        pass
+    return None
+
+class MetadataCache:
+    """
+    Кэш метаданных видео по videoId с ограниченным сроком жизни.
+
+    Хранит то, что уже известно о видео из поиска и загрузок: название, длительность,
+    обложку, выбранный аудиоформат и подписанную ссылку на поток со сроком ее действия,
+    а также сокращенный info dict yt-dlp. Пока ссылка действительна, повторная загрузка
+    обходится без извлечения информации (запросов к YouTube и расшифровки подписей).
+    """
+
+    def __init__(self, ttl: int, max_size: int):
+        self._ttl = ttl
+        # Запись живет ttl секунд с последнего обновления, при переполнении вытесняются старые
+        self._entries: TLRUCache = TLRUCache(
+            maxsize=max_size, ttu=lambda _key, entry, _now: entry["expires_at"], timer=time.time
+        )
+
+    def get(self, video_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Возвращает известные метаданные видео
+
+        Args:
+            video_id: ID видео YouTube
+
+        Returns:
+            Словарь с метаданными или None
+        """
+        return self._entries.get(video_id)
+
+    def update(self, video_id: str, **fields: Any) -> None:
+        """
+        Дополняет запись видео новыми полями (пустые значения не перезаписывают известные)
+
+        Args:
+            video_id: ID видео YouTube
+            **fields: title, duration_sec, thumbnail и другие поля
+        """
+        entry = dict(self._entries.get(video_id) or {"video_id": video_id})
+        entry.update({key: value for key, value in fields.items() if value is not None})
+        entry["expires_at"] = time.time() + self._ttl
+        self._entries[video_id] = entry
+
+    def put_info(self, video_id: str, info: Dict[str, Any]) -> None:
+        """
+        Сохраняет результат извлечения yt-dlp (компактный info dict из исполнителя)
+
+        Args:
+            video_id: ID видео YouTube
+            info: Компактный info dict (см. services.ydl_engine.compact_info)
+        """
+        info_dict = info.get("info_dict")
+        stream_expires_at = None
+        if info_dict:
+            # Ссылки всех аудиоформатов подписаны одновременно - берем самый ранний срок
+            expiries = [
+                parse_stream_expiry(stream_format.get("url"))
+                for stream_format in info_dict.get("formats") or []
+            ]
+            expiries = [expiry for expiry in expiries if expiry]
+            stream_expires_at = min(expiries) if expiries else time.time() + STREAM_URL_DEFAULT_TTL
+
+        self.update(
+            video_id,
+            title=info.get("title"),
+            duration_sec=info.get("duration"),
+            thumbnail=info.get("thumbnail"),
+            format_id=info.get("format_id"),
+            stream_url=info.get("url"),
+            stream_expires_at=stream_expires_at,
+            info_dict=info_dict,
+        )
+
+    def get_stream_info(self, video_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Возвращает сохраненный info dict, если подписанные ссылки на поток еще действительны
+
+        Args:
+            video_id: ID видео YouTube
+
+        Returns:
+            Info dict для повторной обработки yt-dlp без извлечения или None
+        """
+        entry = self._entries.get(video_id)
+        if not entry or not entry.get("info_dict"):
+            return None
+        if entry.get("stream_expires_at", 0) - STREAM_URL_SAFETY_MARGIN <= time.time():
+            return None
+        return entry["info_dict"]
+
+    def invalidate_stream(self, video_id: str) -> None:
+        """Забывает ссылки на поток видео (например, если источник отклонил запрос)"""
+        entry = self._entries.get(video_id)
+        if entry:
+            entry = {key: value for key, value in entry.items()
+                     if key not in ("info_dict", "stream_url", "stream_expires_at", "format_id")}
+            self._entries[video_id] = entry
+
+# Создаем глобальный экземпляр кэша метаданных
+metadata_cache = MetadataCache(METADATA_CACHE_TTL, METADATA_CACHE_SIZE)
@@ -0,0 +1,161 @@
+import functools
+import logging
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+
+from config import METRICS_ENABLED, METRICS_HOST, METRICS_PORT
+
+logger = logging.getLogger(__name__)
+
+# Границы гистограмм длительности (секунды): от быстрых ответов кэша до долгих загрузок
+STAGE_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 3, 5, 7.5, 10, 15, 20, 30, 45, 60, 120, 300)
+
+# Границы гистограммы скорости загрузки (байт/с): от 64 КБ/с до 128 МБ/с
+SPEED_BUCKETS = tuple(64 * 1024 * 2 ** power for power in range(12))
+
+STAGE_DURATION = Histogram(
+    "ytaudio_stage_duration_seconds",
+    "Длительность этапов обработки трека",
+    ["stage"],
+    buckets=STAGE_BUCKETS,
+)
+
+TIME_TO_AUDIO = Histogram(
+    "ytaudio_time_to_audio_seconds",
+    "Время от получения запроса до отправки аудио пользователю",
+    ["source"],
+    buckets=STAGE_BUCKETS,
+)
+
+DOWNLOAD_SPEED = Histogram(
+    "ytaudio_download_speed_bytes_per_second",
+    "Скорость загрузки аудиопотока из источника",
+    buckets=SPEED_BUCKETS,
+)
+
+CACHE_LOOKUPS = Counter(
+    "ytaudio_cache_lookups_total",
+    "Обращения к кэшам по результату",
+    ["cache", "result"],
+)
+
+FAILURES = Counter(
+    "ytaudio_failures_total",
+    "Ошибки обработки по этапу и причине",
+    ["stage", "reason"],
+)
+
+INFLIGHT_JOBS = Gauge(
+    "ytaudio_inflight_jobs",
+    "Выполняющиеся задачи по этапу",
+    ["stage"],
+)
+
+QUEUED_JOBS = Gauge(
+    "ytaudio_queued_jobs",
+    "Задачи, ожидающие в очереди планировщика загрузок",
+)
+
+PREFETCH_RESULTS = Counter(
+    "ytaudio_prefetch_results_total",
+    "Упреждающая загрузка результатов поиска по виду работы и результату",
+    ["kind", "result"],
+)
+
+TRANSCODE_QUEUED = Gauge(
+    "ytaudio_transcode_queued_jobs",
+    "Задачи ffmpeg, ожидающие свободного ядра",
+)
+
+def failure_reason(error: BaseException) -> str:
+    """Возвращает причину ошибки для метрик (имя класса исключения - ограниченный набор значений)"""
+    return type(error).__name__
+
+def record_failure(stage: str, error: BaseException) -> None:
+    """
+    Учитывает ошибку этапа
+
+    Args:
+        stage: Этап обработки
+        error: Исключение
+    """
+    FAILURES.labels(stage=stage, reason=failure_reason(error)).inc()
+
+def record_cache_lookup(cache: str, hit: bool) -> None:
+    """
+    Учитывает обращение к кэшу
+
+    Args:
+        cache: Название кэша
+        hit: Найдена ли запись
+    """
+    CACHE_LOOKUPS.labels(cache=cache, result="hit" if hit else "miss").inc()
+
+@contextmanager
+def observe_stage(stage: str) -> Iterator[None]:
+    """
+    Измеряет длительность этапа и учитывает его ошибки; пока этап выполняется,
+    он учитывается в числе выполняющихся задач
+
+    Args:
+        stage: Этап обработки
+    """
+    started = time.perf_counter()
+    inflight = INFLIGHT_JOBS.labels(stage=stage)
+    inflight.inc()
+    try:
+        yield
+    except Exception as e:
+        record_failure(stage, e)
+        raise
+    finally:
+        inflight.dec()
+        STAGE_DURATION.labels(stage=stage).observe(time.perf_counter() - started)
+
+def timed_stage(stage: str):
+    """Декоратор корутины, измеряющий длительность этапа (см. observe_stage)"""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with observe_stage(stage):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def record_download(seconds: float, size: int) -> None:
+    """
+    Учитывает длительность и скорость загрузки аудиопотока
+
+    Args:
+        seconds: Длительность загрузки
+        size: Размер загруженных данных в байтах
+    """
+    if not seconds:
+        return
+    STAGE_DURATION.labels(stage="download").observe(seconds)
+    if size:
+        DOWNLOAD_SPEED.observe(size / seconds)
+
+def record_ydl_timings(outputs: Optional[Dict[str, Any]]) -> None:
+    """
+    Учитывает длительности загрузки и постобработки, собранные хуками yt-dlp
+
+    Args:
+        outputs: Выходные данные задачи yt-dlp (см. services.ydl_engine.compact_info)
+    """
+    timings = (outputs or {}).get("timings") or {}
+    record_download(timings.get("download_seconds"), timings.get("download_bytes"))
+    postprocess_seconds = timings.get("postprocess_seconds")
+    if postprocess_seconds:
+        # Перекодирование выполняет services.transcoder, у yt-dlp остаются исправления контейнера и перенос файлов
+        STAGE_DURATION.labels(stage="postprocess").observe(postprocess_seconds)
+
+def start_metrics_server() -> None:
+    """Запускает HTTP-сервер с эндпоинтом /metrics (если метрики включены)"""
+    if not METRICS_ENABLED:
+        return
+    start_http_server(METRICS_PORT, addr=METRICS_HOST)
+    logger.info(f"Метрики Prometheus доступны на http://{METRICS_HOST}:{METRICS_PORT}/metrics")
@@ -0,0 +1,189 @@
+import asyncio
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from config import PREFETCH_ENABLED, PREFETCH_TOP_K, PREFETCH_AUDIO_COUNT, PREFETCH_CONCURRENCY, PREFETCH_TTL
+from services.youtube import (
+    AdmissionError, DEFAULT_AUDIO_PROFILE, download_audio_from_youtube, is_audio_available,
+    release_downloaded_files, warm_track_info,
+)
+from services.file_id_registry import file_id_registry
+from services.scheduler import download_scheduler
+from services.transcoder import transcoder
+from services.metrics import PREFETCH_RESULTS
+
+logger = logging.getLogger(__name__)
+
+# Ключ сообщения с результатами поиска: (chat_id, message_id)
+ResultsKey = Tuple[int, int]
+
+class SearchPrefetcher:
+    """
+    Упреждающая загрузка результатов поиска.
+
+    Пока пользователь читает новые результаты поиска, для первых из них по порядку
+    заранее выполняется предварительная проверка (информация о видео, ссылка на поток
+    и обложка попадают в кэши), а самые первые при необходимости загружаются в кэш аудио.
+    Нажатие на такой результат обходится без извлечения информации или загрузки.
+
+    Упреждающая работа не занимает слотов планировщика загрузок, но ограничена собственным
+    числом одновременных задач и выполняется, только пока в очереди загрузок нет ожидающих
+    запросов пользователей (загрузка в кэш аудио - и пока нет очереди перекодирования).
+    Работа по сообщению с результатами отменяется, когда пользователь уходит от них
+    (новый поиск, возврат в меню) или по истечении срока.
+    """
+
+    def __init__(self, enabled: bool, top_k: int, audio_count: int, concurrency: int, ttl: int):
+        self._enabled = enabled and top_k > 0
+        self._top_k = top_k
+        self._audio_count = audio_count
+        self._ttl = ttl
+        self._semaphore = asyncio.Semaphore(max(1, concurrency))
+        # Упреждающая работа по сообщениям с результатами
+        self._sessions: Dict[ResultsKey, asyncio.Task] = {}
+        # Последние результаты пользователя в чате/топике: (user_id, chat_id, topic_id) -> ключ сообщения
+        self._latest: Dict[Tuple[int, int, Optional[int]], ResultsKey] = {}
+        # Выполняющаяся упреждающая работа по видео (ее дожидается нажатие на этот результат)
+        self._active: Dict[str, asyncio.Task] = {}
+
+    @property
+    def enabled(self) -> bool:
+        """Включена ли упреждающая загрузка"""
+        return self._enabled
+
+    def schedule(self, user_id: int, chat_id: int, topic_id: Optional[int], message_id: int,
+                 results: List[Dict]) -> None:
+        """
+        Запускает упреждающую загрузку для новых результатов поиска.
+        Предыдущие результаты пользователя в этом чате/топике считаются оставленными.
+
+        Args:
+            user_id: ID пользователя, выполнившего поиск
+            chat_id: ID чата
+            topic_id: ID топика или None
+            message_id: ID сообщения с результатами
+            results: Результаты поиска по порядку
+        """
+        if not self._enabled:
+            return
+        video_ids = [result['videoId'] for result in results if result.get('videoId')][:self._top_k]
+        if not video_ids:
+            return
+
+        user_key = (user_id, chat_id, topic_id)
+        previous = self._latest.get(user_key)
+        if previous is not None:
+            self.abandon(*previous)
+
+        key = (chat_id, message_id)
+        self._latest[user_key] = key
+        task = asyncio.create_task(self._run_session(key, video_ids))
+        self._sessions[key] = task
+
+        def forget_session(_task, key=key, user_key=user_key):
+            if self._sessions.get(key) is _task:
+                self._sessions.pop(key, None)
+            if self._latest.get(user_key) == key:
+                self._latest.pop(user_key, None)
+
+        task.add_done_callback(forget_session)
+
+    def abandon(self, chat_id: int, message_id: int) -> None:
+        """
+        Отменяет упреждающую работу по сообщению с результатами (пользователь ушел от них)
+
+        Args:
+            chat_id: ID чата
+            message_id: ID сообщения с результатами
+        """
+        task = self._sessions.pop((chat_id, message_id), None)
+        if task and not task.done():
+            logger.info(f"Упреждающая загрузка результатов {message_id} в чате {chat_id} отменена")
+            task.cancel()
+
+    async def join(self, video_id: Optional[str]) -> None:
+        """
+        Дожидается упреждающей работы по видео, если она уже выполняется,
+        чтобы загрузка по нажатию не повторяла ее (ошибки упреждающей работы не передаются)
+
+        Args:
+            video_id: ID видео
+        """
+        task = self._active.get(video_id) if video_id else None
+        if task and not task.done():
+            logger.info(f"Видео {video_id} уже загружается заранее, ожидаем результат")
+            await asyncio.wait({task})
+
+    async def _run_session(self, key: ResultsKey, video_ids: List[str]) -> None:
+        """Упреждающая работа по одному сообщению с результатами: результаты обрабатываются по порядку"""
+        try:
+            await asyncio.wait_for(self._prefetch_results(video_ids), self._ttl)
+        except asyncio.TimeoutError:
+            logger.info(f"Упреждающая загрузка результатов {key[1]} в чате {key[0]} прервана по сроку")
+
+    async def _prefetch_results(self, video_ids: List[str]) -> None:
+        """Обрабатывает результаты по порядку, пока есть бюджет"""
+        for index, video_id in enumerate(video_ids):
+            async with self._semaphore:
+                # Запросы пользователей ждут в очереди - упреждающая работа их не задерживает
+                if download_scheduler.queued:
+                    PREFETCH_RESULTS.labels(kind="info", result="skipped").inc()
+                    return
+                with_audio = index < self._audio_count and not transcoder.queued
+                task = asyncio.create_task(self._prefetch(video_id, with_audio))
+                self._active[video_id] = task
+                try:
+                    await task
+                finally:
+                    if self._active.get(video_id) is task:
+                        self._active.pop(video_id, None)
+
+    async def _prefetch(self, video_id: str, with_audio: bool) -> None:
+        """
+        Готовит один результат поиска
+
+        Args:
+            video_id: ID видео
+            with_audio: Загрузить аудио в кэш (иначе - только информация о видео)
+        """
+        kind = "audio" if with_audio else "info"
+        url = f"https://www.youtube.com/watch?v={video_id}"
+        if file_id_registry.get(video_id, DEFAULT_AUDIO_PROFILE) or is_audio_available(url):
+            # Трек будет отправлен без загрузки
+            PREFETCH_RESULTS.labels(kind=kind, result="cached").inc()
+            return
+        try:
+            if with_audio:
+                result = await download_audio_from_youtube(url, speculative=True)
+                # Трек остается в кэше аудио, а обложка - в кэше обложек: ссылки на них не нужны
+                await release_downloaded_files(result.file_path, result.thumb_path)
+                warmed = True
+            else:
+                warmed = await warm_track_info(url)
+        except asyncio.CancelledError:
+            PREFETCH_RESULTS.labels(kind=kind, result="cancelled").inc()
+            raise
+        except AdmissionError as e:
+            # Трек будет отклонен и без загрузки - причина уже в кэше метаданных
+            logger.debug(f"Упреждающая загрузка видео {video_id} отклонена: {e}")
+            PREFETCH_RESULTS.labels(kind=kind, result="rejected").inc()
+            return
+        except Exception as e:
+            logger.warning(f"Ошибка упреждающей загрузки видео {video_id}: {e}")
+            PREFETCH_RESULTS.labels(kind=kind, result="failed").inc()
+            return
+        PREFETCH_RESULTS.labels(kind=kind, result="warmed" if warmed else "cached").inc()
+        logger.info(f"Видео {video_id} подготовлено заранее ({'аудио' if with_audio else 'информация'})")
+
+    async def shutdown(self) -> None:
+        """Отменяет всю упреждающую работу (при остановке бота)"""
+        tasks = [task for task in self._sessions.values() if not task.done()]
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+# Создаем глобальный экземпляр упреждающей загрузки
+search_prefetcher = SearchPrefetcher(
+    PREFETCH_ENABLED, PREFETCH_TOP_K, PREFETCH_AUDIO_COUNT, PREFETCH_CONCURRENCY, PREFETCH_TTL
+)
@@ -0,0 +1,278 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
+
+import aiohttp
+
+from config import (
+    MAX_CONCURRENT_DOWNLOADS, RANGED_DOWNLOAD_CHUNK_SIZE, RANGED_DOWNLOAD_CONNECTIONS, RANGED_DOWNLOAD_RETRIES
+)
+from services.metrics import record_download
+
+logger = logging.getLogger(__name__)
+
+# Протоколы форматов, которые отдаются одним файлом по прямой ссылке
+RANGED_PROTOCOLS = ("http", "https")
+
+# Размер блока чтения ответа
+READ_BLOCK_SIZE = 64 * 1024
+
+# Данные диапазона накапливаются в памяти и записываются в файл в потоке блоками не больше этого размера
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+# Интервал сохранения прогресса загрузки (секунды)
+PROGRESS_SAVE_INTERVAL = 2
+
+class RangedDownloadError(Exception):
+    """Источник не отдает поток по частям (нет поддержки Range или размер потока изменился)"""
+
+def _parse_content_range(header: Optional[str]) -> Optional[int]:
+    """Возвращает полный размер потока из заголовка Content-Range (bytes start-end/total)"""
+    if not header or "/" not in header:
+        return None
+    total = header.rsplit("/", 1)[1].strip()
+    return int(total) if total.isdigit() else None
+
+class RangedDownloader:
+    """
+    Загрузка одиночного аудиопотока (прямая ссылка на m4a/webm) по частям.
+
+    yt-dlp загружает такой формат одним соединением, а YouTube ограничивает скорость
+    каждого соединения. Поток известной длины делится на диапазоны байт, которые
+    загружаются параллельно через общий пул соединений и записываются на свои места
+    в итоговый файл. Каждый диапазон повторяется при сетевых ошибках с места обрыва.
+
+    Загруженные диапазоны отмечаются в файле прогресса рядом с .part, поэтому загрузка,
+    прерванная остановкой или падением бота, продолжается с недостающих диапазонов.
+    Запись в файл и сохранение прогресса (раз в PROGRESS_SAVE_INTERVAL секунд) выполняются
+    в потоках и не блокируют цикл событий.
+    """
+
+    def __init__(self, connections: int, chunk_size: int, retries: int):
+        """
+        Args:
+            connections: Одновременных соединений на одну загрузку
+            chunk_size: Размер диапазона в байтах
+            retries: Повторов каждого диапазона при сетевых ошибках
+        """
+        self._connections = max(1, connections)
+        self._chunk_size = max(READ_BLOCK_SIZE, chunk_size)
+        self._retries = retries
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        """Возвращает общую HTTP-сессию (создается при первом использовании)"""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=None, sock_connect=10, sock_read=30),
+                connector=aiohttp.TCPConnector(
+                    limit=self._connections * MAX_CONCURRENT_DOWNLOADS, ttl_dns_cache=300
+                ),
+                # Ответы пишутся в файл как есть - сжатие и автоматическая распаковка не нужны
+                auto_decompress=False,
+            )
+        return self._session
+
+    async def close(self) -> None:
+        """Закрывает HTTP-сессию"""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    @staticmethod
+    def supports(info: Optional[Dict[str, Any]]) -> bool:
+        """
+        Проверяет, можно ли загрузить выбранный формат по частям
+
+        Args:
+            info: Компактный info dict с выбранным форматом (см. services.ydl_engine.compact_info)
+        """
+        return bool(info and info.get("url") and info.get("ext") and info.get("protocol") in RANGED_PROTOCOLS)
+
+    async def download(self, url: str, path: str, headers: Optional[Dict[str, str]] = None,
+                       size: Optional[int] = None) -> int:
+        """
+        Загружает поток по частям в файл. Файл появляется под итоговым именем только
+        после загрузки всех диапазонов. Если от прерванной загрузки того же потока
+        остался .part файл, загружаются только недостающие диапазоны.
+
+        Args:
+            url: Прямая ссылка на поток
+            path: Путь итогового файла
+            headers: HTTP-заголовки формата
+            size: Размер потока, если известен (иначе определяется по первому диапазону)
+
+        Returns:
+            int: Размер загруженного файла в байтах
+
+        Raises:
+            RangedDownloadError: Если источник не поддерживает загрузку по частям
+            aiohttp.ClientError, asyncio.TimeoutError: Если диапазон не удалось загрузить после всех повторов
+        """
+        headers = {**(headers or {}), "Accept-Encoding": "identity"}
+        part_path = path + ".part"
+        progress_path = part_path + ".ranges"
+        started = time.perf_counter()
+        # Начала уже загруженных диапазонов
+        done = self._load_progress(part_path, progress_path, size)
+        # Запись диапазонов и сброс файла на диск выполняются в разных потоках
+        write_lock = threading.Lock()
+        try:
+            with open(part_path, "r+b" if done else "wb") as file:
+                ranges: Deque[Tuple[int, int]] = deque()
+                if size:
+                    ranges.extend(r for r in self._split(0, size) if r[0] not in done)
+                    if done:
+                        logger.info(
+                            f"Продолжаю прерванную загрузку по частям: осталось {len(ranges)} из "
+                            f"{len(ranges) + len(done)} диапазонов"
+                        )
+                else:
+                    # Размер неизвестен - первый диапазон загружается отдельно и сообщает полный размер
+                    first_end = self._chunk_size - 1
+                    size = await self._fetch_range(url, headers, file, write_lock, 0, first_end, None)
+                    if not size:
+                        raise RangedDownloadError("Источник не сообщил размер потока")
+                    done.add(0)
+                    ranges.extend(self._split(first_end + 1, size))
+                file.truncate(size)
+
+                async def worker():
+                    while ranges:
+                        start, end = ranges.popleft()
+                        await self._fetch_range(url, headers, file, write_lock, start, end, size)
+                        done.add(start)
+
+                finished = asyncio.Event()
+
+                async def save_progress():
+                    saved = len(done)
+                    while not finished.is_set():
+                        try:
+                            await asyncio.wait_for(finished.wait(), PROGRESS_SAVE_INTERVAL)
+                        except asyncio.TimeoutError:
+                            pass
+                        if len(done) != saved and not finished.is_set():
+                            saved = len(done)
+                            await asyncio.to_thread(
+                                self._save_progress, file, write_lock, progress_path, size, sorted(done)
+                            )
+
+                workers = [asyncio.create_task(worker()) for _ in range(min(self._connections, len(ranges)))]
+                saver = asyncio.create_task(save_progress())
+                try:
+                    await asyncio.gather(*workers)
+                finally:
+                    for task in workers:
+                        task.cancel()
+                    # Сохранение прогресса дописывается до конца, чтобы не пересоздать файл прогресса
+                    # после его удаления и не писать в закрытый файл
+                    finished.set()
+                    await asyncio.gather(saver, return_exceptions=True)
+            os.replace(part_path, path)
+            self._remove(progress_path)
+        except asyncio.CancelledError:
+            # Остановка бота: загруженные диапазоны сохраняются до перезапуска
+            raise
+        except BaseException:
+            self._remove(part_path, progress_path)
+            raise
+
+        elapsed = time.perf_counter() - started
+        record_download(elapsed, size)
+        logger.info(
+            f"Поток загружен по частям: {size / 1024 / 1024:.1f} МБ за {elapsed:.1f} с "
+            f"({self._connections} соединений)"
+        )
+        return size
+
+    @staticmethod
+    def _remove(*paths: str) -> None:
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _load_progress(self, part_path: str, progress_path: str, size: Optional[int]) -> Set[int]:
+        """
+        Возвращает начала диапазонов, загруженных до прерывания. Прогресс используется, только если
+        он относится к потоку того же размера и с тем же размером диапазона
+        """
+        if not size or not os.path.exists(part_path) or os.path.getsize(part_path) != size:
+            return set()
+        try:
+            with open(progress_path, encoding="utf-8") as f:
+                progress = json.load(f)
+        except (OSError, ValueError):
+            return set()
+        if progress.get("size") != size or progress.get("chunk_size") != self._chunk_size:
+            return set()
+        return set(progress.get("done") or ())
+
+    def _save_progress(self, file, write_lock: threading.Lock, progress_path: str, size: int,
+                       done: List[int]) -> None:
+        """Отмечает загруженные диапазоны после сброса их данных в .part файл (выполняется в потоке)"""
+        with write_lock:
+            file.flush()
+        temp_path = progress_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump({"size": size, "chunk_size": self._chunk_size, "done": done}, f)
+        os.replace(temp_path, progress_path)
+
+    @staticmethod
+    def _write_at(file, write_lock: threading.Lock, position: int, data: bytes) -> None:
+        """Записывает данные на свое место в файле (выполняется в потоке)"""
+        with write_lock:
+            file.seek(position)
+            file.write(data)
+
+    def _split(self, start: int, size: int):
+        """Делит оставшуюся часть потока на диапазоны (включительно, как в заголовке Range)"""
+        for position in range(start, size, self._chunk_size):
+            yield position, min(position + self._chunk_size, size) - 1
+
+    async def _fetch_range(self, url: str, headers: Dict[str, str], file, write_lock: threading.Lock,
+                           start: int, end: int, size: Optional[int]) -> Optional[int]:
+        """
+        Загружает диапазон байт и записывает его на свое место в файле.
+        При сетевой ошибке диапазон запрашивается повторно с конца записанной части.
+
+        Returns:
+            int: Полный размер потока из Content-Range
+        """
+        position = start
+        attempt = 0
+        while True:
+            buffer = bytearray()
+            try:
+                request_headers = {**headers, "Range": f"bytes={position}-{end}"}
+                async with self._get_session().get(url, headers=request_headers) as response:
+                    if response.status != 206:
+                        raise RangedDownloadError(f"Источник не поддерживает Range (HTTP {response.status})")
+                    total = _parse_content_range(response.headers.get("Content-Range"))
+                    if size and total and total != size:
+                        raise RangedDownloadError(f"Размер потока изменился: {total} вместо {size}")
+                    async for block in response.content.iter_chunked(READ_BLOCK_SIZE):
+                        buffer += block[:end - position - len(buffer) + 1]
+                        if len(buffer) >= WRITE_BUFFER_SIZE or position + len(buffer) > end:
+                            await asyncio.to_thread(self._write_at, file, write_lock, position, buffer)
+                            position += len(buffer)
+                            buffer = bytearray()
+                        if position > end:
+                            break
+                if position <= end:
+                    raise aiohttp.ClientPayloadError(f"Диапазон {start}-{end} получен не полностью")
+                return total
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                attempt += 1
+                if attempt > self._retries:
+                    raise
+                logger.warning(f"Ошибка загрузки диапазона {position}-{end} (попытка {attempt}): {e}")
+                await asyncio.sleep(min(0.5 * 2 ** attempt, 5))
+
+# Создаем глобальный экземпляр загрузчика
+ranged_downloader = RangedDownloader(RANGED_DOWNLOAD_CONNECTIONS, RANGED_DOWNLOAD_CHUNK_SIZE, RANGED_DOWNLOAD_RETRIES)
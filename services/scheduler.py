@@ -0,0 +1,265 @@
+import asyncio
+import itertools
+import logging
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, Optional, Tuple
+
+from services.metrics import QUEUED_JOBS
+from config import (
+    MAX_CONCURRENT_DOWNLOADS, MAX_DOWNLOADS_PER_USER, MAX_DOWNLOADS_PER_CHAT, CHAT_QUEUE_WEIGHTS
+)
+
+logger = logging.getLogger(__name__)
+
+# Тип обратного вызова, которому сообщается позиция задачи в очереди
+PositionCallback = Callable[[int], Awaitable[Any]]
+
+class DownloadJob:
+    """Задача в очереди планировщика загрузок"""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, user_id: int, chat_key: Tuple[int, Optional[int]],
+                 on_position: Optional[PositionCallback] = None,
+                 group: Optional[Hashable] = None, group_limit: int = 1):
+        self.id = next(self._ids)
+        self.user_id = user_id
+        self.chat_key = chat_key
+        self.on_position = on_position
+        # Группа задач одного запроса (например, треки плейлиста) со своим лимитом вместо лимита пользователя
+        self.group = group
+        self.group_limit = group_limit
+        self.position: Optional[int] = None
+        # Задача ожидала в очереди перед запуском
+        self.was_queued = False
+        self.started = asyncio.get_running_loop().create_future()
+
+class DownloadScheduler:
+    """
+    Планировщик загрузок с глобальным ограничением параллельности,
+    ограничениями на пользователя и на чат/топик и справедливой очередью.
+
+    Каждый чат (или топик) имеет свою очередь. Свободные слоты раздаются
+    по кругу между чатами (взвешенный round-robin), поэтому один активный
+    чат не может занять все слоты и задержать остальных.
+
+    Задачи одной группы (треки плейлиста) ограничиваются лимитом группы вместо
+    лимита пользователя, поэтому плейлист не занимает пользовательские слоты,
+    но по-прежнему подчиняется общему лимиту и лимиту чата.
+    """
+
+    def __init__(self, max_concurrent: int, per_user: int, per_chat: int,
+                 chat_weights: Optional[Dict[int, int]] = None):
+        self._max_concurrent = max_concurrent
+        self._per_user = per_user
+        self._per_chat = per_chat
+        self._chat_weights = chat_weights or {}
+
+        # Очереди ожидающих задач по чатам в порядке обхода round-robin
+        self._queues: "OrderedDict[Tuple[int, Optional[int]], Deque[DownloadJob]]" = OrderedDict()
+        # Сколько задач чат еще может запустить в текущем круге (с учетом веса)
+        self._credits: Dict[Tuple[int, Optional[int]], int] = {}
+
+        self._running = 0
+        self._running_by_user: Dict[int, int] = {}
+        self._running_by_chat: Dict[Tuple[int, Optional[int]], int] = {}
+        self._running_by_group: Dict[Hashable, int] = {}
+
+        # Ссылки на задачи уведомлений, чтобы их не удалил сборщик мусора
+        self._notify_tasks = set()
+
+    @property
+    def running(self) -> int:
+        """Количество выполняющихся загрузок"""
+        return self._running
+
+    @property
+    def queued(self) -> int:
+        """Количество задач, ожидающих в очереди"""
+        return sum(len(queue) for queue in self._queues.values())
+
+    def _weight(self, chat_key: Tuple[int, Optional[int]]) -> int:
+        """Возвращает вес чата в справедливой очереди"""
+        return max(1, self._chat_weights.get(chat_key[0], 1))
+
+    def _owner(self, job: DownloadJob) -> Tuple[Dict[Any, int], Any, int]:
+        """Счетчик, ключ и лимит, которым ограничивается задача: группа или пользователь"""
+        if job.group is not None:
+            return self._running_by_group, job.group, job.group_limit
+        return self._running_by_user, job.user_id, self._per_user
+
+    def _can_start(self, job: DownloadJob) -> bool:
+        """Проверяет, позволяют ли ограничения запустить задачу прямо сейчас"""
+        counters, key, limit = self._owner(job)
+        return (
+            self._running < self._max_concurrent
+            and counters.get(key, 0) < limit
+            and self._running_by_chat.get(job.chat_key, 0) < self._per_chat
+        )
+
+    def _start(self, job: DownloadJob) -> None:
+        """Отмечает задачу как запущенную"""
+        self._running += 1
+        counters, key, _ = self._owner(job)
+        counters[key] = counters.get(key, 0) + 1
+        self._running_by_chat[job.chat_key] = self._running_by_chat.get(job.chat_key, 0) + 1
+        job.position = 0
+        if not job.started.done():
+            job.started.set_result(None)
+
+    def _finish(self, job: DownloadJob) -> None:
+        """Освобождает слоты завершенной задачи"""
+        self._running -= 1
+        owner_counters, owner_key, _ = self._owner(job)
+        for counters, key in ((owner_counters, owner_key), (self._running_by_chat, job.chat_key)):
+            count = counters.get(key, 0) - 1
+            if count > 0:
+                counters[key] = count
+            else:
+                counters.pop(key, None)
+
+    def _dispatch(self) -> None:
+        """Запускает ожидающие задачи, обходя очереди чатов по кругу"""
+        while self._running < self._max_concurrent and self._queues:
+            started = False
+            for chat_key in list(self._queues.keys()):
+                queue = self._queues[chat_key]
+                # Берем первую задачу чата, которую разрешают ограничения на пользователя или группу
+                # (отмененная задача еще в очереди, пока ее не уберет acquire, - слот ей не выдается)
+                job = next(
+                    (candidate for candidate in queue if not candidate.started.done() and self._can_start(candidate)),
+                    None
+                )
+                if job is None:
+                    continue
+
+                queue.remove(job)
+                self._start(job)
+                started = True
+
+                # Расходуем кредит чата; когда он исчерпан, чат уходит в конец круга
+                self._credits[chat_key] = self._credits.get(chat_key, self._weight(chat_key)) - 1
+                if not queue:
+                    del self._queues[chat_key]
+                    self._credits.pop(chat_key, None)
+                elif self._credits[chat_key] <= 0:
+                    self._queues.move_to_end(chat_key)
+                    self._credits[chat_key] = self._weight(chat_key)
+                break
+
+            if not started:
+                break
+        self._update_positions()
+
+    def _update_positions(self) -> None:
+        """Пересчитывает позиции ожидающих задач и уведомляет об изменениях"""
+        # Позиции соответствуют порядку выдачи слотов при обходе по кругу
+        queues = [list(queue) for queue in self._queues.values()]
+        position = 0
+        depth = 0
+        while any(depth < len(queue) for queue in queues):
+            for queue in queues:
+                if depth < len(queue):
+                    position += 1
+                    job = queue[depth]
+                    if job.position != position:
+                        job.position = position
+                        if job.on_position:
+                            task = asyncio.create_task(self._notify(job, position))
+                            self._notify_tasks.add(task)
+                            task.add_done_callback(self._notify_tasks.discard)
+            depth += 1
+
+    @staticmethod
+    async def _notify(job: DownloadJob, position: int) -> None:
+        """Сообщает задаче ее позицию в очереди, не прерывая планировщик при ошибках"""
+        if job.started.done():
+            # Задача уже запущена - позиция больше не актуальна
+            return
+        try:
+            await job.on_position(position)
+        except Exception as e:
+            logger.debug(f"Не удалось сообщить позицию в очереди для задачи {job.id}: {e}")
+
+    async def acquire(self, user_id: int, chat_id: int, topic_id: Optional[int] = None,
+                      on_position: Optional[PositionCallback] = None,
+                      group: Optional[Hashable] = None, group_limit: int = 1) -> DownloadJob:
+        """
+        Ставит задачу в очередь и ожидает, пока для нее освободится слот
+
+        Args:
+            user_id: ID пользователя
+            chat_id: ID чата
+            topic_id: ID темы/топика
+            on_position: Корутина, вызываемая при изменении позиции в очереди
+            group: Ключ группы задач; задача группы не занимает слот пользователя
+            group_limit: Сколько задач группы может выполняться одновременно
+
+        Returns:
+            Запущенная задача (передается в release после завершения)
+        """
+        job = DownloadJob(user_id, (chat_id, topic_id), on_position, group, group_limit)
+        self._queues.setdefault(job.chat_key, deque()).append(job)
+        self._dispatch()
+        if job.started.done():
+            return job
+
+        job.was_queued = True
+        logger.info(
+            f"Загрузка для пользователя {user_id} в чате {chat_id} поставлена в очередь "
+            f"(позиция {job.position}, выполняется {self._running})"
+        )
+        try:
+            await job.started
+        except asyncio.CancelledError:
+            if job.started.done() and not job.started.cancelled():
+                # Слот успели выдать - возвращаем его
+                self.release(job)
+            else:
+                queue = self._queues.get(job.chat_key)
+                if queue and job in queue:
+                    queue.remove(job)
+                    if not queue:
+                        del self._queues[job.chat_key]
+                        self._credits.pop(job.chat_key, None)
+                self._update_positions()
+            raise
+        return job
+
+    def release(self, job: DownloadJob) -> None:
+        """
+        Освобождает слот завершенной задачи и запускает следующие из очереди
+
+        Args:
+            job: Задача, полученная из acquire
+        """
+        self._finish(job)
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, user_id: int, chat_id: int, topic_id: Optional[int] = None,
+                   on_position: Optional[PositionCallback] = None,
+                   group: Optional[Hashable] = None, group_limit: int = 1):
+        """
+        Контекстный менеджер: ожидает слот загрузки и освобождает его при выходе
+
+        Args:
+            user_id: ID пользователя
+            chat_id: ID чата
+            topic_id: ID темы/топика
+            on_position: Корутина, вызываемая при изменении позиции в очереди
+            group: Ключ группы задач; задача группы не занимает слот пользователя
+            group_limit: Сколько задач группы может выполняться одновременно
+        """
+        job = await self.acquire(user_id, chat_id, topic_id, on_position, group, group_limit)
+        try:
+            yield job
+        finally:
+            self.release(job)
+
+# Создаем глобальный экземпляр планировщика
+download_scheduler = DownloadScheduler(
+    MAX_CONCURRENT_DOWNLOADS, MAX_DOWNLOADS_PER_USER, MAX_DOWNLOADS_PER_CHAT, CHAT_QUEUE_WEIGHTS
+)
+QUEUED_JOBS.set_function(lambda: download_scheduler.queued)
@@ -0,0 +1,144 @@
+import asyncio
+import logging
+import time
+import unicodedata
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+from cachetools import TLRUCache
+
+from config import SEARCH_CACHE_TTL, SEARCH_CACHE_STALE_TTL, SEARCH_CACHE_SIZE, SEARCH_CACHE_TRANSLITERATE
+from services.metrics import record_cache_lookup
+
+logger = logging.getLogger(__name__)
+
+# Ключ кэша: (нормализованный запрос, лимит результатов)
+SearchKey = Tuple[str, int]
+
+# Кириллица в латиницу (по правилам транслитерации загранпаспортов РФ, с украинскими буквами)
+TRANSLITERATION = str.maketrans({
+    "а": "a", "б": "b", "в": "v", "г": "g", "д": "d", "е": "e", "ж": "zh", "з": "z", "и": "i",
+    "й": "i", "к": "k", "л": "l", "м": "m", "н": "n", "о": "o", "п": "p", "р": "r", "с": "s",
+    "т": "t", "у": "u", "ф": "f", "х": "kh", "ц": "ts", "ч": "ch", "ш": "sh", "щ": "shch",
+    "ъ": "", "ы": "y", "ь": "", "э": "e", "ю": "iu", "я": "ia",
+    "і": "i", "ї": "i", "є": "ie", "ґ": "g",
+})
+
+# Апострофы удаляются без разделения слов ("don't" и "dont" - один запрос)
+APOSTROPHES = str.maketrans({"'": "", "’": "", "`": "", "ʼ": ""})
+
+def normalize_query(query: str, transliterate: bool = False) -> str:
+    """
+    Приводит поисковый запрос к виду ключа кэша: регистр, буква ё, пробелы и знаки препинания
+    не влияют на ключ ("Rammstein - Sonne!" и "rammstein  sonne" совпадают)
+
+    Args:
+        query: Поисковый запрос
+        transliterate: Привести кириллицу к латинице
+
+    Returns:
+        str: Нормализованный запрос
+    """
+    text = unicodedata.normalize("NFKC", query).casefold().replace("ё", "е").translate(APOSTROPHES)
+    text = "".join(char if char.isalnum() else " " for char in text)
+    if transliterate:
+        text = text.translate(TRANSLITERATION)
+    # Запрос только из знаков препинания остается самим собой
+    return " ".join(text.split()) or query.strip().casefold()
+
+class SearchCache:
+    """
+    Кэш результатов поиска по нормализованному запросу.
+
+    Свежие результаты (моложе ttl) выдаются без запроса к YouTube Music. Устаревшие, но не старше
+    ttl + stale_ttl, выдаются сразу, а запрос обновляется в фоне. Одновременные запросы с одним ключом
+    ожидают один поиск. Пустые результаты (поиск ничего не нашел или завершился ошибкой) не кэшируются.
+    При переполнении вытесняются давно не запрашивавшиеся запросы.
+    """
+
+    def __init__(self, ttl: int, stale_ttl: int, max_size: int, transliterate: bool):
+        self._ttl = ttl
+        self._stale_ttl = max(0, stale_ttl)
+        self._transliterate = transliterate
+        self._entries: TLRUCache = TLRUCache(
+            maxsize=max(1, max_size),
+            ttu=lambda _key, entry, _now: entry["fetched_at"] + self._ttl + self._stale_ttl,
+            timer=time.time,
+        )
+        # Выполняющиеся поиски по ключу
+        self._inflight: Dict[SearchKey, asyncio.Task] = {}
+
+    @property
+    def enabled(self) -> bool:
+        """Включен ли кэш"""
+        return self._ttl > 0
+
+    def key(self, query: str, limit: int) -> SearchKey:
+        """Возвращает ключ кэша для запроса"""
+        return normalize_query(query, self._transliterate), limit
+
+    async def get(self, query: str, limit: int,
+                  search: Callable[[str, int], Awaitable[List[Dict[str, Any]]]]) -> List[Dict[str, Any]]:
+        """
+        Возвращает результаты поиска из кэша или выполняет поиск
+
+        Args:
+            query: Поисковый запрос
+            limit: Максимальное количество результатов
+            search: Функция поиска без кэша (запрос, лимит) -> результаты
+
+        Returns:
+            Список результатов поиска (копия, ее можно изменять)
+        """
+        if not self.enabled:
+            return await search(query, limit)
+
+        key = self.key(query, limit)
+        entry = self._entries.get(key)
+        if entry is not None:
+            record_cache_lookup("search", True)
+            if time.time() - entry["fetched_at"] >= self._ttl:
+                # Устаревшие результаты выдаются сразу, обновление идет в фоне
+                logger.info(f"Результаты поиска '{key[0]}' устарели, обновляем в фоне")
+                self._start_search(key, query, limit, search)
+            return [dict(result) for result in entry["results"]]
+
+        record_cache_lookup("search", False)
+        # Отмена ожидающего не прерывает поиск: его результат нужен другим и кэшу
+        results = await asyncio.shield(self._start_search(key, query, limit, search))
+        return [dict(result) for result in results]
+
+    def _start_search(self, key: SearchKey, query: str, limit: int,
+                      search: Callable[[str, int], Awaitable[List[Dict[str, Any]]]]) -> asyncio.Task:
+        """Запускает поиск по ключу или возвращает уже выполняющийся"""
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._search(key, query, limit, search))
+            self._inflight[key] = task
+
+            def forget_search(_task, key=key):
+                if self._inflight.get(key) is _task:
+                    self._inflight.pop(key, None)
+                if not _task.cancelled() and _task.exception() is not None:
+                    logger.warning(f"Ошибка поиска '{key[0]}': {_task.exception()}")
+
+            task.add_done_callback(forget_search)
+        return task
+
+    async def _search(self, key: SearchKey, query: str, limit: int,
+                      search: Callable[[str, int], Awaitable[List[Dict[str, Any]]]]) -> List[Dict[str, Any]]:
+        """Выполняет поиск и сохраняет непустые результаты"""
+        results = await search(query, limit)
+        if results:
+            self._entries[key] = {"results": results, "fetched_at": time.time()}
+        return results
+
+    async def shutdown(self) -> None:
+        """Отменяет выполняющиеся поиски (при остановке бота)"""
+        tasks = [task for task in self._inflight.values() if not task.done()]
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+# Создаем глобальный кэш результатов поиска
+search_cache = SearchCache(SEARCH_CACHE_TTL, SEARCH_CACHE_STALE_TTL, SEARCH_CACHE_SIZE, SEARCH_CACHE_TRANSLITERATE)
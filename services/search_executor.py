@@ -0,0 +1,72 @@
+import asyncio
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from config import SEARCH_EXECUTOR_WORKERS, SEARCH_TIMEOUT
+from services.metrics import record_failure
+
+logger = logging.getLogger(__name__)
+
+class SearchTimeoutError(TimeoutError):
+    """Запрос поиска не завершился за отведенное время"""
+
+class SearchExecutor:
+    """
+    Исполнитель синхронных запросов поиска (YouTube Music, резервный поиск yt-dlp).
+
+    Запросы выполняются в отдельном ограниченном пуле потоков: они не блокируют цикл событий
+    и не ждут в одной очереди с загрузками (пул yt-dlp) и файловыми операциями (пул по умолчанию).
+    Каждый запрос ограничен таймаутом, включающим ожидание свободного потока. При таймауте
+    или отмене запрос, еще не начавшийся, снимается с очереди, а выполняющийся дорабатывает
+    в своем потоке до сетевого таймаута, и его результат отбрасывается.
+    """
+
+    def __init__(self, workers: int, timeout: float):
+        self._workers = max(1, workers)
+        self._timeout = timeout
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def start(self) -> None:
+        """Создает пул потоков (вызывается при запуске бота или при первом запросе)"""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix="search")
+            logger.info(f"Запущен пул потоков поиска ({self._workers} потоков)")
+
+    def shutdown(self) -> None:
+        """Останавливает пул потоков, ожидающие запросы отменяются"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def run(self, func: Callable[..., Any], *args: Any, timeout: Optional[float] = None, **kwargs: Any) -> Any:
+        """
+        Выполняет синхронный запрос поиска в пуле потоков
+
+        Args:
+            func: Синхронная функция запроса
+            *args: Позиционные аргументы функции
+            timeout: Таймаут в секундах (по умолчанию SEARCH_TIMEOUT)
+            **kwargs: Именованные аргументы функции
+
+        Returns:
+            Результат функции
+
+        Raises:
+            SearchTimeoutError: Если запрос не завершился за отведенное время
+        """
+        self.start()
+        timeout = self._timeout if timeout is None else timeout
+        future = asyncio.get_running_loop().run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError as e:
+            name = getattr(func, "__qualname__", None) or getattr(func, "__name__", repr(func))
+            error = SearchTimeoutError(f"Запрос поиска {name} не завершился за {timeout} с")
+            record_failure('search', error)
+            logger.warning(str(error))
+            raise error from e
+
+# Создаем глобальный исполнитель поиска
+search_executor = SearchExecutor(SEARCH_EXECUTOR_WORKERS, SEARCH_TIMEOUT)
@@ -0,0 +1,124 @@
+import asyncio
+import logging
+from typing import AsyncGenerator, Dict, List, Optional
+
+import aiohttp
+from aiogram.types import InputFile
+
+from services.transcoder import FFMPEG_STDERR_TAIL, transcoder
+
+logger = logging.getLogger(__name__)
+
+# Размер блока, которым выход ffmpeg передается в тело запроса к Telegram
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Размер диапазона одного HTTP-запроса к источнику
+# (YouTube ограничивает скорость длинных запросов без Range, как и yt-dlp, качаем частями)
+SOURCE_RANGE_SIZE = 10 * 1024 * 1024
+
+def _parse_total_size(content_range: Optional[str]) -> Optional[int]:
+    """Возвращает полный размер ресурса из заголовка Content-Range (bytes 0-99/1000)"""
+    if not content_range or "/" not in content_range:
+        return None
+    total = content_range.rsplit("/", 1)[1].strip()
+    return int(total) if total.isdigit() else None
+
+class StreamingAudioFile(InputFile):
+    """
+    Аудиофайл для отправки в Telegram, который формируется на лету.
+
+    Байты аудиопотока скачиваются из источника и подаются на stdin ffmpeg,
+    а stdout ffmpeg блоками передается в тело multipart-запроса aiogram.
+    Все буферы ограничены: запись в stdin ждет, пока ffmpeg заберет данные,
+    чтение stdout ждет, пока aiohttp отправит предыдущий блок. Файл на диск
+    не пишется, отправка начинается до окончания скачивания. Процесс ffmpeg кодирует,
+    поэтому все время своей работы занимает место в очереди менеджера перекодирования.
+    """
+
+    def __init__(self, source_url: str, headers: Optional[Dict[str, str]], ffmpeg_args: List[str],
+                 filename: str, chunk_size: int = STREAM_CHUNK_SIZE):
+        """
+        Args:
+            source_url: Прямая ссылка на аудиопоток
+            headers: HTTP-заголовки для запросов к источнику
+            ffmpeg_args: Параметры кодирования ffmpeg (между входом и выходом pipe:1)
+            filename: Имя файла, передаваемое в Telegram
+            chunk_size: Размер блока передачи
+        """
+        super().__init__(filename=filename, chunk_size=chunk_size)
+        self._source_url = source_url
+        self._headers = dict(headers or {})
+        self._ffmpeg_args = ffmpeg_args
+        # Сколько байт готового аудио передано в запрос
+        self.bytes_sent = 0
+
+    async def _feed_source(self, stdin: asyncio.StreamWriter) -> None:
+        """Скачивает аудиопоток диапазонами и записывает его в stdin ffmpeg"""
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=10, sock_read=30)
+        try:
+            async with aiohttp.ClientSession(timeout=timeout) as session:
+                offset = 0
+                while True:
+                    headers = dict(self._headers)
+                    headers["Range"] = f"bytes={offset}-{offset + SOURCE_RANGE_SIZE - 1}"
+                    received = 0
+                    async with session.get(self._source_url, headers=headers) as response:
+                        response.raise_for_status()
+                        async for chunk in response.content.iter_chunked(self.chunk_size):
+                            stdin.write(chunk)
+                            await stdin.drain()
+                            received += len(chunk)
+                        total = _parse_total_size(response.headers.get("Content-Range"))
+                        partial = response.status == 206
+
+                    offset += received
+                    # Источник отдал весь файл целиком или диапазоны закончились
+                    if not partial or received == 0 or (total is not None and offset >= total):
+                        break
+        except (BrokenPipeError, ConnectionResetError):
+            # ffmpeg завершился раньше - причину сообщит его код возврата
+            return
+        finally:
+            if not stdin.is_closing():
+                stdin.close()
+
+    async def read(self, bot) -> AsyncGenerator[bytes, None]:
+        async with transcoder.slot():
+            process = await transcoder.spawn(
+                ["-i", "pipe:0", *self._ffmpeg_args, "pipe:1"],
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                # Ограничиваем буфер чтения stdout размером блока
+                limit=self.chunk_size,
+            )
+            feeder = asyncio.create_task(self._feed_source(process.stdin))
+            stderr_reader = asyncio.create_task(process.stderr.read())
+            logger.info(f"Запущена потоковая передача аудио {self.filename}")
+            try:
+                while True:
+                    chunk = await process.stdout.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    self.bytes_sent += len(chunk)
+                    yield chunk
+
+                # Ошибка источника или ffmpeg прерывает запрос, чтобы Telegram не получил обрезанный файл
+                await feeder
+                return_code = await process.wait()
+                if return_code != 0:
+                    stderr = (await stderr_reader)[-FFMPEG_STDERR_TAIL:].decode(errors="replace").strip()
+                    raise RuntimeError(f"ffmpeg завершился с кодом {return_code}: {stderr}")
+                logger.info(
+                    f"Потоковая передача {self.filename} завершена ({self.bytes_sent / 1024 / 1024:.1f} МБ)"
+                )
+            finally:
+                if not feeder.done():
+                    feeder.cancel()
+                elif not feeder.cancelled():
+                    # Забираем исключение источника, если передача прервалась раньше
+                    feeder.exception()
+                if process.returncode is None:
+                    process.kill()
+                    await process.wait()
+                stderr_reader.cancel()
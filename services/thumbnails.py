@@ -0,0 +1,259 @@
+import asyncio
+import logging
+import os
+import uuid
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set
+
+import aiohttp
+
+from config import THUMBNAIL_CACHE_DIR, THUMBNAIL_CACHE_MAX_FILES
+from services.metrics import record_cache_lookup, timed_stage
+from services.transcoder import TranscodeError, transcoder
+
+logger = logging.getLogger(__name__)
+
+# Требования Telegram к обложке аудио: JPEG, не больше 320 пикселей по каждой стороне и до 200 КБ
+THUMBNAIL_MAX_SIDE = 320
+THUMBNAIL_MAX_BYTES = 200 * 1024
+
+# Качество JPEG для ffmpeg (-q:v, меньше - лучше), перебирается, пока обложка не уложится в лимит
+THUMBNAIL_QUALITY_STEPS = (3, 6, 10, 16)
+
+# Максимальный размер исходного изображения
+SOURCE_MAX_BYTES = 5 * 1024 * 1024
+
+# Обложка YouTube, доступная для любого видео (используется, если ссылка на миниатюру неизвестна)
+FALLBACK_THUMBNAIL_URL = "https://i.ytimg.com/vi/{video_id}/hqdefault.jpg"
+
+class ThumbnailService:
+    """
+    Обложки треков для Telegram.
+
+    Исходное изображение загружается через общий пул HTTP-соединений (параллельно
+    с загрузкой аудио), уменьшается ffmpeg до требований Telegram и сохраняется
+    в кэш по videoId. Повторные запросы получают готовый файл без загрузки
+    и обработки изображения, одновременные запросы одной обложки объединяются.
+    Каждый запрос получает ссылку на обложку и освобождает ее после отправки (release):
+    вытесненная из кэша обложка удаляется, только когда на нее не осталось ссылок.
+    """
+
+    def __init__(self, cache_dir: str, max_files: int):
+        self._cache_dir = cache_dir
+        self._max_files = max_files
+        os.makedirs(cache_dir, exist_ok=True)
+
+        self._session: Optional[aiohttp.ClientSession] = None
+        # Активные загрузки обложек: video_id -> задача
+        self._inflight: Dict[str, asyncio.Task] = {}
+
+        # Файлы кэша в порядке последнего использования: video_id -> путь
+        self._files: "OrderedDict[str, str]" = OrderedDict()
+        # Ссылки на обложки, выданные запросам: путь -> количество
+        self._refs: Dict[str, int] = {}
+        # Вытесненные обложки, которые еще используются: удаляются при освобождении последней ссылки
+        self._evicted: Set[str] = set()
+        entries = []
+        with os.scandir(cache_dir) as iterator:
+            for entry in iterator:
+                if entry.is_file() and entry.name.endswith(".jpg"):
+                    entries.append((entry.stat().st_mtime, entry.name[:-4], entry.path))
+                elif entry.is_file() and entry.name.endswith(".tmp"):
+                    # Остаток прерванной записи
+                    os.remove(entry.path)
+        for _, video_id, path in sorted(entries):
+            self._files[video_id] = path
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        """Возвращает общую HTTP-сессию (создается при первом использовании)"""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=10),
+                connector=aiohttp.TCPConnector(limit=20, ttl_dns_cache=300),
+            )
+        return self._session
+
+    async def close(self) -> None:
+        """Закрывает HTTP-сессию"""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def owns(self, path: Optional[str]) -> bool:
+        """Проверяет, является ли файл обложкой из кэша (такие файлы не удаляются после отправки)"""
+        return bool(path) and os.path.dirname(os.path.abspath(path)) == os.path.abspath(self._cache_dir)
+
+    def cached_path(self, video_id: str) -> Optional[str]:
+        """
+        Возвращает путь к готовой обложке из кэша без загрузки
+
+        Args:
+            video_id: ID видео YouTube
+
+        Returns:
+            str: Путь к обложке или None
+        """
+        path = self._files.get(video_id)
+        if path is None:
+            return None
+        if not os.path.exists(path):
+            self._files.pop(video_id, None)
+            return None
+        self._files.move_to_end(video_id)
+        return path
+
+    def acquire(self, video_id: str) -> Optional[str]:
+        """
+        Возвращает путь к готовой обложке из кэша без загрузки и захватывает ссылку на нее
+
+        Args:
+            video_id: ID видео YouTube
+
+        Returns:
+            str: Путь к обложке (освобождается через release) или None
+        """
+        path = self.cached_path(video_id)
+        if path:
+            self.retain(path)
+        return path
+
+    def retain(self, path: str, refs: int = 1) -> None:
+        """
+        Захватывает дополнительные ссылки на обложку (например, для запросов, ожидающих общую загрузку)
+
+        Args:
+            path: Путь к обложке из кэша
+            refs: Количество ссылок
+        """
+        self._refs[path] = self._refs.get(path, 0) + refs
+
+    def release(self, path: str) -> None:
+        """
+        Освобождает ссылку на обложку после отправки. Вытесненная обложка удаляется
+        вместе с последней ссылкой.
+
+        Args:
+            path: Путь к обложке из кэша
+        """
+        refs = self._refs.get(path, 0) - 1
+        if refs > 0:
+            self._refs[path] = refs
+            return
+        self._refs.pop(path, None)
+        if path in self._evicted:
+            self._evicted.discard(path)
+            self._remove(path)
+
+    async def get(self, video_id: str, thumbnail_url: Optional[str] = None) -> Optional[str]:
+        """
+        Возвращает путь к обложке трека, при необходимости загружая и уменьшая ее.
+        Запрос получает ссылку на обложку, которую нужно освободить через release.
+
+        Args:
+            video_id: ID видео YouTube
+            thumbnail_url: Известная ссылка на миниатюру (если нет - используется стандартная обложка YouTube)
+
+        Returns:
+            str: Путь к JPEG-обложке или None, если получить обложку не удалось
+        """
+        path = self.acquire(video_id)
+        record_cache_lookup('thumbnail', bool(path))
+        if path:
+            return path
+
+        task = self._inflight.get(video_id)
+        if task is None:
+            task = asyncio.create_task(self._fetch(video_id, thumbnail_url))
+            self._inflight[video_id] = task
+            task.add_done_callback(lambda _task: self._inflight.pop(video_id, None))
+        # shield: отмена одного запроса не прерывает общую загрузку обложки
+        path = await asyncio.shield(task)
+        if path:
+            self.retain(path)
+        return path
+
+    @timed_stage('thumbnail')
+    async def _fetch(self, video_id: str, thumbnail_url: Optional[str]) -> Optional[str]:
+        """Загружает исходное изображение, уменьшает его и помещает в кэш"""
+        urls: List[str] = [url for url in (thumbnail_url, FALLBACK_THUMBNAIL_URL.format(video_id=video_id)) if url]
+        for url in urls:
+            try:
+                source = await self._download(url)
+                if not source:
+                    continue
+                image = await self._resize(source)
+                if image:
+                    path = await asyncio.to_thread(self._store, video_id, image)
+                    self._remember(video_id, path)
+                    logger.info(f"Обложка для видео {video_id} подготовлена ({len(image) / 1024:.0f} КБ)")
+                    return path
+            except Exception as e:
+                logger.warning(f"Не удалось подготовить обложку {url} для видео {video_id}: {e}")
+        return None
+
+    async def _download(self, url: str) -> Optional[bytes]:
+        """Загружает исходное изображение"""
+        async with self._get_session().get(url) as response:
+            if response.status != 200:
+                logger.warning(f"Миниатюра {url} недоступна (HTTP {response.status})")
+                return None
+            data = bytearray()
+            async for chunk in response.content.iter_chunked(64 * 1024):
+                data.extend(chunk)
+                if len(data) > SOURCE_MAX_BYTES:
+                    logger.warning(f"Миниатюра {url} слишком большая")
+                    return None
+            return bytes(data)
+
+    async def _resize(self, source: bytes) -> Optional[bytes]:
+        """Уменьшает изображение до требований Telegram и перекодирует в JPEG"""
+        for quality in THUMBNAIL_QUALITY_STEPS:
+            try:
+                image = await transcoder.run([
+                    "-i", "pipe:0",
+                    "-vf", f"scale={THUMBNAIL_MAX_SIDE}:{THUMBNAIL_MAX_SIDE}:force_original_aspect_ratio=decrease",
+                    "-frames:v", "1", "-q:v", str(quality), "-f", "image2", "-c:v", "mjpeg", "pipe:1",
+                ], input=source)
+            except TranscodeError as e:
+                logger.warning(f"ffmpeg не смог обработать миниатюру: {e}")
+                return None
+            if not image:
+                logger.warning("ffmpeg не вернул миниатюру")
+                return None
+            if len(image) <= THUMBNAIL_MAX_BYTES:
+                return image
+        return None
+
+    def _store(self, video_id: str, image: bytes) -> str:
+        """Атомарно записывает обложку в кэш (выполняется в потоке)"""
+        path = os.path.join(self._cache_dir, f"{video_id}.jpg")
+        tmp_path = os.path.join(self._cache_dir, f".{video_id}.{uuid.uuid4().hex[:8]}.tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(image)
+        os.replace(tmp_path, path)
+        return path
+
+    def _remember(self, video_id: str, path: str) -> None:
+        """Добавляет обложку в индекс кэша и удаляет давно не использованные"""
+        self._files[video_id] = path
+        self._files.move_to_end(video_id)
+        # Обложка могла быть вытеснена раньше и загружена заново
+        self._evicted.discard(path)
+        while len(self._files) > self._max_files:
+            _, old_path = self._files.popitem(last=False)
+            if self._refs.get(old_path):
+                # Обложка еще отправляется - удалится при освобождении последней ссылки
+                self._evicted.add(old_path)
+            else:
+                self._remove(old_path)
+
+    @staticmethod
+    def _remove(path: str) -> None:
+        """Удаляет файл обложки"""
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+# Создаем глобальный экземпляр сервиса обложек
+thumbnail_service = ThumbnailService(THUMBNAIL_CACHE_DIR, THUMBNAIL_CACHE_MAX_FILES)
@@ -0,0 +1,224 @@
+import asyncio
+import logging
+import os
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Optional, Set
+
+import imageio_ffmpeg
+
+from config import TRANSCODE_CONCURRENCY, TRANSCODE_THREADS
+from services.metrics import TRANSCODE_QUEUED, observe_stage
+
+logger = logging.getLogger(__name__)
+
+# Сколько последних байт stderr ffmpeg сохраняется для сообщения об ошибке
+FFMPEG_STDERR_TAIL = 2048
+
+# Файлы cgroup с ограничением CPU: v2 (квота и период в одной строке) и v1 (отдельные файлы)
+CGROUP_ROOT = "/sys/fs/cgroup"
+
+class TranscodeError(Exception):
+    """ffmpeg завершился с ошибкой"""
+
+def _read_file(path: str) -> Optional[str]:
+    try:
+        with open(path, encoding="ascii") as f:
+            return f.read().strip()
+    except (OSError, ValueError):
+        return None
+
+def _cgroup_cpu_quota() -> Optional[float]:
+    """
+    Возвращает квоту CPU контейнера в ядрах (cgroup v2 cpu.max или v1 cpu.cfs_quota_us)
+    или None, если квота не задана
+    """
+    # cgroup v2: путь группы процесса из /proc/self/cgroup ("0::/path")
+    paths = []
+    for line in (_read_file("/proc/self/cgroup") or "").splitlines():
+        if line.startswith("0::"):
+            paths.append(os.path.join(CGROUP_ROOT, line[3:].lstrip("/"), "cpu.max"))
+    paths.append(os.path.join(CGROUP_ROOT, "cpu.max"))
+    for path in paths:
+        value = _read_file(path)
+        if value:
+            quota, _, period = value.partition(" ")
+            if quota == "max":
+                return None
+            if quota.isdigit() and period.isdigit() and int(period) > 0:
+                return int(quota) / int(period)
+
+    # cgroup v1
+    quota = _read_file(os.path.join(CGROUP_ROOT, "cpu", "cpu.cfs_quota_us"))
+    period = _read_file(os.path.join(CGROUP_ROOT, "cpu", "cpu.cfs_period_us"))
+    if quota and period and quota.lstrip("-").isdigit() and period.isdigit():
+        if int(quota) > 0 and int(period) > 0:
+            return int(quota) / int(period)
+    return None
+
+def available_cpus() -> int:
+    """
+    Количество ядер, доступных процессу: привязка к ядрам (affinity) с учетом квоты CPU контейнера.
+    Дробная квота округляется вниз - остаток остается боту и yt-dlp.
+    """
+    if hasattr(os, "sched_getaffinity"):
+        cpus = len(os.sched_getaffinity(0))
+    else:
+        cpus = os.cpu_count() or 1
+    quota = _cgroup_cpu_quota()
+    if quota:
+        cpus = min(cpus, int(quota))
+    return max(1, cpus)
+
+class TranscodeManager:
+    """
+    Все запуски ffmpeg бота.
+
+    Перекодирование ограничено числом доступных ядер: одновременно выполняется не больше
+    задач, чем ядер (libmp3lame кодирует в один поток), остальные ждут в очереди.
+    При перегрузке пропускная способность остается постоянной, а не падает из-за десятков
+    конкурирующих за ядра процессов ffmpeg. Задачи отменяемы: при отмене процесс ffmpeg
+    завершается, а недописанный файл удаляется.
+    """
+
+    def __init__(self, concurrency: int = 0, threads: int = 0):
+        """
+        Args:
+            concurrency: Одновременных задач перекодирования (0 - по числу доступных ядер)
+            threads: Потоков ffmpeg на задачу (0 - доступные ядра, поделенные между задачами)
+        """
+        cpus = available_cpus()
+        self._concurrency = concurrency if concurrency > 0 else cpus
+        self._threads = threads if threads > 0 else max(1, cpus // self._concurrency)
+        self._slots = asyncio.Semaphore(self._concurrency)
+        self._queued = 0
+        self._processes: Set[asyncio.subprocess.Process] = set()
+        logger.info(
+            f"Перекодирование: {self._concurrency} одновременных задач, "
+            f"{self._threads} потоков ffmpeg на задачу (доступно ядер: {cpus})"
+        )
+
+    @property
+    def concurrency(self) -> int:
+        """Количество одновременных задач перекодирования"""
+        return self._concurrency
+
+    @property
+    def threads(self) -> int:
+        """Количество потоков ffmpeg на задачу"""
+        return self._threads
+
+    @property
+    def queued(self) -> int:
+        """Количество задач, ожидающих свободного ядра"""
+        return self._queued
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        """Занимает место для задачи, нагружающей CPU (ожидает в очереди, если мест нет)"""
+        self._queued += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self._queued -= 1
+        try:
+            yield
+        finally:
+            self._slots.release()
+
+    async def spawn(self, args: List[str], **kwargs) -> asyncio.subprocess.Process:
+        """
+        Запускает ffmpeg с заданными аргументами (после общих флагов и числа потоков).
+        Процесс учитывается менеджером и завершается при остановке бота.
+
+        Args:
+            args: Аргументы ffmpeg (входы, параметры кодирования, выход)
+            **kwargs: Параметры asyncio.create_subprocess_exec (stdin, stdout, stderr, limit)
+        """
+        process = await asyncio.create_subprocess_exec(
+            imageio_ffmpeg.get_ffmpeg_exe(), "-hide_banner", "-loglevel", "error", "-nostdin",
+            "-threads", str(self._threads), *args,
+            **kwargs,
+        )
+        # Завершившиеся процессы больше не отслеживаются
+        self._processes = {running for running in self._processes if running.returncode is None}
+        self._processes.add(process)
+        return process
+
+    async def run(self, args: List[str], input: Optional[bytes] = None) -> bytes:
+        """
+        Выполняет ffmpeg в очереди задач и возвращает его stdout
+
+        Args:
+            args: Аргументы ffmpeg
+            input: Данные для stdin (None - stdin не используется)
+
+        Raises:
+            TranscodeError: Если ffmpeg завершился с ошибкой
+        """
+        async with self.slot():
+            process = await self.spawn(
+                args,
+                stdin=asyncio.subprocess.PIPE if input is not None else asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+            )
+            try:
+                stdout, stderr = await process.communicate(input)
+            finally:
+                # Отмена задачи завершает ffmpeg
+                if process.returncode is None:
+                    process.kill()
+                    await process.wait()
+            if process.returncode != 0:
+                stderr = stderr[-FFMPEG_STDERR_TAIL:].decode(errors="replace").strip()
+                raise TranscodeError(f"ffmpeg завершился с кодом {process.returncode}: {stderr}")
+            return stdout
+
+    async def transcode(self, source_path: str, target_path: str, codec_args: List[str],
+                        metadata: Optional[Dict[str, str]] = None,
+                        input_args: Optional[List[str]] = None) -> str:
+        """
+        Перекодирует аудиофайл за один проход (вместе с записью тегов)
+
+        Args:
+            source_path: Исходный файл или URL потока
+            target_path: Итоговый файл (формат определяется расширением)
+            codec_args: Параметры кодирования (например, ['-c:a', 'libmp3lame', '-b:a', '128k'])
+            metadata: Теги итогового файла (title, artist, album)
+            input_args: Параметры чтения источника, указываются перед -i
+                (например, ['-ss', '3730', '-t', '40'] - только фрагмент источника)
+
+        Returns:
+            str: Путь к итоговому файлу
+
+        Raises:
+            TranscodeError: Если ffmpeg завершился с ошибкой
+        """
+        metadata_args = []
+        for key, value in (metadata or {}).items():
+            if value:
+                metadata_args += ["-metadata", f"{key}={value}"]
+        try:
+            with observe_stage("transcode"):
+                await self.run([
+                    "-y", *(input_args or []), "-i", source_path, "-vn", "-map_metadata", "-1",
+                    *codec_args, *metadata_args, target_path,
+                ])
+        except BaseException:
+            # Недописанный файл не должен попасть в кэш
+            if os.path.exists(target_path):
+                os.remove(target_path)
+            raise
+        return target_path
+
+    async def shutdown(self) -> None:
+        """Завершает работающие процессы ffmpeg (при остановке бота)"""
+        for process in list(self._processes):
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+
+# Создаем глобальный экземпляр менеджера перекодирования
+transcoder = TranscodeManager(TRANSCODE_CONCURRENCY, TRANSCODE_THREADS)
+
+TRANSCODE_QUEUED.set_function(lambda: transcoder.queued)
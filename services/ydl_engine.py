@@ -0,0 +1,303 @@
+import asyncio
+import copy
+import logging
+import multiprocessing
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Dict, Optional
+
+import yt_dlp
+
+from config import YDL_EXECUTOR, YDL_PROCESS_WORKERS, MAX_CONCURRENT_DOWNLOADS
+
+logger = logging.getLogger(__name__)
+
+# Поля info dict, которые возвращаются в процесс бота (остальное остается в исполнителе)
+RESULT_FIELDS = (
+    'id', 'title', 'artist', 'album', 'track', 'thumbnail', 'channel', 'uploader',
+    'duration', 'ext', 'webpage_url',
+    # Выбранный формат (нужен для потоковой передачи без скачивания)
+    'url', 'http_headers', 'protocol', 'format_id', 'acodec', 'abr', 'filesize', 'filesize_approx',
+)
+
+# Поля записей плейлиста при плоском извлечении (extract_flat)
+ENTRY_FIELDS = ('id', 'title', 'duration', 'channel', 'uploader')
+
+# Тяжелые поля info dict, которые не нужны для повторной обработки без извлечения
+REUSABLE_INFO_EXCLUDED_FIELDS = (
+    'subtitles', 'automatic_captions', 'heatmap', 'thumbnails', 'description', 'chapters', 'tags', 'categories',
+)
+
+# Сколько экземпляров YoutubeDL с разными настройками держит один рабочий процесс
+MAX_WORKER_YDL_INSTANCES = 4
+
+class YdlJobError(Exception):
+    """Ошибка yt-dlp, переданная из исполнителя (сериализуется между процессами)"""
+
+class _OutputTracker:
+    """
+    Собирает пути файлов задачи из хуков yt-dlp: скачанные файлы (хук загрузки)
+    и итоговые файлы после постобработки (хук постпроцессоров), а также
+    длительность загрузки и постобработки для метрик.
+    """
+
+    def __init__(self):
+        self.downloaded = []
+        self.audio_path: Optional[str] = None
+        self.thumbnail_paths = []
+        # Время начала текущей загрузки и постпроцессора (time.monotonic)
+        self._download_started: Optional[float] = None
+        self._postprocessor_started: Optional[float] = None
+        self.download_seconds = 0.0
+        self.download_bytes = 0
+        self.postprocess_seconds = 0.0
+
+    def on_progress(self, status: Dict[str, Any]) -> None:
+        """Обрабатывает событие хука загрузки"""
+        if self._download_started is None:
+            self._download_started = time.monotonic()
+        if status.get('status') == 'finished':
+            # Загрузчик сообщает время загрузки сам, иначе считаем от первого события
+            self.download_seconds += status.get('elapsed') or time.monotonic() - self._download_started
+            self.download_bytes += status.get('total_bytes') or status.get('downloaded_bytes') or 0
+            self._download_started = None
+            if status.get('filename'):
+                self.downloaded.append(status['filename'])
+
+    def on_postprocessor(self, status: Dict[str, Any]) -> None:
+        """Обрабатывает событие хука постпроцессоров"""
+        if status.get('status') == 'started':
+            self._postprocessor_started = time.monotonic()
+            return
+        if status.get('status') != 'finished':
+            return
+        if self._postprocessor_started is not None:
+            self.postprocess_seconds += time.monotonic() - self._postprocessor_started
+            self._postprocessor_started = None
+        info = status.get('info_dict') or {}
+        # Каждый постпроцессор сообщает путь после своей работы, последний (перенос файлов) - итоговый
+        if info.get('filepath'):
+            self.audio_path = info['filepath']
+        self.thumbnail_paths = [
+            thumbnail['filepath'] for thumbnail in info.get('thumbnails') or [] if thumbnail.get('filepath')
+        ]
+
+    def as_dict(self) -> Dict[str, Any]:
+        """Возвращает собранные пути (сериализуется между процессами)"""
+        # Без постобработки итоговым файлом остается скачанный
+        audio_path = self.audio_path or (self.downloaded[-1] if self.downloaded else None)
+        return {
+            'audio_path': audio_path,
+            'thumbnail_paths': list(self.thumbnail_paths),
+            'downloaded': list(self.downloaded),
+            'timings': {
+                'download_seconds': self.download_seconds,
+                'download_bytes': self.download_bytes,
+                'postprocess_seconds': self.postprocess_seconds,
+            },
+        }
+
+# Трекер выходных файлов текущей задачи (в каждом потоке исполнителя выполняется одна задача)
+_job_state = threading.local()
+
+def _progress_hook(status: Dict[str, Any]) -> None:
+    """Хук загрузки yt-dlp: передает событие трекеру текущей задачи"""
+    tracker = getattr(_job_state, 'tracker', None)
+    if tracker is not None:
+        tracker.on_progress(status)
+
+def _postprocessor_hook(status: Dict[str, Any]) -> None:
+    """Хук постпроцессоров yt-dlp: передает событие трекеру текущей задачи"""
+    tracker = getattr(_job_state, 'tracker', None)
+    if tracker is not None:
+        tracker.on_postprocessor(status)
+
+def _with_hooks(opts: Dict[str, Any]) -> Dict[str, Any]:
+    """Добавляет к настройкам YoutubeDL хуки отслеживания выходных файлов"""
+    return {**opts, 'progress_hooks': [_progress_hook], 'postprocessor_hooks': [_postprocessor_hook]}
+
+def reusable_info(info: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Сокращает info dict до вида, пригодного для повторной обработки (process_ie_result)
+    без извлечения: остаются только аудиоформаты и поля, нужные для выбора формата и загрузки.
+
+    Args:
+        info: Полный info dict yt-dlp
+
+    Returns:
+        dict: Сокращенный info dict или None, если в нем нет списка форматов
+    """
+    if not info.get('formats'):
+        return None
+    # Тот же вид, что yt-dlp сохраняет в .info.json для --load-info-json
+    result = yt_dlp.YoutubeDL.sanitize_info(info, remove_private_keys=True)
+    for field in REUSABLE_INFO_EXCLUDED_FIELDS:
+        result.pop(field, None)
+    audio_formats = [f for f in result['formats'] if f.get('vcodec') == 'none' and f.get('url')]
+    if audio_formats:
+        result['formats'] = audio_formats
+    return result
+
+def compact_info(info: Optional[Dict[str, Any]],
+                 outputs: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+    """
+    Оставляет в info dict только поля, нужные боту.
+
+    Args:
+        info: Полный info dict yt-dlp
+        outputs: Пути выходных файлов задачи, собранные хуками yt-dlp
+
+    Returns:
+        dict: Компактный словарь с метаданными, путями выходных файлов
+        и сокращенным info dict для кэша метаданных
+    """
+    if not info:
+        return None
+    result = {field: info.get(field) for field in RESULT_FIELDS}
+    result['outputs'] = outputs or {'audio_path': None, 'thumbnail_paths': [], 'downloaded': []}
+    result['info_dict'] = reusable_info(info)
+    if info.get('entries') is not None:
+        # Плейлист: только записи без форматов (плоское извлечение)
+        result['entries'] = [
+            {field: entry.get(field) for field in ENTRY_FIELDS} for entry in info['entries'] if entry
+        ]
+    return result
+
+# Экземпляры YoutubeDL рабочего процесса: ключ настроек -> экземпляр
+_worker_instances: "OrderedDict[str, yt_dlp.YoutubeDL]" = OrderedDict()
+
+def _options_key(opts: Dict[str, Any]) -> str:
+    """Ключ настроек YoutubeDL без параметров, которые меняются от задачи к задаче"""
+    return repr(sorted((key, repr(value)) for key, value in opts.items() if key != 'outtmpl'))
+
+def _get_worker_ydl(opts: Dict[str, Any]) -> yt_dlp.YoutubeDL:
+    """Возвращает прогретый экземпляр YoutubeDL рабочего процесса для данных настроек"""
+    key = _options_key(opts)
+    # YoutubeDL нормализует переданные настройки на месте, поэтому шаблон берем до создания экземпляра
+    outtmpl = opts.get('outtmpl')
+    ydl = _worker_instances.get(key)
+    if ydl is None:
+        ydl = yt_dlp.YoutubeDL(_with_hooks(opts))
+        _worker_instances[key] = ydl
+        if len(_worker_instances) > MAX_WORKER_YDL_INSTANCES:
+            _, old_ydl = _worker_instances.popitem(last=False)
+            old_ydl.close()
+    else:
+        _worker_instances.move_to_end(key)
+    # Шаблон имени выходного файла свой у каждой задачи
+    if isinstance(outtmpl, str):
+        ydl.params['outtmpl']['default'] = outtmpl
+    return ydl
+
+def _init_worker() -> None:
+    """Инициализация рабочего процесса: заранее загружаем экстракторы yt-dlp"""
+    from yt_dlp.extractor import gen_extractor_classes
+    list(gen_extractor_classes())
+
+def _run_ydl(ydl: yt_dlp.YoutubeDL, url: str, download: bool,
+             info: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """
+    Извлекает информацию по ссылке или повторно обрабатывает уже извлеченный info dict.
+    Пути выходных файлов задачи собираются хуками yt-dlp.
+    """
+    tracker = _OutputTracker()
+    _job_state.tracker = tracker
+    try:
+        if info is not None:
+            result = ydl.process_ie_result(info, download=download)
+        else:
+            result = ydl.extract_info(url, download=download)
+    finally:
+        _job_state.tracker = None
+    return compact_info(result, tracker.as_dict())
+
+def _run_job_in_process(opts: Dict[str, Any], url: str, download: bool,
+                        info: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+    """Выполняет задачу yt-dlp в рабочем процессе с повторно используемым YoutubeDL"""
+    try:
+        ydl = _get_worker_ydl(opts)
+        return _run_ydl(ydl, url, download, info)
+    except Exception as e:
+        raise YdlJobError(str(e)) from None
+
+def _run_job_in_thread(opts: Dict[str, Any], url: str, download: bool,
+                       info: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+    """Выполняет задачу yt-dlp в потоке с отдельным экземпляром YoutubeDL"""
+    with yt_dlp.YoutubeDL(_with_hooks(opts)) as ydl:
+        # yt-dlp дополняет info dict при обработке - работаем с копией из кэша
+        return _run_ydl(ydl, url, download, copy.deepcopy(info))
+
+class YdlEngine:
+    """
+    Исполнитель задач yt-dlp.
+
+    В режиме "thread" задачи выполняются в отдельном пуле потоков.
+    В режиме "process" - в пуле долгоживущих рабочих процессов, каждый из которых
+    хранит прогретые экземпляры YoutubeDL. Извлечение информации (расшифровка подписей,
+    разбор JSON, регулярные выражения) тогда не конкурирует за GIL с циклом событий бота,
+    а пропускная способность растет с количеством ядер.
+    """
+
+    def __init__(self, mode: str, process_workers: int, thread_workers: int):
+        self._mode = mode
+        self._process_workers = process_workers
+        self._thread_workers = thread_workers
+        self._executor: Optional[Executor] = None
+
+    @property
+    def mode(self) -> str:
+        """Режим исполнителя: thread или process"""
+        return self._mode
+
+    def start(self) -> None:
+        """Создает пул исполнителей (вызывается при запуске бота или при первой задаче)"""
+        if self._executor is not None:
+            return
+        if self._mode == "process":
+            self._executor = ProcessPoolExecutor(
+                max_workers=self._process_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+            )
+            # Запускаем рабочие процессы заранее, чтобы первая загрузка не ждала их старта
+            for _ in range(self._process_workers):
+                self._executor.submit(_init_worker)
+            logger.info(f"Запущен пул процессов yt-dlp ({self._process_workers} процессов)")
+        else:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self._thread_workers, thread_name_prefix="ydl"
+            )
+            logger.info(f"Запущен пул потоков yt-dlp ({self._thread_workers} потоков)")
+
+    def shutdown(self) -> None:
+        """Останавливает пул исполнителей"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+            logger.info("Пул исполнителей yt-dlp остановлен")
+
+    async def extract_info(self, opts: Dict[str, Any], url: str, download: bool = True,
+                           info: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+        """
+        Выполняет extract_info в исполнителе
+
+        Args:
+            opts: Настройки YoutubeDL (должны сериализоваться для режима process)
+            url: Ссылка на видео
+            download: Скачивать ли файл
+            info: Ранее извлеченный info dict (см. reusable_info) - если передан,
+                  извлечение пропускается и выполняются только выбор формата и загрузка
+
+        Returns:
+            dict: Компактный info dict (см. compact_info)
+        """
+        self.start()
+        loop = asyncio.get_running_loop()
+        if self._mode == "process":
+            return await loop.run_in_executor(self._executor, _run_job_in_process, opts, url, download, info)
+        return await loop.run_in_executor(self._executor, _run_job_in_thread, opts, url, download, info)
+
+# Создаем глобальный экземпляр исполнителя
+ydl_engine = YdlEngine(YDL_EXECUTOR, YDL_PROCESS_WORKERS, MAX_CONCURRENT_DOWNLOADS)
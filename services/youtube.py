@@ -1,78 +1,243 @@
 import os
+import re
 import logging
 import yt_dlp
 import imageio_ffmpeg
-import glob
-import subprocess
-from config import DOWNLOADS_DIR
+from config import DOWNLOADS_DIR, AUDIO_DELIVERY_MODE, MAX_TRACK_DURATION, MAX_TELEGRAM_FILE_SIZE, RANGED_DOWNLOAD_ENABLED, PLAYLIST_MAX_TRACKS, CLIP_DEFAULT_LENGTH
+from services.audio_cache import audio_cache
+from services.ydl_engine import ydl_engine
+from services.metadata_cache import metadata_cache
+from services.janitor import downloads_janitor
+from services.thumbnails import thumbnail_service
+from services.streaming import StreamingAudioFile
+from services.ranged_download import ranged_downloader
+from services.transcoder import transcoder
+from services.ytmusic_pool import ytmusic_pool
+from services.search_executor import search_executor
+from services.search_cache import search_cache
+from services.metrics import observe_stage, timed_stage, record_cache_lookup, record_ydl_timings
 import uuid
 import time
-import datetime
-import requests
 import asyncio
+from typing import Dict, Iterable, NamedTuple, Optional, Tuple
+from urllib.parse import urlparse, parse_qs
 
 logger = logging.getLogger(__name__)
 
-# Максимальный размер файла для отправки в Telegram (в байтах)
-MAX_TELEGRAM_FILE_SIZE = 50 * 1024 * 1024  # 50 МБ
+# Запас до лимита размера файла (контейнер, теги и погрешность оценки)
+FILE_SIZE_MARGIN = 2 * 1024 * 1024
 
-# Максимальный возраст файлов в папке загрузок (в часах)
-MAX_FILE_AGE_HOURS = 1
+# Битрейты MP3 (кбит/с), из которых выбирается наибольший, при котором трек укладывается в лимит
+MP3_BITRATES = (128, 96, 64, 48, 32)
 
-def cleanup_downloads_folder(max_age_hours=MAX_FILE_AGE_HOURS):
+# Режимы выдачи аудио: профиль кодирования (часть ключа кэша и реестра file_id) и расширение файла
+AUDIO_DELIVERY_PROFILES = {
+    # Перекодирование в MP3 128 кбит/с
+    "mp3": {"profile": "mp3_128", "ext": "mp3"},
+    # Исходный AAC-поток без перекодирования, перепакованный в m4a
+    "passthrough": {"profile": "m4a_passthrough", "ext": "m4a"},
+}
+
+if AUDIO_DELIVERY_MODE not in AUDIO_DELIVERY_PROFILES:
+    logger.warning(f"Неизвестный режим выдачи аудио {AUDIO_DELIVERY_MODE}, используется mp3")
+
+# Профиль кодирования аудио (используется как часть ключа в кэше и реестре file_id)
+DEFAULT_AUDIO_PROFILE = AUDIO_DELIVERY_PROFILES.get(AUDIO_DELIVERY_MODE, AUDIO_DELIVERY_PROFILES["mp3"])["profile"]
+# Расширение итогового аудиофайла
+AUDIO_FILE_EXT = AUDIO_DELIVERY_PROFILES.get(AUDIO_DELIVERY_MODE, AUDIO_DELIVERY_PROFILES["mp3"])["ext"]
+
+# Выбор аудиоформата для загрузки: предпочитаем m4a как более эффективный формат
+# (в режиме без перекодирования - любой AAC)
+AUDIO_FORMAT_SELECTOR = (
+    'bestaudio[ext=m4a]/bestaudio[acodec^=mp4a]/bestaudio/best'
+    if AUDIO_FILE_EXT == 'm4a' else 'bestaudio[ext=m4a]/bestaudio/best'
+)
+
+# Настройки YoutubeDL для предварительной проверки (извлечение информации без скачивания)
+PREFLIGHT_YDL_OPTS = {
+    'format': AUDIO_FORMAT_SELECTOR,
+    'quiet': True,
+    'no_warnings': True,
+    'noplaylist': True,
+    'check_formats': False,
+    'socket_timeout': 10,
+}
+
+# Регулярное выражение для проверки ID видео YouTube
+VIDEO_ID_REGEX = re.compile(r"^[A-Za-z0-9_-]{11}$")
+
+def extract_video_id(url: str) -> Optional[str]:
     """
-    Очищает папку загрузок от старых файлов.
-    
+    Извлекает ID видео из ссылки YouTube.
+
     Args:
-        max_age_hours: Максимальный возраст файлов в часах
+        url: Ссылка на видео (youtube.com/watch, youtu.be, shorts, embed, music.youtube.com)
+
+    Returns:
+        str: ID видео или None, если его не удалось определить
     """
     try:
-        now = time.time()
-        max_age_seconds = max_age_hours * 3600
-        
-        # Проверяем наличие директории
-        if not os.path.exists(DOWNLOADS_DIR):
-            os.makedirs(DOWNLOADS_DIR)
-            logger.info(f"Создана директория для загрузок: {DOWNLOADS_DIR}")
-            return
-        
-        # Удаляем все файлы из директории, которые старше заданного возраста
-        count = 0
-        for filename in os.listdir(DOWNLOADS_DIR):
-            file_path = os.path.join(DOWNLOADS_DIR, filename)
-            if os.path.isfile(file_path):
-                try:
-                    file_age = now - os.path.getmtime(file_path)
-                    if file_age > max_age_seconds:
-                        # Попытка форсированного удаления с повторными попытками
-                        for attempt in range(3):
-                            try:
-                                os.remove(file_path)
-                                count += 1
-                                logger.info(f"Удален старый файл: {filename} (возраст: {file_age/3600:.1f} ч.)")
-                                break
-                            except PermissionError:
-                                # Если файл заблокирован, даем системе немного времени
-                                logger.warning(f"Файл {filename} заблокирован, попытка {attempt+1}/3")
-                                time.sleep(0.5)
-                            except Exception as e:
-                                logger.warning(f"Не удалось удалить файл {filename}: {e}")
-                                break
-                except Exception as e:
-                    logger.warning(f"Ошибка при проверке файла {filename}: {e}")
-        
-        if count > 0:
-            logger.info(f"Очищено {count} старых файлов из директории загрузок")
-        else:
-            logger.info("Старых файлов для очистки не найдено")
-            
+        if "://" not in url:
+            url = "https://" + url
+        parsed = urlparse(url.strip())
+        host = (parsed.hostname or "").lower()
+        path_parts = [part for part in parsed.path.split("/") if part]
+
+        candidate = None
+        if host.endswith("youtu.be"):
+            candidate = path_parts[0] if path_parts else None
+        elif host.endswith("youtube.com"):
+            query_video_id = parse_qs(parsed.query).get("v")
+            if query_video_id:
+                candidate = query_video_id[0]
+            elif len(path_parts) >= 2 and path_parts[0] in ("shorts", "embed", "live", "v"):
+                candidate = path_parts[1]
+
+        if candidate and VIDEO_ID_REGEX.match(candidate):
+            return candidate
+    except Exception as e:
+        logger.warning(f"Не удалось извлечь ID видео из ссылки {url}: {e}")
+    return None
+
+# Регулярное выражение для проверки ID плейлиста YouTube (PL..., OLAK5uy_... для альбомов YouTube Music и т.п.)
+PLAYLIST_ID_REGEX = re.compile(r"^[A-Za-z0-9_-]{10,}$")
+
+def extract_playlist_id(url: str) -> Optional[str]:
+    """
+    Извлекает ID плейлиста из ссылки на страницу плейлиста или альбома.
+    Ссылка на видео внутри плейлиста (watch?v=...&list=...) считается ссылкой на одно видео.
+
+    Args:
+        url: Ссылка (youtube.com/playlist?list=..., music.youtube.com/playlist?list=...)
+
+    Returns:
+        str: ID плейлиста или None, если ссылка не ведет на плейлист
+    """
+    try:
+        if "://" not in url:
+            url = "https://" + url
+        parsed = urlparse(url.strip())
+        host = (parsed.hostname or "").lower()
+        if not host.endswith("youtube.com") or parsed.path.rstrip("/") != "/playlist":
+            return None
+        candidate = (parse_qs(parsed.query).get("list") or [None])[0]
+        if candidate and PLAYLIST_ID_REGEX.match(candidate):
+            return candidate
+    except Exception as e:
+        logger.warning(f"Не удалось извлечь ID плейлиста из ссылки {url}: {e}")
+    return None
+
+# Отметка времени в формате YouTube: 90, 90s, 1h2m10s
+TIMESTAMP_REGEX = re.compile(r"^(?:(\d+)h)?(?:(\d+)m)?(?:(\d+)s?)?$")
+
+def parse_timestamp(value: str) -> Optional[int]:
+    """
+    Преобразует отметку времени в секунды.
+
+    Args:
+        value: Отметка времени (1:02:10, 62:10, 3730, 3730s, 1h2m10s)
+
+    Returns:
+        int: Секунды от начала трека или None, если отметку не удалось разобрать
+    """
+    value = (value or "").strip().lower()
+    if not value:
+        return None
+    if ':' in value:
+        parts = value.split(':')
+        if len(parts) > 3 or not all(part.isdigit() for part in parts):
+            return None
+        return _parse_duration(value)
+    match = TIMESTAMP_REGEX.match(value)
+    if not match or not any(match.groups()):
+        return None
+    hours, minutes, seconds = (int(group or 0) for group in match.groups())
+    return hours * 3600 + minutes * 60 + seconds
+
+def format_timestamp(seconds: int) -> str:
+    """Форматирует секунды как отметку времени (2:10 или 1:02:10)"""
+    hours, rest = divmod(int(seconds), 3600)
+    minutes, seconds = divmod(rest, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
+
+def extract_timestamp(url: str) -> Optional[int]:
+    """
+    Извлекает отметку времени из ссылки YouTube (параметры t= и start=)
+
+    Args:
+        url: Ссылка на видео
+
+    Returns:
+        int: Секунды от начала трека или None, если отметки в ссылке нет
+    """
+    try:
+        if "://" not in url:
+            url = "https://" + url
+        parsed = urlparse(url.strip())
+        # Отметка может быть и в якоре ссылки (#t=90)
+        params = {**parse_qs(parsed.fragment), **parse_qs(parsed.query)}
+        value = (params.get("t") or params.get("start") or [None])[0]
+        return parse_timestamp(value) if value else None
     except Exception as e:
-        logger.error(f"Ошибка при очистке директории загрузок: {e}")
+        logger.warning(f"Не удалось извлечь отметку времени из ссылки {url}: {e}")
+    return None
 
-def force_cleanup_downloads_folder():
+def parse_clip_request(text: str) -> Optional[Tuple[str, int, int]]:
+    """
+    Разбирает аргументы команды /clip: ссылку и интервал фрагмента.
+    Если конец интервала не указан, фрагмент длится CLIP_DEFAULT_LENGTH секунд;
+    если не указан весь интервал, начало берется из отметки времени в ссылке (&t=).
+
+    Args:
+        text: Аргументы команды ("ссылка 1:02:10-1:02:50", "ссылка 1:02:10" или "ссылка&t=3730")
+
+    Returns:
+        tuple: (ссылка, начало, конец) в секундах или None, если аргументы не удалось разобрать
+    """
+    parts = (text or "").split(maxsplit=1)
+    if not parts or not extract_video_id(parts[0]):
+        return None
+    url = parts[0]
+    spec = parts[1].replace(" ", "").replace("–", "-").replace("—", "-") if len(parts) > 1 else ""
+
+    if spec:
+        start_text, separator, end_text = spec.partition("-")
+        start = parse_timestamp(start_text)
+        end = parse_timestamp(end_text) if separator else None
+        if start is None or (separator and end is None):
+            return None
+    else:
+        start, end = extract_timestamp(url), None
+        if start is None:
+            return None
+
+    if end is None:
+        end = start + CLIP_DEFAULT_LENGTH
+    if end <= start:
+        return None
+    return url, start, end
+
+def clip_profile(start: int, end: int) -> str:
+    """Профиль фрагмента трека (часть ключа кэша и реестра file_id)"""
+    return f"{DEFAULT_AUDIO_PROFILE}_clip{start}-{end}"
+
+def download_basename(video_id: Optional[str]) -> str:
+    """
+    Возвращает имя файлов загрузки без расширения. Для известного videoId имя постоянное,
+    поэтому загрузка, прерванная перезапуском бота, продолжается с уже загруженных частей
+
+    Args:
+        video_id: ID видео YouTube (None - уникальное временное имя)
+    """
+    return f"audio_{video_id}" if video_id else f"audio_{uuid.uuid4().hex[:8]}"
+
+def force_cleanup_downloads_folder(keep_video_ids: Iterable[str] = ()):
     """
     Принудительно очищает все файлы из папки загрузок, независимо от их возраста.
     Полезно для запуска при старте бота или при ручной очистке.
+
+    Args:
+        keep_video_ids: Видео незавершенных задач, частично загруженные файлы которых сохраняются
     """
     try:
         # Проверяем наличие директории
@@ -82,8 +247,12 @@ def force_cleanup_downloads_folder():
             return
         
         count = 0
+        keep_prefixes = tuple(f"{download_basename(video_id)}." for video_id in keep_video_ids)
         for filename in os.listdir(DOWNLOADS_DIR):
             file_path = os.path.join(DOWNLOADS_DIR, filename)
+            if keep_prefixes and filename.startswith(keep_prefixes):
+                logger.info(f"Сохранен файл незавершенной загрузки: {filename}")
+                continue
             if os.path.isfile(file_path):
                 try:
                     # Попытка форсированного удаления с повторными попытками
@@ -111,6 +280,49 @@ def force_cleanup_downloads_folder():
     except Exception as e:
         logger.error(f"Ошибка при принудительной очистке директории загрузок: {e}")
 
+async def release_downloaded_files(file_path: Optional[str], thumb_path: Optional[str] = None) -> None:
+    """
+    Освобождает файлы, полученные из download_audio_from_youtube, после отправки.
+    Файлы из кэша аудио только освобождаются (остаются в кэше), временные файлы удаляются.
+
+    Args:
+        file_path: Путь к аудиофайлу
+        thumb_path: Путь к обложке
+    """
+    if thumb_path and thumbnail_service.owns(thumb_path):
+        # Обложка из кэша обложек только освобождается
+        thumbnail_service.release(thumb_path)
+        thumb_path = None
+
+    if file_path and audio_cache.owns(file_path):
+        audio_cache.release(file_path)
+        return
+
+    if file_path in _shared_temp_files:
+        # Временный файл общей загрузки удаляется после отправки последним ожидавшим запросом
+        _shared_temp_files[file_path] -= 1
+        if _shared_temp_files[file_path] > 0:
+            return
+        del _shared_temp_files[file_path]
+
+    for path in (file_path, thumb_path):
+        if not path or thumbnail_service.owns(path):
+            continue
+        # Попытка удаления файла с повторными попытками
+        for attempt in range(5):
+            try:
+                if os.path.exists(path):
+                    os.remove(path)
+                    logger.info(f"Временный файл {path} удален")
+                break
+            except PermissionError:
+                # Если файл заблокирован, ждем немного и пробуем снова
+                logger.warning(f"Файл {path} заблокирован, попытка {attempt+1}/5")
+                await asyncio.sleep(0.5)
+            except Exception as e:
+                logger.warning(f"Не удалось удалить файл {path}: {e}")
+                break
+
 def enhance_metadata(metadata):
     """
     Улучшает метаданные трека, извлекая информацию из названия, если есть возможность.
@@ -141,20 +353,416 @@ def enhance_metadata(metadata):
         logger.warning(f"Ошибка при улучшении метаданных: {e}")
         return metadata
 
-async def download_audio_from_youtube(url: str) -> tuple:
+def build_track_metadata(info: Dict) -> Dict:
+    """
+    Формирует метаданные трека из info dict yt-dlp.
+
+    Args:
+        info: Info dict (полный или компактный)
+
+    Returns:
+        dict: Метаданные трека
+    """
+    metadata = {
+        'title': info.get('title', 'Unknown Title'),
+        # Не используем название канала в качестве артиста
+        'artist': info.get('artist', '') or '',
+        'album': info.get('album', 'YouTube Audio'),
+        'thumbnail': info.get('thumbnail'),
+        'duration': None,
+        'channel': info.get('channel') or info.get('uploader', ''),
+    }
+
+    # Форматируем длительность
+    duration_sec = info.get('duration')
+    if duration_sec:
+        minutes = int(duration_sec) // 60
+        seconds = int(duration_sec) % 60
+        metadata['duration'] = f"{minutes}:{seconds:02d}"
+        metadata['duration_sec'] = duration_sec
+
+    # Всегда очищаем метаданные
+    return enhance_metadata(metadata)
+
+def _parse_duration(duration) -> Optional[int]:
+    """Преобразует длительность из результатов поиска (MM:SS, H:MM:SS или секунды) в секунды"""
+    if isinstance(duration, (int, float)):
+        return int(duration)
+    try:
+        seconds = 0
+        for part in str(duration).split(':'):
+            seconds = seconds * 60 + int(part)
+        return seconds
+    except ValueError:
+        return None
+
+async def extract_track_info(ydl_opts: Dict, url: str, download: bool) -> Optional[Dict]:
+    """
+    Выполняет задачу yt-dlp, используя кэш метаданных: пока подписанные ссылки
+    на поток из прошлого извлечения действительны, извлечение информации пропускается.
+    Результат нового извлечения сохраняется в кэш метаданных.
+
+    Args:
+        ydl_opts: Настройки YoutubeDL
+        url: YouTube URL
+        download: Скачивать ли файл
+
+    Returns:
+        dict: Компактный info dict (см. services.ydl_engine.compact_info)
+    """
+    video_id = extract_video_id(url)
+    cached_info = metadata_cache.get_stream_info(video_id) if video_id else None
+    if video_id:
+        record_cache_lookup('metadata', bool(cached_info))
+
+    # Задача без скачивания - только извлечение, со скачиванием - вся задача yt-dlp
+    # (длительности загрузки и перекодирования учитываются отдельно по хукам)
+    with observe_stage('ydl_job' if download else 'extract'):
+        if cached_info:
+            try:
+                info = await ydl_engine.extract_info(ydl_opts, url, download=download, info=cached_info)
+                logger.info(f"Информация о видео {video_id} взята из кэша метаданных, извлечение пропущено")
+                return info
+            except Exception as e:
+                # Ссылка могла быть отозвана раньше срока - извлекаем информацию заново
+                logger.warning(f"Не удалось использовать кэш метаданных для видео {video_id}: {e}")
+                metadata_cache.invalidate_stream(video_id)
+
+        info = await ydl_engine.extract_info(ydl_opts, url, download=download)
+    if video_id and info:
+        metadata_cache.put_info(video_id, info)
+    return info
+
+class AdmissionError(Exception):
+    """Трек не может быть отправлен (слишком длинный или слишком большой) - загрузка не начинается"""
+
+class TrackTooLongError(AdmissionError):
+    """Трек длиннее MAX_TRACK_DURATION (из него можно получить только фрагмент)"""
+
+class AudioPlan(NamedTuple):
+    """План кодирования аудио, выбранный до загрузки"""
+    # Кодек итогового файла: mp3 или m4a
+    codec: str
+    # Битрейт в кбит/с
+    bitrate: int
+    # Исходный AAC отдается без перекодирования
+    passthrough: bool
+    # Ожидаемый размер файла в байтах (None, если оценить не удалось)
+    estimated_size: Optional[int]
+
+def _estimate_size(duration_sec: Optional[float], bitrate: int) -> Optional[int]:
+    """Оценивает размер аудиофайла по длительности и битрейту"""
+    if not duration_sec:
+        return None
+    return int(duration_sec * bitrate * 1000 / 8)
+
+def plan_audio(info: Dict) -> AudioPlan:
+    """
+    Выбирает кодирование трека до загрузки: проверяет длительность и оценивает размер файла
+    по выбранному формату. Если трек не укладывается в лимит Telegram, выбирает меньший битрейт.
+
+    Args:
+        info: Компактный info dict с выбранным форматом (загрузка не выполнялась)
+
+    Returns:
+        AudioPlan: План кодирования
+
+    Raises:
+        AdmissionError: Если трек слишком длинный или не укладывается в лимит даже при минимальном битрейте
+    """
+    duration_sec = info.get('duration')
+    if duration_sec and duration_sec > MAX_TRACK_DURATION:
+        raise TrackTooLongError(
+            f"Трек слишком длинный: {int(duration_sec) // 60}:{int(duration_sec) % 60:02d} "
+            f"(максимум {MAX_TRACK_DURATION // 60}:{MAX_TRACK_DURATION % 60:02d})"
+        )
+
+    size_limit = MAX_TELEGRAM_FILE_SIZE - FILE_SIZE_MARGIN
+    if AUDIO_FILE_EXT == 'm4a':
+        if (info.get('acodec') or '').startswith('mp4a'):
+            # Без перекодирования размер файла равен размеру исходного потока
+            source_size = info.get('filesize') or info.get('filesize_approx') or _estimate_size(
+                duration_sec, info.get('abr') or 128
+            )
+            if source_size is None or source_size <= size_limit:
+                return AudioPlan('m4a', int(info.get('abr') or 128), True, source_size)
+        else:
+            estimated_size = _estimate_size(duration_sec, 128)
+            if estimated_size is None or estimated_size <= size_limit:
+                return AudioPlan('m4a', 128, False, estimated_size)
+
+    # MP3 с наибольшим битрейтом, при котором файл укладывается в лимит
+    for bitrate in MP3_BITRATES:
+        estimated_size = _estimate_size(duration_sec, bitrate)
+        if estimated_size is None or estimated_size <= size_limit:
+            if bitrate != MP3_BITRATES[0] or AUDIO_FILE_EXT == 'm4a':
+                logger.info(f"Трек не укладывается в лимит Telegram, выбран MP3 {bitrate} кбит/с")
+            return AudioPlan('mp3', bitrate, False, estimated_size)
+
+    raise AdmissionError(
+        f"Файл будет слишком большим для отправки даже при битрейте {MP3_BITRATES[-1]} кбит/с"
+    )
+
+def _check_known_duration(video_id: Optional[str]) -> None:
+    """Отклоняет трек по длительности, уже известной из поиска, без обращения к YouTube"""
+    known_duration = ((metadata_cache.get(video_id) if video_id else None) or {}).get('duration_sec')
+    if known_duration and known_duration > MAX_TRACK_DURATION:
+        plan_audio({'duration': known_duration})
+
+async def preflight_download(url: str, video_id: Optional[str], ydl_opts: Dict) -> tuple:
+    """
+    Предварительная проверка перед загрузкой: отклоняет трек по длительности из кэша метаданных
+    без обращения к YouTube, иначе извлекает информацию без скачивания и выбирает план кодирования.
+    Извлеченная информация используется самой загрузкой, повторного извлечения не происходит.
+
+    Args:
+        url: YouTube URL
+        video_id: ID видео или None
+        ydl_opts: Настройки YoutubeDL для выбора формата
+
+    Returns:
+        tuple: (AudioPlan, компактный info dict)
+
+    Raises:
+        AdmissionError: Если трек не может быть отправлен
+    """
+    _check_known_duration(video_id)
+
+    info = await extract_track_info(ydl_opts, url, download=False)
+    plan = plan_audio(info or {})
+    logger.info(
+        f"Предварительная проверка {url}: {plan.codec} {plan.bitrate} кбит/с"
+        f"{' без перекодирования' if plan.passthrough else ''}"
+        + (f", ожидаемый размер {plan.estimated_size / 1024 / 1024:.1f} МБ" if plan.estimated_size else "")
+    )
+    return plan, info
+
+async def warm_track_info(url: str) -> bool:
+    """
+    Заранее выполняет предварительную проверку трека, не скачивая его: информация о видео
+    и ссылка на поток сохраняются в кэш метаданных, обложка - в кэш обложек. Загрузка,
+    начатая позже, пропускает извлечение информации.
+
+    Args:
+        url: YouTube URL
+
+    Returns:
+        bool: True, если информация извлечена (False - она уже была в кэше)
+
+    Raises:
+        AdmissionError: Если трек не может быть отправлен
+    """
+    video_id = extract_video_id(url)
+    if video_id and metadata_cache.get_stream_info(video_id):
+        return False
+
+    thumbnail_task = None
+    if video_id:
+        known_metadata = metadata_cache.get(video_id) or {}
+        thumbnail_task = asyncio.create_task(thumbnail_service.get(video_id, known_metadata.get('thumbnail')))
+    try:
+        await preflight_download(url, video_id, PREFLIGHT_YDL_OPTS)
+    except BaseException:
+        _discard_thumbnail(thumbnail_task)
+        raise
+    if thumbnail_task:
+        # Обложка остается в кэше обложек, ссылка на нее не нужна
+        thumb_path = await thumbnail_task
+        if thumb_path:
+            thumbnail_service.release(thumb_path)
+    return True
+
+def _discard_thumbnail(thumbnail_task: Optional[asyncio.Task]) -> None:
+    """Отменяет ненужную подготовку обложки или освобождает уже полученную ссылку на обложку"""
+    if thumbnail_task is None:
+        return
+    if not thumbnail_task.done():
+        thumbnail_task.cancel()
+    elif not thumbnail_task.cancelled() and thumbnail_task.exception() is None and thumbnail_task.result():
+        thumbnail_service.release(thumbnail_task.result())
+
+def audio_codec_args(plan: AudioPlan) -> list:
+    """Параметры кодирования ffmpeg для плана кодирования"""
+    if plan.passthrough:
+        # AAC перепаковывается без перекодирования
+        return ['-c:a', 'copy']
+    if plan.codec == 'm4a':
+        return ['-c:a', 'aac', '-b:a', f'{plan.bitrate}k']
+    return ['-c:a', 'libmp3lame', '-b:a', f'{plan.bitrate}k']
+
+async def transcode_download(source_path: str, output_path: str, plan: AudioPlan, metadata: Dict) -> str:
+    """
+    Приводит скачанный поток к итоговому формату через менеджер перекодирования
+    (перекодирование и запись тегов за один проход). Исходный файл удаляется.
+
+    Args:
+        source_path: Скачанный исходный поток
+        output_path: Путь выходного файла без расширения
+        plan: План кодирования
+        metadata: Метаданные трека (см. build_track_metadata)
+
+    Returns:
+        str: Путь к итоговому файлу
+    """
+    if plan.passthrough and source_path.endswith('.m4a'):
+        # AAC в m4a отдается как есть - название и исполнитель передаются в Telegram при отправке
+        return source_path
+
+    target_path = f"{output_path}.{plan.codec}"
+    if target_path == source_path:
+        target_path = f"{output_path}.{plan.codec}.{plan.codec}"
+    downloads_janitor.register(target_path)
+    await transcoder.transcode(source_path, target_path, audio_codec_args(plan), {
+        'title': metadata.get('title'),
+        'artist': metadata.get('artist') or metadata.get('channel'),
+        'album': metadata.get('album'),
+    })
+    await release_downloaded_files(source_path)
+    return target_path
+
+async def download_stream_ranged(info: Optional[Dict], output_path: str) -> Optional[str]:
+    """
+    Загружает выбранный формат по частям в несколько соединений в файл, который ожидает yt-dlp
+    (шаблон output_path + '.%(ext)s'). yt-dlp находит готовый файл и выполняет только постобработку.
+    Если поток нельзя или не удалось загрузить по частям, его загрузит сам yt-dlp.
+
+    Args:
+        info: Компактный info dict с выбранным форматом (загрузка не выполнялась)
+        output_path: Путь выходного файла без расширения
+
+    Returns:
+        str: Путь к загруженному файлу или None
+    """
+    if not RANGED_DOWNLOAD_ENABLED or not ranged_downloader.supports(info):
+        return None
+    path = f"{output_path}.{info['ext']}"
+    if info.get('filesize') and os.path.exists(path) and os.path.getsize(path) == info['filesize']:
+        # Поток полностью загружен до перезапуска бота
+        logger.info(f"Используется ранее загруженный поток: {path}")
+        return path
+    try:
+        await ranged_downloader.download(info['url'], path, info.get('http_headers'), info.get('filesize'))
+        return path
+    except Exception as e:
+        logger.warning(f"Не удалось загрузить поток по частям, загрузка средствами yt-dlp: {e}")
+        return None
+
+class DownloadResult(NamedTuple):
+    """Результат загрузки аудио"""
+    # Путь к аудиофайлу
+    file_path: str
+    # Метаданные трека
+    metadata: Dict
+    # Путь к обложке для Telegram или None
+    thumb_path: Optional[str]
+
+class _InflightDownload:
+    """
+    Общая загрузка одного видео, которую ожидают все одновременные запросы.
+    waiters - количество ожидающих запросов, каждому из них после загрузки
+    выдается собственная ссылка на запись кэша аудио.
+    """
+
+    def __init__(self):
+        self.task: Optional[asyncio.Task] = None
+        self.waiters = 0
+
+# Активные загрузки по ключу кэша (videoId + профиль): key -> _InflightDownload
+_inflight_downloads: Dict[str, _InflightDownload] = {}
+
+# Временные файлы общих загрузок, не попавшие в кэш аудио: путь -> количество запросов, еще не освободивших файл
+_shared_temp_files: Dict[str, int] = {}
+
+def is_audio_available(url: str) -> bool:
+    """
+    Проверяет, можно ли получить аудио без новой загрузки:
+    трек уже есть в кэше или прямо сейчас загружается по другому запросу.
+
+    Args:
+        url: YouTube URL
+
+    Returns:
+        True, если запрос не создаст новой загрузки
+    """
+    video_id = extract_video_id(url)
+    if not video_id:
+        return False
+    key = audio_cache.make_key(video_id, DEFAULT_AUDIO_PROFILE)
+    return key in _inflight_downloads or audio_cache.contains(video_id, DEFAULT_AUDIO_PROFILE)
+
+async def download_audio_from_youtube(url: str, speculative: bool = False) -> DownloadResult:
     """
     Скачивает аудио из YouTube видео и сохраняет в формате MP3.
     Оптимизированная версия с быстрой загрузкой.
+    Одновременные запросы одного и того же видео объединяются в одну загрузку,
+    результат получает каждый ожидающий запрос.
     
     Args:
         url: YouTube URL для скачивания
+        speculative: Упреждающая загрузка - при ее отмене общая загрузка прерывается,
+            если результат больше никто не ожидает
         
     Returns:
-        tuple: (путь к файлу, метаданные трека, путь к обложке)
+        DownloadResult: (путь к файлу, метаданные трека, путь к обложке)
         
     Raises:
         Exception: Если произошла ошибка при скачивании
     """
+    video_id = extract_video_id(url)
+    if not video_id:
+        # Без ID видео нельзя ни кэшировать, ни объединять загрузки
+        return await _download_audio(url, None, None)
+
+    # Если трек уже есть в кэше, отдаем его без скачивания
+    cached_entry = audio_cache.acquire(video_id, DEFAULT_AUDIO_PROFILE)
+    record_cache_lookup('audio', bool(cached_entry))
+    if cached_entry:
+        thumb_path = cached_entry['thumb_path'] or thumbnail_service.acquire(video_id)
+        return DownloadResult(cached_entry['audio_path'], cached_entry['metadata'], thumb_path)
+
+    key = audio_cache.make_key(video_id, DEFAULT_AUDIO_PROFILE)
+    flight = _inflight_downloads.get(key)
+    if flight is None:
+        flight = _InflightDownload()
+        flight.task = asyncio.create_task(_download_audio(url, video_id, flight))
+        _inflight_downloads[key] = flight
+
+        def forget_flight(_task, key=key, flight=flight):
+            if _inflight_downloads.get(key) is flight:
+                _inflight_downloads.pop(key, None)
+
+        flight.task.add_done_callback(forget_flight)
+    else:
+        logger.info(f"Видео {video_id} уже загружается, ожидаем общий результат")
+
+    flight.waiters += 1
+    try:
+        # shield: отмена одного запроса не должна прерывать общую загрузку
+        return await asyncio.shield(flight.task)
+    except asyncio.CancelledError:
+        if flight.task.done() and not flight.task.cancelled() and flight.task.exception() is None:
+            # Загрузка завершилась и уже выдала нам ссылку на запись кэша - возвращаем ее
+            result = flight.task.result()
+            await release_downloaded_files(result.file_path, result.thumb_path)
+        else:
+            flight.waiters -= 1
+            if speculative and flight.waiters == 0:
+                # Трек был нужен только упреждающей загрузке
+                flight.task.cancel()
+        raise
+
+async def _download_audio(url: str, video_id: Optional[str], flight: Optional[_InflightDownload]) -> DownloadResult:
+    """
+    Выполняет фактическую загрузку и конвертацию аудио.
+    
+    Args:
+        url: YouTube URL для скачивания
+        video_id: ID видео (None, если его не удалось определить - результат не кэшируется)
+        flight: Общая загрузка, для ожидающих запросов которой захватываются записи кэша
+        
+    Returns:
+        DownloadResult: (путь к файлу, метаданные трека, путь к обложке)
+    """
     # Инициализируем переменные заранее, чтобы они были доступны в блоке except
     audio_file_path = None
     metadata = {
@@ -165,52 +773,42 @@ async def download_audio_from_youtube(url: str) -> tuple:
         'duration': None
     }
     telegram_thumb_path = None
-    
+    thumbnail_task = None
+
     try:
-        # Очищаем папку загрузок от старых файлов
-        cleanup_downloads_folder()
-        
         logger.info(f"Начинаю скачивание аудио из: {url}")
+
+        # Обложку загружаем и уменьшаем параллельно с загрузкой аудио
+        if video_id:
+            known_metadata = metadata_cache.get(video_id) or {}
+            thumbnail_task = asyncio.create_task(thumbnail_service.get(video_id, known_metadata.get('thumbnail')))
         
         # Путь к ffmpeg
         ffmpeg_path = imageio_ffmpeg.get_ffmpeg_exe()
         
-        # Временный файл для аудио с уникальным именем
-        temp_filename = f"audio_{uuid.uuid4().hex[:8]}"
-        output_path = os.path.join(DOWNLOADS_DIR, temp_filename)
-        
-        # Список файлов перед загрузкой
-        before_files = set(os.listdir(DOWNLOADS_DIR))
+        # Файлы загрузки видео имеют постоянное имя: одновременные загрузки одного видео
+        # объединяются, а загрузка, прерванная перезапуском, продолжается с частично загруженного файла
+        output_path = os.path.join(DOWNLOADS_DIR, download_basename(video_id))
         
-        # Прямая оптимизированная загрузка аудио с получением метаданных
+        # До загрузки проверяем длительность и размер и выбираем битрейт
+        plan, preflight_info = await preflight_download(url, video_id, PREFLIGHT_YDL_OPTS)
+
+        # yt-dlp только скачивает исходный поток: перекодирование и запись тегов выполняет
+        # менеджер перекодирования за один проход ffmpeg с учетом числа доступных ядер
         ydl_opts = {
-            'format': 'bestaudio[ext=m4a]/bestaudio/best',  # Предпочитаем m4a как более эффективный формат
-            'postprocessors': [{
-                'key': 'FFmpegExtractAudio',
-                'preferredcodec': 'mp3',
-                'preferredquality': '128',
-            }, {
-                # Добавляем постпроцессор для записи метаданных в файл
-                'key': 'FFmpegMetadata',
-                'add_metadata': True,
-            }],
+            'format': AUDIO_FORMAT_SELECTOR,
             'outtmpl': output_path + '.%(ext)s',
+            # ffmpeg нужен yt-dlp только для исправления контейнера и фрагментированных форматов
             'ffmpeg_location': ffmpeg_path,
-            # Добавляем параметры FFmpeg через postprocessor_args
-            'postprocessor_args': [
-                '-threads', '4', 
-                '-preset', 'fast'
-            ],
             'quiet': True,  # Скрываем большинство выводов yt-dlp
             'no_warnings': True,  # Скрываем предупреждения
             'verbose': False,  # Отключаем подробные логи
             'progress': False,  # Отключаем индикатор прогресса
-            'max_filesize': MAX_TELEGRAM_FILE_SIZE - 2*1024*1024,  # Запас 2 МБ
-            'max_duration': 900,  # 15 минут
+            'max_filesize': MAX_TELEGRAM_FILE_SIZE - FILE_SIZE_MARGIN,
             'noplaylist': True,
             'extract_flat': False,
             'skip_download': False,
-            'writethumbnail': True,  # Скачиваем миниатюру для обложки Telegram
+            'writethumbnail': False,  # Обложку для Telegram готовит сервис обложек
             'writeinfojson': False,
             'writedescription': False,
             'writesubtitles': False,
@@ -218,6 +816,7 @@ async def download_audio_from_youtube(url: str) -> tuple:
             'concurrent_fragment_downloads': 8,  # Увеличиваем параллельные загрузки фрагментов
             'fragment_retries': 3,
             'retries': 3,
+            'continuedl': True,  # Продолжаем загрузку из .part файла, оставшегося после перезапуска
             # Отключаем лишние проверки API
             'check_formats': False,
             'source_address': '0.0.0.0',  # Более быстрая инициализация сетевых запросов
@@ -227,138 +826,370 @@ async def download_audio_from_youtube(url: str) -> tuple:
                 'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/96.0.4664.110 Safari/537.36',
             }
         }
-        
-        # Определяем функцию для скачивания в отдельном потоке
-        def download_in_thread():
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=True)
-                return info
-        
-        logger.info("Запускаю загрузку аудио в отдельном потоке")
-        # Запускаем скачивание в отдельном потоке с помощью asyncio.to_thread
-        info = await asyncio.to_thread(download_in_thread)
+
+        # Одиночный поток загружаем по частям в несколько соединений
+        # (concurrent_fragment_downloads ускоряет только фрагментированные форматы)
+        ranged_path = await download_stream_ranged(preflight_info, output_path)
+        downloads_janitor.register(ranged_path)
+
+        logger.info(f"Запускаю загрузку аудио в исполнителе yt-dlp (режим {ydl_engine.mode})")
+        # Скачивание выполняется в пуле потоков или процессов, не блокируя цикл событий.
+        # Информация уже извлечена предварительной проверкой (и сохранена в кэш метаданных) -
+        # выполняется только загрузка
+        if not video_id and preflight_info and preflight_info.get('info_dict'):
+            info = await ydl_engine.extract_info(ydl_opts, url, download=True, info=preflight_info['info_dict'])
+        else:
+            info = await extract_track_info(ydl_opts, url, download=True)
         
         # Сохраняем метаданные после успешной загрузки
         if info:
-            metadata['title'] = info.get('title', 'Unknown Title')
-            # Не используем название канала в качестве артиста
-            metadata['artist'] = info.get('artist', '') or ''
-            metadata['album'] = info.get('album', 'YouTube Audio')
-            metadata['thumbnail'] = info.get('thumbnail')
-            metadata['channel'] = info.get('channel') or info.get('uploader', '')
-            
-            # Форматируем длительность
-            duration_sec = info.get('duration')
-            if duration_sec:
-                minutes = int(duration_sec) // 60
-                seconds = int(duration_sec) % 60
-                metadata['duration'] = f"{minutes}:{seconds:02d}"
-                metadata['duration_sec'] = duration_sec
-            
-            # Всегда очищаем метаданные
-            metadata = enhance_metadata(metadata)
-        
-        # Ищем новые файлы после загрузки
-        after_files = set(os.listdir(DOWNLOADS_DIR))
-        new_files = list(after_files - before_files)
-        logger.info(f"Новые файлы после загрузки: {new_files}")
+            metadata = build_track_metadata(info)
         
-        # Находим скачанный MP3 файл
-        audio_file_path = None
-        
-        # Ищем MP3 файл, который мы только что скачали
-        expected_mp3 = output_path + ".mp3"
-        if os.path.exists(expected_mp3):
-            logger.info(f"Найден скачанный файл: {expected_mp3}")
-            audio_file_path = expected_mp3
-        else:
-            # Если точный путь не найден, ищем по шаблону
-            mp3_files = [os.path.join(DOWNLOADS_DIR, f) for f in new_files if f.endswith('.mp3') or f.endswith('.mp3.mp3')]
-            if mp3_files:
-                audio_file_path = mp3_files[0]
-                logger.info(f"Найден новый MP3 файл: {audio_file_path}")
-            else:
-                # Если ничего не найдено, ищем самый свежий MP3 в папке
-                all_mp3_files = glob.glob(os.path.join(DOWNLOADS_DIR, "*.mp3"))
-                if all_mp3_files:
-                    recent_file = max(all_mp3_files, key=os.path.getmtime)
-                    # Проверяем, что файл новый (создан не более 10 секунд назад)
-                    if time.time() - os.path.getmtime(recent_file) < 10:
-                        logger.info(f"Найден свежий MP3 файл: {recent_file}")
-                        audio_file_path = recent_file
-        
-        if not audio_file_path:
-            raise FileNotFoundError(f"Не удалось найти скачанный MP3 файл для {url}")
-        
-        # Поиск миниатюры только для Telegram
-        thumbnail_files = [f for f in new_files if any(f.endswith(ext) for ext in ['.jpg', '.jpeg', '.png', '.webp'])]
-        
-        # Обрабатываем обложку только для Telegram
-        if thumbnail_files:
-            source_thumbnail = os.path.join(DOWNLOADS_DIR, thumbnail_files[0])
-            logger.info(f"Найдена миниатюра: {source_thumbnail}")
-            
-            # Получаем расширение файла
-            thumbnail_ext = os.path.splitext(source_thumbnail)[1].lower()
-            
-            # WebP можно использовать напрямую в Telegram для обложек (экспериментально)
-            # Создаем копию обложки для Telegram с тем же форматом
-            telegram_thumb_name = f"tg_thumb_{uuid.uuid4().hex[:8]}{thumbnail_ext}"
-            telegram_thumb_path = os.path.join(DOWNLOADS_DIR, telegram_thumb_name)
-            
-            # Копируем файл (независимо от формата)
-            import shutil
-            shutil.copy2(source_thumbnail, telegram_thumb_path)
-            logger.info(f"Подготовлена обложка для Telegram: {telegram_thumb_path}")
-        
-        # Если не нашли миниатюру среди скачанных файлов, пробуем загрузить напрямую
-        if not telegram_thumb_path and metadata.get('thumbnail'):
-            try:
-                thumbnail_url = metadata['thumbnail']
-                # Определяем расширение из URL
-                thumbnail_ext = os.path.splitext(thumbnail_url.split('?')[0])[1].lower()
-                if not thumbnail_ext:
-                    thumbnail_ext = '.jpg'  # По умолчанию jpg если расширение не определено
-                
-                telegram_thumb_path = os.path.join(DOWNLOADS_DIR, f"tg_thumb_{uuid.uuid4().hex[:8]}{thumbnail_ext}")
-                logger.info(f"Загружаю миниатюру напрямую: {thumbnail_url}")
-                
-                response = requests.get(thumbnail_url, timeout=10)
-                with open(telegram_thumb_path, 'wb') as f:
-                    f.write(response.content)
-                
-                if os.path.exists(telegram_thumb_path) and os.path.getsize(telegram_thumb_path) > 0:
-                    logger.info(f"Миниатюра успешно загружена напрямую: {telegram_thumb_path}")
-                else:
-                    logger.warning("Не удалось загрузить миниатюру напрямую")
-                    telegram_thumb_path = None
-            except Exception as e:
-                logger.warning(f"Ошибка при загрузке миниатюры напрямую: {e}")
-                telegram_thumb_path = None
-        
-        # Удаляем все временные файлы миниатюр, кроме той что для Telegram
-        for thumb_file in [f for f in new_files if any(f.endswith(ext) for ext in ['.jpg', '.jpeg', '.png', '.webp'])]:
-            thumb_path = os.path.join(DOWNLOADS_DIR, thumb_file)
+        # Точные пути выходных файлов задачи сообщают хуки yt-dlp
+        outputs = (info or {}).get('outputs') or {}
+        record_ydl_timings(outputs)
+        # Если поток загружен по частям, yt-dlp не сообщает о загрузке - исходным файлом остается он
+        source_path = outputs.get('audio_path') or ranged_path
+        logger.info(f"Выходные файлы загрузки: {outputs}")
+        # Файлы, которые не будут удалены после отправки или перенесены в кэш, удалит фоновая очистка
+        downloads_janitor.register(source_path, *outputs.get('downloaded', []), *outputs.get('thumbnail_paths', []))
+
+        if not source_path or not os.path.exists(source_path):
+            raise FileNotFoundError(f"Не удалось найти скачанный аудиофайл для {url}")
+
+        audio_file_path = await transcode_download(source_path, output_path, plan, metadata)
+
+        # Обложка готовилась параллельно с загрузкой аудио
+        if thumbnail_task:
+            telegram_thumb_path = await thumbnail_task
+
+        # Помещаем готовый трек в кэш, чтобы следующие запросы обходились без скачивания
+        # (обложка хранится в кэше обложек и в запись не переносится)
+        result = DownloadResult(audio_file_path, metadata, telegram_thumb_path)
+        if video_id:
             try:
-                # Не удаляем обложку для Telegram
-                if thumb_path == telegram_thumb_path:
-                    continue
-                
-                if os.path.exists(thumb_path):
-                    os.remove(thumb_path)
-                    logger.info(f"Удален файл миниатюры: {thumb_path}")
+                cached_entry = await _put_into_cache(video_id, DEFAULT_AUDIO_PROFILE, audio_file_path, metadata)
+                result = DownloadResult(cached_entry['audio_path'], metadata, telegram_thumb_path)
             except Exception as e:
-                logger.warning(f"Не удалось удалить файл миниатюры {thumb_path}: {e}")
-                
-        return audio_file_path, metadata, telegram_thumb_path
+                logger.warning(f"Не удалось поместить аудио в кэш: {e}")
+
+        if flight:
+            await _share_result(result, flight.waiters)
+        return result
         
+    except asyncio.CancelledError:
+        _discard_thumbnail(thumbnail_task)
+        raise
+    except AdmissionError as e:
+        _discard_thumbnail(thumbnail_task)
+        logger.info(f"Загрузка {url} отклонена предварительной проверкой: {e}")
+        raise
     except Exception as e:
+        _discard_thumbnail(thumbnail_task)
         logger.error(f"Ошибка при скачивании аудио: {e}", exc_info=True)
         raise Exception(f"Не удалось скачать аудио: {str(e)}")
 
+async def _put_into_cache(video_id: str, profile: str, audio_file_path: str, metadata: Dict) -> Dict:
+    """
+    Помещает готовый аудиофайл в кэш аудио в отдельном потоке (перенос файла, на другом разделе -
+    копирование, и вытеснение старых записей не блокируют цикл событий)
+
+    Args:
+        video_id: ID видео YouTube
+        profile: Профиль кодирования аудио
+        audio_file_path: Путь к готовому аудиофайлу
+        metadata: Метаданные трека
+
+    Returns:
+        Запись кэша с одной захваченной ссылкой
+    """
+    put_task = asyncio.ensure_future(
+        asyncio.to_thread(audio_cache.put, video_id, profile, audio_file_path, None, metadata)
+    )
+    try:
+        return await asyncio.shield(put_task)
+    except asyncio.CancelledError:
+        # Поток завершит перенос и после отмены - освобождаем захваченную им ссылку
+        def release_entry(_task):
+            if not _task.cancelled() and _task.exception() is None:
+                audio_cache.release(_task.result()['audio_path'])
+
+        put_task.add_done_callback(release_entry)
+        raise
+
+async def _share_result(result: DownloadResult, waiters: int) -> None:
+    """
+    Раздает ссылки на результат общей загрузки: каждый ожидающий запрос получает свою ссылку
+    на запись кэша (или общий временный файл) и на обложку. Вызывается после последнего await
+    загрузки, когда число ожидающих уже не изменится; загрузка держит одну ссылку.
+
+    Args:
+        result: Результат загрузки
+        waiters: Количество ожидающих запросов
+    """
+    if waiters == 0:
+        # Все ожидавшие запросы отменены - результат больше не нужен
+        await release_downloaded_files(result.file_path, result.thumb_path)
+        return
+    if waiters == 1:
+        return
+
+    if audio_cache.owns(result.file_path):
+        audio_cache.retain(result.file_path, waiters - 1)
+    else:
+        # Временный файл получают все ожидающие запросы - удаляет его последний из них
+        _shared_temp_files[result.file_path] = waiters
+    if result.thumb_path:
+        thumbnail_service.retain(result.thumb_path, waiters - 1)
+
+async def open_audio_stream(url: str) -> Optional[tuple]:
+    """
+    Готовит потоковую передачу аудио без временных файлов: получает ссылку на аудиопоток
+    (без скачивания) и создает файл для отправки, который перекодируется на лету.
+
+    Args:
+        url: YouTube URL
+
+    Returns:
+        tuple: (StreamingAudioFile, метаданные трека, оценка размера в байтах, путь к обложке)
+        или None, если поток нельзя передать напрямую (тогда используется обычная загрузка)
+
+    Raises:
+        AdmissionError: Если трек не может быть отправлен
+    """
+    video_id = extract_video_id(url)
+    _check_known_duration(video_id)
+
+    # Обложку готовим параллельно с получением ссылки на поток
+    thumbnail_task = None
+    if video_id:
+        known_metadata = metadata_cache.get(video_id) or {}
+        thumbnail_task = asyncio.create_task(thumbnail_service.get(video_id, known_metadata.get('thumbnail')))
+
+    ydl_opts = {
+        # Потоковая передача возможна только для форматов, отдаваемых одним HTTP-файлом
+        'format': (
+            'bestaudio[ext=m4a][protocol^=http]/bestaudio[acodec^=mp4a][protocol^=http]/bestaudio[protocol^=http]'
+            if AUDIO_FILE_EXT == 'm4a' else
+            'bestaudio[ext=m4a][protocol^=http]/bestaudio[protocol^=http]'
+        ),
+        'quiet': True,
+        'no_warnings': True,
+        'noplaylist': True,
+        'check_formats': False,
+        'socket_timeout': 10,
+        'http_headers': {
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/96.0.4664.110 Safari/537.36',
+        }
+    }
+
+    try:
+        info = await extract_track_info(ydl_opts, url, download=False)
+    except Exception as e:
+        logger.warning(f"Не удалось получить аудиопоток для {url}, используется обычная загрузка: {e}")
+        info = None
+    if not info or not info.get('url'):
+        _discard_thumbnail(thumbnail_task)
+        return None
+
+    try:
+        plan = plan_audio(info)
+    except AdmissionError:
+        _discard_thumbnail(thumbnail_task)
+        raise
+
+    if plan.codec == 'm4a':
+        # Фрагментированный m4a: обычный требует перемотки выходного файла для записи индекса
+        container_args = ['-f', 'ipod', '-movflags', '+frag_keyframe+empty_moov+default_base_moof',
+                          '-frag_duration', '5000000']
+    else:
+        container_args = ['-f', 'mp3']
+    estimated_size = plan.estimated_size or 0
+
+    metadata = build_track_metadata(info)
+    audio_file = StreamingAudioFile(
+        info['url'],
+        info.get('http_headers'),
+        ['-vn', '-map_metadata', '-1', *audio_codec_args(plan), *container_args],
+        filename=f"{video_id or info.get('id') or uuid.uuid4().hex[:8]}.{plan.codec}"
+    )
+    thumb_path = await thumbnail_task if thumbnail_task else None
+    logger.info(
+        f"Подготовлена потоковая передача для {url} (формат {info.get('format_id')}, "
+        f"оценка размера {estimated_size / 1024 / 1024:.1f} МБ)"
+    )
+    return audio_file, metadata, estimated_size, thumb_path
+
+async def download_clip(url: str, start: int, end: int) -> DownloadResult:
+    """
+    Загружает фрагмент трека [start, end). Скачивается и кодируется только фрагмент:
+    ffmpeg читает аудиопоток по ссылке с перемоткой на начало фрагмента (запросы Range
+    к HTTP-потоку или только нужные сегменты HLS), поэтому объем загрузки и время
+    кодирования пропорциональны длительности фрагмента, а не всего видео.
+
+    Args:
+        url: YouTube URL
+        start: Начало фрагмента в секундах
+        end: Конец фрагмента в секундах (ограничивается длительностью видео)
+
+    Returns:
+        DownloadResult: (путь к файлу, метаданные фрагмента, путь к обложке)
+
+    Raises:
+        AdmissionError: Если фрагмент слишком длинный или находится за пределами трека
+    """
+    if end - start > MAX_TRACK_DURATION:
+        raise AdmissionError(
+            f"Фрагмент слишком длинный: {format_timestamp(end - start)} "
+            f"(максимум {format_timestamp(MAX_TRACK_DURATION)})"
+        )
+
+    video_id = extract_video_id(url)
+    profile = clip_profile(start, end)
+    if video_id:
+        cached_entry = audio_cache.acquire(video_id, profile)
+        record_cache_lookup('audio', bool(cached_entry))
+        if cached_entry:
+            thumb_path = cached_entry['thumb_path'] or thumbnail_service.acquire(video_id)
+            return DownloadResult(cached_entry['audio_path'], cached_entry['metadata'], thumb_path)
+
+    # Обложку готовим параллельно с получением ссылки на поток
+    thumbnail_task = None
+    if video_id:
+        known_metadata = metadata_cache.get(video_id) or {}
+        thumbnail_task = asyncio.create_task(thumbnail_service.get(video_id, known_metadata.get('thumbnail')))
+
+    try:
+        logger.info(f"Начинаю загрузку фрагмента {format_timestamp(start)}-{format_timestamp(end)} из: {url}")
+        # Нужен поток, который ffmpeg может читать с произвольного места: одиночный HTTP-файл или HLS
+        # (сегменты DASH перематывать по ссылке нельзя)
+        info = await extract_track_info({
+            'format': (
+                'bestaudio[ext=m4a][protocol^=http][protocol!=http_dash_segments]/'
+                'bestaudio[protocol^=http][protocol!=http_dash_segments]/bestaudio[protocol*=m3u8]/best[protocol*=m3u8]'
+            ),
+            'quiet': True,
+            'no_warnings': True,
+            'noplaylist': True,
+            'check_formats': False,
+            'socket_timeout': 10,
+        }, url, download=False)
+        if not info or not info.get('url'):
+            raise Exception("Не удалось получить ссылку на аудиопоток")
+
+        duration_sec = info.get('duration')
+        if duration_sec:
+            if start >= duration_sec:
+                raise AdmissionError(
+                    f"Начало фрагмента {format_timestamp(start)} за пределами трека "
+                    f"(длительность {format_timestamp(duration_sec)})"
+                )
+            end = min(end, int(duration_sec))
+        length = end - start
+
+        # AAC-поток в режиме без перекодирования копируется, иначе кодируется только фрагмент
+        plan = plan_audio({'duration': length, 'acodec': info.get('acodec'), 'abr': info.get('abr')})
+
+        metadata = build_track_metadata(info)
+        metadata['title'] = f"{metadata['title']} ({format_timestamp(start)}-{format_timestamp(end)})"
+        metadata['duration'] = format_timestamp(length)
+        metadata['duration_sec'] = length
+
+        headers = info.get('http_headers') or {}
+        input_args = ['-ss', str(start), '-t', str(length)]
+        if headers:
+            input_args += ['-headers', ''.join(f"{name}: {value}\r\n" for name, value in headers.items())]
+
+        audio_file_path = os.path.join(
+            DOWNLOADS_DIR, f"{download_basename(video_id)}.clip{start}-{end}.{plan.codec}"
+        )
+        downloads_janitor.register(audio_file_path)
+        await transcoder.transcode(info['url'], audio_file_path, audio_codec_args(plan), {
+            'title': metadata.get('title'),
+            'artist': metadata.get('artist') or metadata.get('channel'),
+            'album': metadata.get('album'),
+        }, input_args=input_args)
+
+        telegram_thumb_path = await thumbnail_task if thumbnail_task else None
+
+        # Фрагмент кэшируется отдельно от полного трека - по профилю с интервалом
+        if video_id:
+            try:
+                cached_entry = await _put_into_cache(video_id, profile, audio_file_path, metadata)
+                return DownloadResult(cached_entry['audio_path'], metadata, telegram_thumb_path)
+            except Exception as e:
+                logger.warning(f"Не удалось поместить фрагмент в кэш: {e}")
+
+        return DownloadResult(audio_file_path, metadata, telegram_thumb_path)
+
+    except asyncio.CancelledError:
+        _discard_thumbnail(thumbnail_task)
+        raise
+    except AdmissionError as e:
+        _discard_thumbnail(thumbnail_task)
+        logger.info(f"Загрузка фрагмента {url} отклонена: {e}")
+        raise
+    except Exception as e:
+        _discard_thumbnail(thumbnail_task)
+        logger.error(f"Ошибка при загрузке фрагмента: {e}", exc_info=True)
+        raise Exception(f"Не удалось скачать фрагмент: {str(e)}")
+
+async def extract_playlist(url: str) -> Dict:
+    """
+    Получает список треков плейлиста без извлечения информации о каждом видео (плоское извлечение)
+
+    Args:
+        url: Ссылка на плейлист
+
+    Returns:
+        dict: {'title': название плейлиста, 'entries': [{'id', 'title', 'duration', ...}],
+               'truncated': плейлист длиннее PLAYLIST_MAX_TRACKS}
+
+    Raises:
+        Exception: Если плейлист не удалось получить
+    """
+    ydl_opts = {
+        'extract_flat': 'in_playlist',
+        'noplaylist': False,
+        # На один трек больше лимита - чтобы узнать, что плейлист был сокращен
+        'playlistend': PLAYLIST_MAX_TRACKS + 1,
+        'quiet': True,
+        'no_warnings': True,
+        'socket_timeout': 10,
+    }
+    with observe_stage('extract'):
+        info = await ydl_engine.extract_info(ydl_opts, url, download=False)
+    entries = [
+        entry for entry in (info or {}).get('entries') or []
+        if entry.get('id') and VIDEO_ID_REGEX.match(entry['id'])
+    ]
+    if not entries:
+        raise Exception("Плейлист пуст или недоступен")
+    logger.info(f"Плейлист {url}: {len(entries)} треков")
+    return {
+        'title': info.get('title') or 'Плейлист',
+        'entries': entries[:PLAYLIST_MAX_TRACKS],
+        'truncated': len(entries) > PLAYLIST_MAX_TRACKS,
+    }
+
 async def search_youtube_music(query: str, limit: int = 0) -> list:
     """
     Выполняет поиск только в YouTube Music по запросу.
+    Результаты кэшируются по нормализованному запросу (см. services.search_cache).
+    
+    Args:
+        query: Строка запроса
+        limit: Максимальное количество результатов (0 = без ограничений)
+        
+    Returns:
+        list: Список результатов поиска (песни из YouTube Music)
+    """
+    return await search_cache.get(query, limit, _search_youtube_music)
+
+@timed_stage('search')
+async def _search_youtube_music(query: str, limit: int = 0) -> list:
+    """
+    Выполняет поиск в YouTube Music без кэша.
     Оптимизированная версия, использующая наиболее эффективные стратегии поиска.
     
     Args:
@@ -371,11 +1202,6 @@ async def search_youtube_music(query: str, limit: int = 0) -> list:
     logger.info(f"Поиск музыки по запросу: {query}")
     
     try:
-        from ytmusicapi import YTMusic
-        
-        # Инициализация API без авторизации
-        ytmusic = YTMusic(language="ru")
-        
         # Определяем лимит поиска
         search_limit = 50 if limit == 0 else limit * 2
         
@@ -385,13 +1211,13 @@ async def search_youtube_music(query: str, limit: int = 0) -> list:
         results = []
         
         # Поиск песен
-        songs_results = ytmusic.search(query, filter="songs", limit=search_limit)
+        songs_results = await ytmusic_pool.call("search", query, filter="songs", limit=search_limit)
         if songs_results:
             results.extend(songs_results)
             logger.info(f"Найдено песен: {len(songs_results)}")
         else:
             # Если песен не найдено, используем общий поиск как запасной вариант
-            general_results = ytmusic.search(query, limit=search_limit)
+            general_results = await ytmusic_pool.call("search", query, limit=search_limit)
             if general_results:
                 results.extend(general_results)
             logger.info(f"Найдено общих результатов: {len(general_results)}")
@@ -416,22 +1242,21 @@ async def search_youtube_music(query: str, limit: int = 0) -> list:
             if not duration or duration == 'Unknown':
                 duration = result.get('length', 'Unknown')
             
-            # Проверяем длительность, исключаем файлы длиннее 15 минут
-            try:
-                if duration and duration != 'Unknown':
-                    duration_parts = duration.split(':')
-                    total_minutes = 0
-                    if len(duration_parts) == 2:  # MM:SS
-                        total_minutes = int(duration_parts[0])
-                    elif len(duration_parts) == 3:  # H:MM:SS
-                        total_minutes = int(duration_parts[0]) * 60 + int(duration_parts[1])
-                    
-                    # Исключаем файлы длиннее 15 минут
-                    if total_minutes > 15:
-                        continue
-            except Exception:
-                pass  # Игнорируем ошибки при обработке длительности для скорости
+            # Проверяем длительность, исключаем треки длиннее допустимой
+            if duration and duration != 'Unknown':
+                duration_sec = _parse_duration(duration)
+                if duration_sec and duration_sec > MAX_TRACK_DURATION:
+                    continue
             
+            # Запоминаем известные из поиска метаданные для последующей загрузки
+            thumbnails = result.get('thumbnails') or []
+            metadata_cache.update(
+                video_id,
+                title=title,
+                duration_sec=_parse_duration(duration) if duration and duration != 'Unknown' else None,
+                thumbnail=thumbnails[-1].get('url') if thumbnails else None
+            )
+
             # Добавляем результат
             formatted_results.append({
                 'title': title,
@@ -470,6 +1295,21 @@ async def search_youtube_music(query: str, limit: int = 0) -> list:
             logger.error(f"Ошибка при резервном поиске: {backup_error}")
         return []
 
+def _extract_search_entries(ydl_opts: Dict, search_query: str) -> list:
+    """
+    Выполняет поиск yt-dlp (синхронно, в пуле потоков поиска)
+
+    Args:
+        ydl_opts: Параметры yt-dlp
+        search_query: Поисковый запрос yt-dlp (ytsearchN:...)
+
+    Returns:
+        list: Найденные записи
+    """
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        info = ydl.extract_info(search_query, download=False)
+    return [entry for entry in (info or {}).get('entries') or [] if entry]
+
 async def search_youtube_with_ytdlp(query: str, limit: int = 0) -> list:
     """
     Резервный метод поиска через yt-dlp.
@@ -511,46 +1351,53 @@ async def search_youtube_with_ytdlp(query: str, limit: int = 0) -> list:
         }
         
         results = []
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            try:
-                # Устанавливаем таймаут для всей операции
-                info = ydl.extract_info(search_query, download=False)
-                if 'entries' in info:
-                    for entry in info['entries']:
-                        # Проверяем, что это видео, а не плейлист
-                        if entry.get('_type') != 'playlist' and entry.get('id'):
-                            title = entry.get('title', 'Unknown Title')
-                            # Не используем название канала
-                            artist = ''
-                            duration_sec = entry.get('duration')
-                            
-                            # Форматируем длительность
-                            if duration_sec:
-                                # Преобразуем в целое число, если duration_sec - float
-                                duration_sec = int(duration_sec)
-                                
-                                # Проверяем длительность - исключаем файлы длиннее 15 минут (900 секунд)
-                                if duration_sec > 900:
-                                    logger.info(f"Исключен трек длительностью {duration_sec} сек: {title}")
-                                    continue
-                                    
-                                minutes = duration_sec // 60
-                                seconds = duration_sec % 60
-                                duration = f"{minutes}:{seconds:02d}"
-                            else:
-                                duration = "Unknown"
+        try:
+            # Запрос выполняется в пуле поиска с таймаутом, цикл событий не блокируется
+            entries = await search_executor.run(_extract_search_entries, ydl_opts, search_query)
+            for entry in entries:
+                # Проверяем, что это видео, а не плейлист
+                if entry.get('_type') != 'playlist' and entry.get('id'):
+                    title = entry.get('title', 'Unknown Title')
+                    # Не используем название канала
+                    artist = ''
+                    duration_sec = entry.get('duration')
+                    
+                    # Форматируем длительность
+                    if duration_sec:
+                        # Преобразуем в целое число, если duration_sec - float
+                        duration_sec = int(duration_sec)
+                        
+                        # Проверяем длительность - исключаем треки длиннее допустимой
+                        if duration_sec > MAX_TRACK_DURATION:
+                            logger.info(f"Исключен трек длительностью {duration_sec} сек: {title}")
+                            continue
                             
-                            # Форматируем для соответствия формату YTMusic API
-                            results.append({
-                                'title': title,
-                                'artist': artist,
-                                'duration': duration,
-                                'videoId': entry.get('id'),
-                                'url': f"https://www.youtube.com/watch?v={entry.get('id')}",
-                                'type': 'song'
-                            })
-            except Exception as search_error:
-                logger.warning(f"Ошибка при поиске: {search_error}")
+                        minutes = duration_sec // 60
+                        seconds = duration_sec % 60
+                        duration = f"{minutes}:{seconds:02d}"
+                    else:
+                        duration = "Unknown"
+                    
+                    # Запоминаем известные из поиска метаданные для последующей загрузки
+                    thumbnails = entry.get('thumbnails') or []
+                    metadata_cache.update(
+                        entry.get('id'),
+                        title=title,
+                        duration_sec=duration_sec or None,
+                        thumbnail=thumbnails[-1].get('url') if thumbnails else None
+                    )
+
+                    # Форматируем для соответствия формату YTMusic API
+                    results.append({
+                        'title': title,
+                        'artist': artist,
+                        'duration': duration,
+                        'videoId': entry.get('id'),
+                        'url': f"https://www.youtube.com/watch?v={entry.get('id')}",
+                        'type': 'song'
+                    })
+        except Exception as search_error:
+            logger.warning(f"Ошибка при поиске: {search_error}")
         
         logger.info(f"Найдено {len(results)} результатов через быстрый поиск yt-dlp")
         return results
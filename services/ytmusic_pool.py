@@ -0,0 +1,194 @@
+import asyncio
+import functools
+import logging
+import time
+from typing import Any, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from ytmusicapi import YTMusic
+
+from config import YTMUSIC_POOL_SIZE, YTMUSIC_CLIENT_MAX_AGE, YTMUSIC_HEALTH_CHECK_INTERVAL, YTMUSIC_REQUEST_TIMEOUT
+from services.search_executor import search_executor
+
+logger = logging.getLogger(__name__)
+
+# Язык результатов YouTube Music
+YTMUSIC_LANGUAGE = "ru"
+
+# Запрос проверки клиента: легкий запрос подсказок поиска, который заодно держит соединение открытым
+HEALTH_CHECK_QUERY = "music"
+
+class _PooledClient:
+    """Клиент YouTube Music из пула вместе со своей HTTP-сессией"""
+
+    def __init__(self, client: YTMusic, session: requests.Session):
+        self.client = client
+        self.session = session
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+
+    @property
+    def age(self) -> float:
+        """Возраст клиента в секундах"""
+        return time.monotonic() - self.created_at
+
+    def close(self) -> None:
+        """Закрывает соединения клиента"""
+        self.session.close()
+
+class YTMusicPool:
+    """
+    Пул долгоживущих клиентов YouTube Music.
+
+    Каждый клиент использует собственную сессию requests с keep-alive, поэтому TLS-соединение
+    и заголовки клиента (visitor id, который новый клиент получает отдельным запросом страницы
+    YouTube Music) переиспользуются между поисками: повторный поиск - это один запрос к API.
+    Клиент используется одним запросом одновременно, запросы выполняются в пуле потоков поиска
+    с таймаутом, не блокируя цикл событий. Клиент, запрос которого завершился ошибкой или
+    таймаутом, закрывается и заменяется новым.
+    Фоновая проверка периодически выполняет легкий запрос простаивающими клиентами (соединение
+    остается теплым, неисправные клиенты отбрасываются) и заменяет клиентов старше максимального
+    возраста заранее, чтобы поиск не ждал создания клиента.
+    """
+
+    def __init__(self, size: int, max_age: int, health_check_interval: int, request_timeout: int):
+        self._size = max(1, size)
+        self._max_age = max_age
+        self._health_check_interval = health_check_interval
+        self._request_timeout = request_timeout
+        self._semaphore = asyncio.Semaphore(self._size)
+        # Свободные клиенты: последний возвращенный используется первым (его соединение теплее)
+        self._idle: List[_PooledClient] = []
+        self._task: Optional[asyncio.Task] = None
+
+    def _create_client(self) -> _PooledClient:
+        """Создает клиента с собственной сессией (выполняется в пуле потоков поиска)"""
+        session = requests.Session()
+        # Одно соединение на клиента; повторяются только ошибки установки соединения
+        adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=1,
+            max_retries=Retry(total=2, connect=2, read=0, status=0, backoff_factor=0.2),
+        )
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        # Без таймаута по умолчанию (30 секунд) зависший запрос надолго занимает клиента
+        session.request = functools.partial(session.request, timeout=self._request_timeout)
+        client = YTMusic(language=YTMUSIC_LANGUAGE, requests_session=session)
+        return _PooledClient(client, session)
+
+    def _take_idle(self) -> Optional[_PooledClient]:
+        """Берет свободного клиента, устаревшие клиенты закрываются"""
+        while self._idle:
+            pooled = self._idle.pop()
+            if self._max_age and pooled.age > self._max_age:
+                pooled.close()
+                continue
+            return pooled
+        return None
+
+    def _put_idle(self, pooled: _PooledClient) -> None:
+        """Возвращает клиента в пул (лишний клиент сверх размера пула закрывается)"""
+        if len(self._idle) >= self._size:
+            pooled.close()
+            return
+        pooled.last_used = time.monotonic()
+        self._idle.append(pooled)
+
+    async def call(self, method: str, *args: Any, **kwargs: Any) -> Any:
+        """
+        Выполняет метод YTMusic свободным клиентом пула
+
+        Args:
+            method: Имя метода YTMusic (например, "search")
+            *args: Позиционные аргументы метода
+            **kwargs: Именованные аргументы метода
+
+        Returns:
+            Результат метода
+
+        Raises:
+            Exception: Ошибка запроса (клиент при этом заменяется)
+        """
+        async with self._semaphore:
+            pooled = self._take_idle() or await search_executor.run(self._create_client)
+            try:
+                result = await search_executor.run(getattr(pooled.client, method), *args, **kwargs)
+            except BaseException:
+                # Состояние соединения и заголовков клиента неизвестно (после таймаута запрос может
+                # еще выполняться в потоке) - клиент не возвращается в пул
+                pooled.close()
+                raise
+            self._put_idle(pooled)
+            return result
+
+    async def _check_client(self, pooled: _PooledClient) -> Optional[_PooledClient]:
+        """Проверяет простаивающего клиента; устаревший заменяется новым, неисправный отбрасывается"""
+        if self._max_age and pooled.age > self._max_age:
+            logger.info(f"Клиент YouTube Music заменяется по возрасту ({pooled.age:.0f} с)")
+            pooled.close()
+            pooled = await search_executor.run(self._create_client)
+        try:
+            await search_executor.run(pooled.client.get_search_suggestions, HEALTH_CHECK_QUERY)
+        except Exception as e:
+            logger.warning(f"Клиент YouTube Music не прошел проверку и будет заменен: {e}")
+            pooled.close()
+            return None
+        return pooled
+
+    async def health_check(self) -> None:
+        """
+        Проверяет клиентов, простаивающих дольше интервала проверки. Если пул пуст,
+        создает и прогревает одного клиента, чтобы первый поиск не ждал его создания.
+        """
+        if not self._idle:
+            async with self._semaphore:
+                checked = await self._check_client(await search_executor.run(self._create_client))
+                if checked is not None:
+                    self._put_idle(checked)
+            return
+
+        now = time.monotonic()
+        candidates = [pooled for pooled in self._idle if now - pooled.last_used >= self._health_check_interval]
+        for pooled in candidates:
+            # Проверяемый клиент занимает место в пуле, как обычный запрос
+            async with self._semaphore:
+                if pooled not in self._idle:
+                    # Клиент уже взят поиском
+                    continue
+                self._idle.remove(pooled)
+                checked = await self._check_client(pooled)
+                if checked is not None:
+                    self._put_idle(checked)
+
+    def start(self) -> None:
+        """Запускает фоновую проверку клиентов (и прогревает первого клиента)"""
+        if self._health_check_interval > 0 and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        """Цикл фоновой проверки"""
+        while True:
+            try:
+                await self.health_check()
+            except Exception as e:
+                logger.error(f"Ошибка при проверке клиентов YouTube Music: {e}")
+            await asyncio.sleep(self._health_check_interval)
+
+    async def stop(self) -> None:
+        """Останавливает фоновую проверку и закрывает соединения клиентов"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        while self._idle:
+            self._idle.pop().close()
+
+# Создаем глобальный пул клиентов YouTube Music
+ytmusic_pool = YTMusicPool(
+    YTMUSIC_POOL_SIZE, YTMUSIC_CLIENT_MAX_AGE, YTMUSIC_HEALTH_CHECK_INTERVAL, YTMUSIC_REQUEST_TIMEOUT
+)